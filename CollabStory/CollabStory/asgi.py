@@ -19,6 +19,15 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "CollabStory.settings")
 # is populated before importing code that may import ORM models.
 django_asgi_app = get_asgi_application()
 
+from django.core.signals import request_finished
+from CollabStory.db import close_request_connections
+
+# Every request runs on a short-lived thread of its own, so its connection
+# cannot be reused and is closed here. The WebSocket consumers and the async
+# views' read pool keep persistent connections; for the per-request ones use
+# PgBouncer with DB_TRANSACTION_POOLING (see CollabStory/db.py)
+request_finished.connect(close_request_connections)
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
@@ -0,0 +1,16 @@
+"""
+Celery application for CollabStory.
+
+Start a worker with ``celery -A CollabStory worker``. Tasks are discovered from
+each installed app's ``tasks.py`` module.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "CollabStory.settings")
+
+app = Celery("CollabStory")
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
@@ -0,0 +1,72 @@
+"""
+System checks for the static asset pipeline.
+
+In production ``collectstatic`` writes each asset under a content-hashed
+name, plus gzip and brotli copies, and WhiteNoise serves the hashed names
+with immutable caching. Only ``{% static %}`` knows the hashed names, so a
+template that links ``/static/...`` directly gets an unhashed file that
+clients revalidate on every load, and a ``{% static %}`` path that no
+finder knows fails when the manifest is looked up. ``check_static_references``
+reports both; it runs with ``manage.py check`` and before ``collectstatic``.
+"""
+
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.checks import Error, Tags, register
+from django.template import engines
+
+TEMPLATE_EXTENSIONS = ('.html', '.txt', '.xml')
+
+STATIC_TAG = re.compile(r"""\{%\s*static\s+(["'])(?P<path>[^"']+)\1""")
+
+
+def literal_static_url():
+    # A quoted (or url()-wrapped) path under STATIC_URL, with or without the leading slash
+    prefix = re.escape(settings.STATIC_URL.strip('/'))
+    return re.compile(rf"""[\"'(]\s*(?P<url>/?{prefix}/[^\"'\s)]*)""")
+
+
+def project_templates():
+    """Template files that belong to this project rather than to installed packages"""
+    root = os.path.realpath(settings.BASE_DIR)
+    for engine in engines.all():
+        for directory in getattr(engine, 'template_dirs', []):
+            directory = os.path.realpath(directory)
+            if os.path.commonpath([root, directory]) != root:
+                continue
+            for dirpath, _, filenames in os.walk(directory):
+                for filename in sorted(filenames):
+                    if filename.endswith(TEMPLATE_EXTENSIONS):
+                        yield os.path.join(dirpath, filename)
+
+
+@register(Tags.staticfiles, Tags.templates)
+def check_static_references(app_configs=None, **kwargs):
+    """Templates must reference local assets through {% static %}, and only ones that exist"""
+    errors = []
+    literal = literal_static_url()
+    for template in project_templates():
+        with open(template, encoding='utf-8') as file:
+            source = file.read()
+        relative = os.path.relpath(template, settings.BASE_DIR)
+        for match in literal.finditer(source):
+            line = source.count('\n', 0, match.start()) + 1
+            errors.append(Error(
+                f"{relative}:{line} links {match.group('url')} directly, bypassing the hashed file name.",
+                hint="Use {% static '...' %} so the manifest's hashed name is served.",
+                obj=relative,
+                id='CollabStory.E001',
+            ))
+        for match in STATIC_TAG.finditer(source):
+            if finders.find(match.group('path')) is None:
+                line = source.count('\n', 0, match.start()) + 1
+                errors.append(Error(
+                    f"{relative}:{line} references static file {match.group('path')!r}, which no finder can locate.",
+                    hint="It would be missing from the manifest; fix the path or add the file.",
+                    obj=relative,
+                    id='CollabStory.E002',
+                ))
+    return errors
@@ -0,0 +1,108 @@
+"""
+Database connection reuse for the WSGI and ASGI deployments.
+
+Django keeps one connection per thread and reuses it for ``CONN_MAX_AGE``
+seconds, checking it with a cheap query first when ``CONN_HEALTH_CHECKS`` is
+on. That check and the max-age expiry only run when a request starts or ends
+on that thread, which leaves two gaps under ASGI:
+
+- Each HTTP request's sync code runs on a thread of its own that ends with
+  the request, so a persistent connection is never reused and lingers until
+  garbage collection. ``close_request_connections`` (connected by asgi.py)
+  closes it as the request finishes. That connection is therefore not
+  pooled here, whatever ``CONN_MAX_AGE`` says: reach Postgres through
+  PgBouncer in transaction mode and set ``DB_TRANSACTION_POOLING`` to pool
+  it. The async views keep it to one per request by making their reads on
+  the read pool below.
+- Socket consumers run their ORM calls on one shared thread that never sees
+  a request, so its connection would never be checked or expire.
+  ``recycle_connections`` applies the same check from consumer handlers, on
+  that thread, at most every ``RECYCLE_INTERVAL`` seconds.
+
+All sockets of a process therefore share one database connection and one
+thread, however many of them are open.
+
+Async views can also run independent reads at the same time with
+``gather_reads``. The reads run on a pool of ``ASYNC_READ_THREADS`` threads
+that lasts as long as the process, so each thread keeps its connection from
+one request to the next, with the usual health check and max-age applied
+around every read. A story page therefore reuses up to that many
+connections instead of opening one per read.
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+RECYCLE_INTERVAL = 5.0
+
+_recycled_at = float('-inf')
+
+_read_executor = None
+_read_executor_lock = threading.Lock()
+
+
+def close_request_connections(**kwargs):
+    """request_finished receiver for ASGI: the request's thread, and its connection, will not be reused"""
+    connections.close_all()
+
+
+async def recycle_connections(clock=time.monotonic):
+    """Close the consumer thread's connection if it is broken or past CONN_MAX_AGE"""
+    global _recycled_at
+    now = clock()
+    if now - _recycled_at < RECYCLE_INTERVAL:
+        return
+    _recycled_at = now
+    # Thread-sensitive, so it runs on the thread the async ORM uses
+    await sync_to_async(close_old_connections)()
+
+
+def get_read_executor():
+    """Return the shared thread pool that gather_reads runs reads on"""
+    global _read_executor
+    with _read_executor_lock:
+        if _read_executor is None:
+            _read_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ASYNC_READ_THREADS', 8),
+                thread_name_prefix='collabstory-read',
+            )
+        return _read_executor
+
+
+def _pooled_read(read):
+    # What request_started and request_finished do for a request's thread:
+    # drop a broken or expired connection, and keep a healthy one
+    close_old_connections()
+    try:
+        return read()
+    finally:
+        close_old_connections()
+
+
+def _in_transaction():
+    return any(connection.in_atomic_block for connection in connections.all(initialized_only=True))
+
+
+async def gather_reads(*reads):
+    """
+    Run independent read-only callables concurrently and return their results in order
+
+    Inside a transaction they run one after another on the caller's
+    connection instead, so they see its uncommitted writes.
+    """
+    if await sync_to_async(_in_transaction)():
+        return [await sync_to_async(read)() for read in reads]
+    loop = asyncio.get_running_loop()
+    executor = get_read_executor()
+    # A copy of the context per read, as sync_to_async makes, so replica
+    # routing and request timings carry over to the pool threads
+    return await asyncio.gather(*(
+        loop.run_in_executor(executor, contextvars.copy_context().run, _pooled_read, read) for read in reads
+    ))
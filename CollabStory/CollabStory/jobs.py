@@ -0,0 +1,106 @@
+"""
+Background job dispatch for CollabStory.
+
+Jobs are ordinary Celery tasks. ``JOB_BACKEND = "celery"`` sends them to the
+broker for a worker to pick up; ``JOB_BACKEND = "thread"`` runs them on an
+in-process thread pool, which is what the test suite and single-process
+development servers use.
+
+A task can register an async version of itself with ``async_body``. The
+thread backend runs that version on a single event loop thread instead of
+the pool, so jobs that mostly wait on the network (AI suggestions) do not
+each hold a pool thread while they wait. Their ORM calls still run on a
+thread of their own per job, which closes its connection when the job ends.
+"""
+
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, connections
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_loop = None
+
+# Task name -> coroutine function the thread backend runs instead
+_async_bodies = {}
+
+
+def async_body(task):
+    """Register the decorated coroutine function as ``task``'s body for the thread backend"""
+    def decorator(coroutine_function):
+        _async_bodies[task.name] = coroutine_function
+        return coroutine_function
+    return decorator
+
+
+def get_executor():
+    """Return the shared thread pool used by the thread job backend"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'JOB_THREAD_WORKERS', 4),
+                thread_name_prefix='collabstory-job',
+            )
+        return _executor
+
+
+def get_event_loop():
+    """Return the event loop the thread job backend runs async job bodies on"""
+    global _loop
+    with _executor_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='collabstory-job-loop', daemon=True).start()
+        return _loop
+
+
+def _run_in_thread(task, args, kwargs):
+    close_old_connections()
+    try:
+        return task(*args, **kwargs)
+    except Exception:
+        logger.exception("Background job %s failed", task.name)
+        raise
+    finally:
+        # Pool threads outlive the job, so never leave a connection open
+        connections.close_all()
+
+
+async def _run_in_loop(task, body, args, kwargs):
+    async with ThreadSensitiveContext():
+        await sync_to_async(close_old_connections)()
+        try:
+            return await body(*args, **kwargs)
+        except Exception:
+            logger.exception("Background job %s failed", task.name)
+            raise
+        finally:
+            # The context's thread ends with the job
+            await sync_to_async(connections.close_all)()
+
+
+def submit(task, *args, **kwargs):
+    """Run a Celery task in the background using the configured job backend"""
+    backend = getattr(settings, 'JOB_BACKEND', 'celery')
+    if backend == 'celery':
+        return task.delay(*args, **kwargs)
+    if backend == 'thread':
+        body = _async_bodies.get(task.name)
+        if body is not None:
+            # Start from an empty context, as a pool thread would, rather
+            # than inherit the request's (asgiref keeps its executors there)
+            return contextvars.Context().run(
+                asyncio.run_coroutine_threadsafe, _run_in_loop(task, body, args, kwargs), get_event_loop()
+            )
+        return get_executor().submit(_run_in_thread, task, args, kwargs)
+    raise ImproperlyConfigured(f"Unknown JOB_BACKEND {backend!r}; expected 'celery' or 'thread'")
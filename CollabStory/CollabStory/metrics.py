@@ -0,0 +1,472 @@
+"""
+Prometheus metrics for capacity planning, served at ``/metrics``.
+
+Counters, gauges and histograms keep one shard of values per thread, so
+recording a sample only updates a dict that no other thread writes and takes
+no lock. Collecting sums the shards; shards of threads that have exited are
+folded into a retired total so short-lived worker threads do not pile up.
+
+A worker process only sees its own samples. With
+``METRICS['MULTIPROCESS_DIR']`` set, every process also writes a snapshot to
+``<pid>-<token>.json`` in that directory every ``FLUSH_INTERVAL`` seconds and
+at exit, and ``/metrics`` adds up the snapshots of all processes: counters
+and histograms including those of processes that have exited, so totals
+never go backwards, and gauges only for processes that are still running.
+Clear the directory when deploying, as with prometheus_client's
+multiprocess mode.
+
+Values read at scrape time, such as the channel layer's queue depth, are
+registered with ``REGISTRY.register_callback``. They are not written to the
+snapshots because every process would report the same shared queue.
+"""
+
+import atexit
+import bisect
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+VIEW_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+AI_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_config = None
+
+
+def get_config():
+    global _config
+    if _config is None:
+        config = getattr(settings, 'METRICS', {})
+        _config = {
+            'TOKEN': config.get('TOKEN'),
+            'MULTIPROCESS_DIR': config.get('MULTIPROCESS_DIR'),
+            'FLUSH_INTERVAL': config.get('FLUSH_INTERVAL', 5.0),
+        }
+    return _config
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    global _config
+    if setting == 'METRICS':
+        _config = None
+
+
+def _add(current, value):
+    # Histogram values are lists of bucket counts followed by the sum
+    if isinstance(current, list):
+        return [a + b for a, b in zip(current, value)]
+    return current + value
+
+
+def _merge(target, samples):
+    for key, value in samples.items():
+        current = target.get(key)
+        if current is None:
+            target[key] = list(value) if isinstance(value, list) else value
+        else:
+            target[key] = _add(current, value)
+
+
+class Metric:
+    """A named metric whose samples are keyed by a tuple of label values"""
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.reset()
+
+    def reset(self):
+        """Drop every sample; also used in a freshly forked child, so takes no lock"""
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+
+    def _values(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+            self._local.values = values
+            _ensure_flusher()
+            return values
+
+    def samples(self):
+        """Label values -> value, summed over every thread"""
+        total = {}
+        with self._lock:
+            live = []
+            for thread, values in self._shards:
+                if thread.is_alive():
+                    live.append((thread, values))
+                else:
+                    # The thread is gone so nothing writes its shard any more
+                    _merge(self._retired, values)
+            self._shards = live
+            _merge(total, self._retired)
+            for _, values in live:
+                _merge(total, dict(values))
+        return total
+
+    def family(self):
+        return {'type': self.kind, 'help': self.help, 'labels': list(self.labels), 'samples': self.samples()}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        values = self._values()
+        values[labels] = values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        values = self._values()
+        values[labels] = values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self):
+        # Rooms everyone has left would otherwise be reported forever
+        return {key: value for key, value in super().samples().items() if value}
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=VIEW_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text, labels)
+
+    def observe(self, value, *labels):
+        values = self._values()
+        counts = values.get(labels)
+        if counts is None:
+            counts = values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def family(self):
+        return {**super().family(), 'buckets': list(self.buckets)}
+
+
+class Registry:
+    """Every metric of the process, plus callbacks evaluated at scrape time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._callbacks = {}
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics or metric.name in self._callbacks:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=VIEW_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def register_callback(self, name, help_text, func, kind='gauge', labels=()):
+        """``func()`` returns {label values: value} whenever metrics are scraped"""
+        with self._lock:
+            self._callbacks[name] = {'type': kind, 'help': help_text, 'labels': list(labels), 'func': func}
+
+    def reset(self):
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+    def snapshot(self):
+        """Families of this process's recorded metrics, without callbacks"""
+        families = {}
+        for name, metric in list(self._metrics.items()):
+            family = metric.family()
+            family['samples'] = {tuple(str(value) for value in key): value for key, value in family['samples'].items()}
+            families[name] = family
+        return families
+
+    def collect(self):
+        families = self.snapshot()
+        for name, callback in list(self._callbacks.items()):
+            try:
+                samples = callback['func']()
+            except Exception as e:
+                # Typically the channel layer being unreachable; leave the metric out
+                logger.warning("Metrics callback %s failed: %s", name, e)
+                continue
+            families[name] = {
+                'type': callback['type'],
+                'help': callback['help'],
+                'labels': callback['labels'],
+                'samples': {tuple(str(value) for value in key): value for key, value in samples.items()},
+            }
+        return families
+
+
+REGISTRY = Registry()
+
+
+# Multi-process aggregation
+
+_token = uuid.uuid4().hex
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def snapshot_path(directory):
+    return Path(directory) / f'{os.getpid()}-{_token}.json'
+
+
+def write_snapshot(directory):
+    path = snapshot_path(directory)
+    families = {
+        name: {**family, 'samples': [[list(key), value] for key, value in family['samples'].items()]}
+        for name, family in REGISTRY.snapshot().items()
+    }
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps({'pid': os.getpid(), 'metrics': families}))
+    # Readers never see a half-written snapshot
+    os.replace(temporary, path)
+
+
+def flush():
+    """Write this process's snapshot to the multiprocess directory, if one is configured"""
+    directory = get_config()['MULTIPROCESS_DIR']
+    if directory:
+        try:
+            write_snapshot(directory)
+        except OSError:
+            logger.warning("Could not write metrics snapshot to %s", directory, exc_info=True)
+
+
+def _flush_forever():
+    while True:
+        time.sleep(get_config()['FLUSH_INTERVAL'])
+        flush()
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None and get_config()['MULTIPROCESS_DIR']:
+        with _flusher_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_forever, name='metrics-flush', daemon=True)
+                _flusher.start()
+                atexit.register(flush)
+
+
+def _after_fork_in_child():
+    # A forked worker starts from zero under its own snapshot file instead of
+    # repeating the parent's samples; its flusher starts on first use
+    global _token, _flusher, _flusher_lock
+    _token = uuid.uuid4().hex
+    _flusher = None
+    _flusher_lock = threading.Lock()
+    REGISTRY.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect_all():
+    """This process's families plus the snapshots of every other process"""
+    families = REGISTRY.collect()
+    directory = get_config()['MULTIPROCESS_DIR']
+    if not directory:
+        return families
+    own = snapshot_path(directory)
+    for path in sorted(Path(directory).glob('*.json')):
+        if path == own:
+            continue
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            # Removed or unreadable; the next scrape will see its replacement
+            continue
+        alive = _pid_alive(data['pid'])
+        for name, family in data['metrics'].items():
+            if family['type'] == 'gauge' and not alive:
+                continue
+            target = families.setdefault(name, {**family, 'samples': {}})
+            _merge(target['samples'], {tuple(key): value for key, value in family['samples']})
+    return families
+
+
+# Prometheus text format
+
+def _format(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def render(families):
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        labels = tuple(family['labels'])
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for key in sorted(family['samples']):
+            value = family['samples'][key]
+            if family['type'] != 'histogram':
+                lines.append(f'{name}{_label_text(labels, key)} {_format(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip([*map(repr, map(float, family['buckets'])), '+Inf'], value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_label_text(labels + ("le",), key + (bound,))} {cumulative}')
+            lines.append(f'{name}_sum{_label_text(labels, key)} {repr(float(value[-1]))}')
+            lines.append(f'{name}_count{_label_text(labels, key)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def render_metrics():
+    return render(collect_all())
+
+
+def timed(histogram, *labels):
+    """Decorator observing how long each call of a view takes"""
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await view(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, *labels)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+        return wrapper
+    return decorator
+
+
+# Channel layer queue depth
+
+def _redis_queue_depth(host, prefix):
+    import redis
+
+    host = dict(host)
+    host.setdefault('socket_timeout', 1.0)
+    if 'address' in host:
+        client = redis.Redis.from_url(host.pop('address'), **host)
+    elif 'host' in host:
+        client = redis.Redis(**host)
+    else:
+        # Sentinel setups are not scraped
+        return 0
+    with client:
+        # Channel keys are sorted sets of pending messages; group keys list members instead
+        keys = [key for key in client.scan_iter(match=f'{prefix}*', count=1000) if b':group:' not in key]
+        pipeline = client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.zcard(key)
+        return sum(pipeline.execute())
+
+
+def channel_layer_queue_depth():
+    layer = get_channel_layer()
+    if layer is None:
+        return {}
+    channels = getattr(layer, 'channels', None)
+    if isinstance(channels, dict):
+        # InMemoryChannelLayer keeps a queue per channel
+        return {(): sum(queue.qsize() for queue in list(channels.values()))}
+    hosts = getattr(layer, 'hosts', None)
+    prefix = getattr(layer, 'prefix', None)
+    if not hosts or prefix is None:
+        return {}
+    return {(): sum(_redis_queue_depth(host, prefix) for host in hosts)}
+
+
+# What the project records
+
+WEBSOCKET_CONNECTIONS = REGISTRY.gauge(
+    'collabstory_websocket_connections', "Open story sockets per room", ['story']
+)
+GROUP_SENDS = REGISTRY.counter(
+    'collabstory_group_sends_total', "Messages sent to story room groups", ['type']
+)
+AI_CALL_DURATION = REGISTRY.histogram(
+    'collabstory_ai_call_duration_seconds', "AI provider call latency", ['prompt_type'], AI_BUCKETS
+)
+AI_CALL_FAILURES = REGISTRY.counter(
+    'collabstory_ai_call_failures_total', "Failed or refused AI provider calls", ['prompt_type', 'error']
+)
+AI_CACHE_LOOKUPS = REGISTRY.counter(
+    'collabstory_ai_cache_lookups_total', "AI suggestion cache lookups by result: hit, miss or coalesced", ['result']
+)
+AI_CACHE_UPSTREAM_CALLS = REGISTRY.counter(
+    'collabstory_ai_cache_upstream_calls_total', "AI provider calls made for suggestion cache misses"
+)
+AI_CACHE_EVICTIONS = REGISTRY.counter(
+    'collabstory_ai_cache_evictions_total', "AI suggestion cache entries evicted when the cache was full"
+)
+NODES_APPENDED = REGISTRY.counter(
+    'collabstory_story_nodes_appended_total', "Story nodes added by writers"
+)
+VIEW_DURATION = REGISTRY.histogram(
+    'collabstory_view_duration_seconds', "Latency of hot views", ['view']
+)
+REGISTRY.register_callback(
+    'collabstory_channel_layer_queue_depth', "Messages waiting in channel layer queues", channel_layer_queue_depth
+)
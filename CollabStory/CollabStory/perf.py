@@ -0,0 +1,201 @@
+"""
+Per-request performance instrumentation for CollabStory.
+
+``PerfMiddleware`` and the ``instrumented`` decorator for consumer handlers
+open a ``Timings`` record for the duration of a request or handler call. SQL
+statements, suggestion cache lookups and AI provider calls add to the
+current record through a context variable, which asgiref copies across
+``sync_to_async`` and ``async_to_sync``, so the same record collects work
+done on the event loop and in worker threads under both WSGI and ASGI.
+
+Finished HTTP requests get a ``Server-Timing`` header; a ``SAMPLE_RATE``
+fraction of requests and handler calls is also logged as a structured
+``perf`` line. With ``PERF_INSTRUMENTATION['ENABLED']`` off the middleware
+removes itself, no SQL wrapper is installed, and the recording hooks return
+after a single context variable lookup.
+"""
+
+import functools
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import setting_changed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('perf_timings', default=None)
+_config = None
+
+
+class Timings:
+    """What one request or handler call spent its time on"""
+
+    __slots__ = ('started', 'sql_count', 'sql_time', 'cache_hits', 'cache_misses', 'ai_calls', 'ai_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.ai_calls = 0
+        self.ai_time = 0.0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Format as a Server-Timing header value; durations in milliseconds"""
+        return ', '.join([
+            f'total;dur={self.elapsed() * 1000:.1f}',
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.sql_count} queries"',
+            f'cache;desc="{self.cache_hits} hits {self.cache_misses} misses"',
+            f'ai;dur={self.ai_time * 1000:.1f};desc="{self.ai_calls} calls"',
+        ])
+
+    def fields(self):
+        return {
+            'wall_ms': round(self.elapsed() * 1000, 1),
+            'sql_count': self.sql_count,
+            'sql_ms': round(self.sql_time * 1000, 1),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'ai_calls': self.ai_calls,
+            'ai_ms': round(self.ai_time * 1000, 1),
+        }
+
+
+def get_config():
+    global _config
+    if _config is None:
+        config = getattr(settings, 'PERF_INSTRUMENTATION', {})
+        _config = {
+            'ENABLED': config.get('ENABLED', False),
+            'SAMPLE_RATE': config.get('SAMPLE_RATE', 0.01),
+            'SERVER_TIMING': config.get('SERVER_TIMING', True),
+        }
+    return _config
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    global _config
+    if setting == 'PERF_INSTRUMENTATION':
+        _config = None
+
+
+def record_cache(hit):
+    timings = _current.get()
+    if timings is not None:
+        if hit:
+            timings.cache_hits += 1
+        else:
+            timings.cache_misses += 1
+
+
+def record_ai_call(seconds):
+    timings = _current.get()
+    if timings is not None:
+        timings.ai_calls += 1
+        timings.ai_time += seconds
+
+
+def _time_sql(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.sql_time += time.perf_counter() - started
+        timings.sql_count += 1
+
+
+def install_sql_timer(connection):
+    if _time_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_sql)
+
+
+@receiver(connection_created)
+def _instrument_new_connection(connection, **kwargs):
+    if get_config()['ENABLED']:
+        install_sql_timer(connection)
+
+
+def log_sample(kind, target, timings, **extra):
+    if random.random() >= get_config()['SAMPLE_RATE']:
+        return
+    fields = {'kind': kind, 'target': target, **extra, **timings.fields()}
+    logger.info("perf %s", " ".join(f"{key}={value}" for key, value in fields.items()), extra=fields)
+
+
+class PerfMiddleware:
+    """Time each request; add a Server-Timing header and log a sample"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_config()['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        # Connections opened before this point missed connection_created
+        for connection in connections.all(initialized_only=True):
+            install_sql_timer(connection)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = Timings()
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = Timings()
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        if get_config()['SERVER_TIMING']:
+            response['Server-Timing'] = timings.server_timing()
+        match = getattr(request, 'resolver_match', None)
+        log_sample(
+            'http', match.view_name if match else request.path, timings,
+            method=request.method, status=response.status_code
+        )
+        return response
+
+
+def instrumented(handler):
+    """Record timings for an async consumer handler, like PerfMiddleware does for views"""
+    @functools.wraps(handler)
+    async def wrapper(self, *args, **kwargs):
+        if not get_config()['ENABLED']:
+            return await handler(self, *args, **kwargs)
+        timings = Timings()
+        token = _current.set(timings)
+        try:
+            return await handler(self, *args, **kwargs)
+        finally:
+            _current.reset(token)
+            log_sample('websocket', f'{type(self).__name__}.{handler.__name__}', timings)
+    return wrapper
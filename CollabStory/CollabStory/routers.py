@@ -0,0 +1,202 @@
+"""
+Primary/replica database routing.
+
+Writes go to ``default``. Reads go to one of
+``READ_REPLICAS['ALIASES']`` only inside a request handled by
+``ReplicaRoutingMiddleware``; management commands, background jobs and
+socket consumers read from the primary, since they usually read in order to
+write. Objects loaded from some other database alias keep using it, as
+without a router.
+
+Within a request, reads switch to the primary (the request is "pinned"):
+
+- for unsafe methods (POST, PUT, PATCH, DELETE), from the start;
+- for admin views;
+- from the first INSERT, UPDATE or DELETE the request runs;
+- inside ``use_primary()``.
+
+A request that wrote also sets a short-lived cookie. The user's requests keep
+reading from the primary until it expires ``STICKY_SECONDS`` later, so they
+see their own changes even while the replicas lag behind. Models of
+``PRIMARY_APPS`` (sessions and the admin log by default) are always read
+from the primary.
+"""
+
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_state = ContextVar('replica_routing', default=None)
+_config = None
+
+
+def get_config():
+    global _config
+    if _config is None:
+        config = getattr(settings, 'READ_REPLICAS', {})
+        _config = {
+            'ALIASES': list(config.get('ALIASES', [])),
+            'STICKY_SECONDS': config.get('STICKY_SECONDS', 10),
+            'PRIMARY_APPS': set(config.get('PRIMARY_APPS', ['admin', 'sessions'])),
+            'COOKIE': config.get('COOKIE', 'db_primary'),
+        }
+    return _config
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    global _config
+    if setting == 'READ_REPLICAS':
+        _config = None
+
+
+class RoutingState:
+    """Whether the current request must read from the primary, and whether it wrote"""
+
+    __slots__ = ('pinned', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside the block (or decorated function)"""
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    pinned = state.pinned
+    state.pinned = True
+    try:
+        yield
+    finally:
+        # Writes made inside the block keep the request pinned
+        state.pinned = pinned or state.wrote
+
+
+class PrimaryReplicaRouter:
+    @staticmethod
+    def hinted_db(hints):
+        instance = hints.get('instance')
+        return instance._state.db if instance is not None else None
+
+    def db_for_read(self, model, **hints):
+        config = get_config()
+        hinted = self.hinted_db(hints)
+        if hinted is not None and hinted != DEFAULT_DB_ALIAS and hinted not in config['ALIASES']:
+            # Some other database, such as a benchmark's scratch copy
+            return hinted
+        state = _state.get()
+        if state is None or state.pinned:
+            return DEFAULT_DB_ALIAS
+        if not config['ALIASES'] or model._meta.app_label in config['PRIMARY_APPS']:
+            return DEFAULT_DB_ALIAS
+        if hinted is not None:
+            # Follow relations on the database the instance came from
+            return hinted
+        return random.choice(config['ALIASES'])
+
+    def db_for_write(self, model, **hints):
+        hinted = self.hinted_db(hints)
+        if hinted is not None and hinted != DEFAULT_DB_ALIAS and hinted not in get_config()['ALIASES']:
+            return hinted
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_config()['ALIASES']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in get_config()['ALIASES']:
+            return False
+        return None
+
+
+def _track_writes(execute, sql, params, many, context):
+    state = _state.get()
+    if state is not None and not state.wrote and sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+        state.wrote = state.pinned = True
+    return execute(sql, params, many, context)
+
+
+def install_write_tracker(connection):
+    if _track_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_track_writes)
+
+
+@receiver(connection_created)
+def _track_new_connection(connection, **kwargs):
+    if connection.alias == DEFAULT_DB_ALIAS and get_config()['ALIASES']:
+        install_write_tracker(connection)
+
+
+class ReplicaRoutingMiddleware:
+    """Route the request's reads to a replica unless it writes or recently wrote"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_config()['ALIASES']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        # Connections opened before this point missed connection_created
+        for connection in connections.all(initialized_only=True):
+            if connection.alias == DEFAULT_DB_ALIAS:
+                install_write_tracker(connection)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.start(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        state = self.start(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(response, state)
+
+    def start(self, request):
+        return RoutingState(
+            pinned=request.method not in SAFE_METHODS or get_config()['COOKIE'] in request.COOKIES
+        )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _state.get()
+        if state is not None and 'admin' in request.resolver_match.namespaces:
+            state.pinned = True
+
+    def finish(self, response, state):
+        if state.wrote:
+            config = get_config()
+            response.set_cookie(
+                config['COOKIE'], '1', max_age=config['STICKY_SECONDS'], httponly=True, samesite='Lax'
+            )
+        return response
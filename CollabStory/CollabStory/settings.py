@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import warnings
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -41,6 +42,8 @@ INSTALLED_APPS = [
     "django.contrib.contenttypes",
     "django.contrib.sessions",
     "django.contrib.messages",
+    # runserver leaves static files to WhiteNoise too, as in production
+    "whitenoise.runserver_nostatic",
     "django.contrib.staticfiles",
     "channels",
     "stories",
@@ -51,7 +54,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "CollabStory.perf.PerfMiddleware",
+    "CollabStory.routers.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -88,9 +94,57 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Reuse each thread's connection, checking it is still alive first.
+        # Under ASGI this covers WebSockets and the async views' read pool;
+        # the rest of each HTTP request opens a connection of its own (see
+        # CollabStory/db.py)
+        "CONN_MAX_AGE": int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Set DB_TRANSACTION_POOLING when Postgres is reached through PgBouncer in
+# transaction mode, which pools the per-request connections of ASGI HTTP
+# requests. Server-side cursors (used by .iterator()) do not survive that
+# mode, so they are turned off for every alias
+DB_TRANSACTION_POOLING = os.getenv('DB_TRANSACTION_POOLING', 'False').lower() in ('true', '1', 'yes')
+DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = DB_TRANSACTION_POOLING
+
+# Read replicas (see CollabStory/routers.py). DATABASE_REPLICA names a second
+# SQLite file, refreshed from the primary with `manage.py sync_replicas`; for a
+# Postgres standby add its entry to DATABASES instead. Every alias besides
+# "default" takes reads from request handlers, except for STICKY_SECONDS after
+# a user writes and for PRIMARY_APPS.
+if os.getenv('DATABASE_REPLICA'):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": os.getenv('DATABASE_REPLICA'),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ['CollabStory.routers.PrimaryReplicaRouter']
+
+READ_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': 10,
+    'PRIMARY_APPS': ['admin', 'sessions'],
+    'COOKIE': 'db_primary',
+}
+
+# Opt-in tuning for the SQLite database (see CollabStory/sqlite.py): WAL,
+# relaxed fsync, mmap and a larger page cache, waiting BUSY_TIMEOUT ms for the
+# write lock, and socket consumer writes queued on one writer thread per
+# process. Compare with the defaults using `manage.py benchmark_sqlite`.
+SQLITE_PROFILE = {
+    'ENABLED': os.getenv('SQLITE_PROFILE', 'False').lower() in ('true', '1', 'yes'),
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',
+    'MMAP_SIZE': 256 * 1024 * 1024,
+    'CACHE_SIZE': -64000,  # negative values are KiB, so 64 MB
+    'BUSY_TIMEOUT': 5000,  # milliseconds
+    'SERIALIZE_WRITES': True,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -130,6 +184,11 @@ STATIC_URL = "static/"
 STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
+STATIC_ROOT = BASE_DIR / "staticfiles"
+if DEBUG:
+    # WhiteNoise serves straight from the finders in DEBUG; collectstatic is
+    # only needed for deploys, so a missing STATIC_ROOT is expected
+    warnings.filterwarnings("ignore", message="No directory at: .*staticfiles", category=UserWarning)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -150,9 +209,187 @@ CHANNEL_LAYERS = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads are stored once per distinct content, named by its hash (see
+# stories/storage.py), and always stream to a temporary file rather than memory.
+# Outside DEBUG, collectstatic writes content-hashed static files with gzip and
+# brotli copies next to them, which WhiteNoise serves with immutable caching;
+# CollabStory/checks.py keeps templates on the hashed names.
+STORAGES = {
+    'default': {'BACKEND': 'stories.storage.ContentAddressedStorage'},
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+        else 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+# Serve MEDIA_URL from the app outside DEBUG too, with immutable caching
+SERVE_MEDIA = os.getenv('SERVE_MEDIA', 'False').lower() in ('true', '1', 'yes')
+
+# Story covers are validated and re-rendered in the background into WebP and
+# JPEG derivatives of each SIZE (see stories/covers.py)
+COVER_IMAGES = {
+    'SIZES': [(360, 200), (720, 400), (1080, 600)],
+    'FORMATS': {'WEBP': 80, 'JPEG': 82},
+    'MAX_UPLOAD_SIZE': 10 * 1024 * 1024,
+    'MAX_PIXELS': 40_000_000,
+}
+
+# Completed public stories are pre-rendered to static HTML (plus gzip and
+# brotli copies) in DIRECTORY and served without database queries (see
+# stories/snapshots.py)
+STORY_SNAPSHOTS = {
+    'ENABLED': True,
+    'DIRECTORY': BASE_DIR / 'snapshots',
+    'MAX_AGE': 300,
+}
+
+# Multi-story export archives are deleted, and their stored files released,
+# TTL_DAYS after they finish (see stories/export.py)
+STORY_EXPORT_RETENTION = {
+    'TTL_DAYS': int(os.getenv('STORY_EXPORT_TTL_DAYS', '7')),
+    'BATCH_SIZE': 100,
+}
+
 # AI Configuration
+# "gemini" uses Google Gemini; "simulated" generates deterministic text offline
+AI_PROVIDER = os.getenv('AI_PROVIDER', 'gemini')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', 'your-gemini-api-key-here')
 
+# Simulated provider: text is seeded from SEED and the prompt; LATENCY is
+# "fixed", "uniform" (MEDIAN +/- SPREAD) or "lognormal" (SPREAD is sigma).
+# ERROR_RATE and TIMEOUT_RATE are the fractions of calls that fail.
+AI_SIMULATED_PROVIDER = {
+    'SEED': int(os.getenv('AI_SIMULATED_SEED', '0')),
+    'WORDS': 40,
+    'WORDS_JITTER': 10,
+    'CHUNK_WORDS': 4,
+    'LATENCY': os.getenv('AI_SIMULATED_LATENCY', 'lognormal'),
+    'LATENCY_MEDIAN': float(os.getenv('AI_SIMULATED_LATENCY_MEDIAN', '0.8')),
+    'LATENCY_SPREAD': 0.5,
+    'FIRST_CHUNK_SHARE': 0.3,
+    'ERROR_RATE': float(os.getenv('AI_SIMULATED_ERROR_RATE', '0')),
+    'TIMEOUT_RATE': float(os.getenv('AI_SIMULATED_TIMEOUT_RATE', '0')),
+}
+
+# Provider client: timeouts in seconds, concurrent upstream calls, retries with
+# jittered backoff, and the circuit breaker that switches to fallbacks
+AI_PROVIDER_CLIENT = {
+    'CONNECT_TIMEOUT': float(os.getenv('AI_CONNECT_TIMEOUT', '3')),
+    'READ_TIMEOUT': float(os.getenv('AI_READ_TIMEOUT', '15')),
+    'MAX_CONCURRENCY': int(os.getenv('AI_MAX_CONCURRENCY', '8')),
+    'ACQUIRE_TIMEOUT': 2.0,
+    'RETRIES': 2,
+    'BACKOFF_BASE': 0.25,
+    'BACKOFF_MAX': 2.0,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30,
+}
+
+# Story context sent to the AI: recent nodes verbatim plus rolling summaries of
+# everything older, kept within TOKEN_BUDGET (see stories/context.py)
+AI_CONTEXT = {
+    'TOKEN_BUDGET': int(os.getenv('AI_CONTEXT_TOKEN_BUDGET', '1500')),
+    'RECENT_SHARE': 0.6,
+    'RECENT_WINDOW': 5,
+    'SEGMENT_SIZE': 10,
+    'SUMMARY_WORDS': 80,
+    'FANOUT': 4,
+    # Segments one append may summarize; a longer backlog goes to a job
+    'SEGMENTS_PER_APPEND': 2,
+}
+
+# Identical suggestion requests within TTL seconds share one Gemini call.
+# VARIANTS > 1 keeps that many distinct suggestions per key and rotates them.
+AI_SUGGESTION_CACHE = {
+    'MAX_ENTRIES': int(os.getenv('AI_CACHE_MAX_ENTRIES', '1024')),
+    'TTL': int(os.getenv('AI_CACHE_TTL', '60')),
+    'VARIANTS': int(os.getenv('AI_CACHE_VARIANTS', '3')),
+}
+
+# Fallback suggestions and outlines used when no provider is available. PATH
+# defaults to ai_assistant/data/suggestions.json; edits are picked up within
+# RELOAD_INTERVAL seconds.
+AI_SUGGESTION_CATALOGUE = {
+    'PATH': os.getenv('AI_SUGGESTION_CATALOGUE_PATH') or None,
+    'RELOAD_INTERVAL': 5.0,
+}
+
+# Unused AI prompts older than TTL_DAYS are purged BATCH_SIZE rows at a time,
+# sleeping BATCH_PAUSE seconds between batches (see stories/prompts.py)
+AI_PROMPT_RETENTION = {
+    'TTL_DAYS': int(os.getenv('AI_PROMPT_TTL_DAYS', '14')),
+    'BATCH_SIZE': 500,
+    'BATCH_PAUSE': 0.05,
+}
+
+# Background jobs
+# "celery" hands jobs to a Celery worker; "thread" runs them on an in-process
+# thread pool so development servers and tests need no broker.
+JOB_BACKEND = os.getenv('JOB_BACKEND', 'thread' if DEBUG else 'celery')
+JOB_THREAD_WORKERS = int(os.getenv('JOB_THREAD_WORKERS', '4'))
+
+# The hot story views have async versions (stories/async_views.py) that run on
+# the event loop under ASGI. Behind WSGI each request would start an event loop
+# of its own, so set it to False there to serve the sync ones
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'True').lower() in ('true', '1', 'yes')
+# Threads (and so database connections) the async views make their concurrent
+# reads on; they last as long as the process (see CollabStory/db.py)
+ASYNC_READ_THREADS = int(os.getenv('ASYNC_READ_THREADS', '8'))
+
+# Celery configuration
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://127.0.0.1:6379/0')
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_BEAT_SCHEDULE = {
+    'purge-ai-prompts': {
+        'task': 'stories.tasks.purge_ai_prompts',
+        'schedule': 60 * 60,
+    },
+    'purge-story-exports': {
+        'task': 'stories.tasks.purge_story_exports',
+        'schedule': 60 * 60,
+    },
+}
+
+# Per-request timings (see CollabStory/perf.py). When enabled every response
+# carries a Server-Timing header (if SERVER_TIMING) and SAMPLE_RATE of requests
+# and socket handler calls are logged to the "CollabStory.perf" logger.
+PERF_INSTRUMENTATION = {
+    'ENABLED': os.getenv('PERF_INSTRUMENTATION', 'False').lower() in ('true', '1', 'yes'),
+    'SAMPLE_RATE': float(os.getenv('PERF_SAMPLE_RATE', '0.01')),
+    'SERVER_TIMING': True,
+}
+
+# Prometheus metrics at /metrics (see CollabStory/metrics.py). Scrapers send
+# "Authorization: Bearer <TOKEN>"; staff can also read it while logged in. With
+# several worker processes point MULTIPROCESS_DIR at a directory they all share,
+# emptied on every deploy, so each scrape adds up all of them.
+METRICS = {
+    'TOKEN': os.getenv('METRICS_TOKEN'),
+    'MULTIPROCESS_DIR': os.getenv('METRICS_MULTIPROCESS_DIR'),
+    'FLUSH_INTERVAL': 5.0,
+}
+
+# Logging
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "ai_assistant": {
+            "handlers": ["console"],
+            "level": os.getenv('AI_LOG_LEVEL', 'WARNING'),
+        },
+        "CollabStory.perf": {
+            "handlers": ["console"],
+            "level": "INFO",
+        },
+    },
+}
+
 # Login URLs
 LOGIN_URL = '/users/login/'
 LOGIN_REDIRECT_URL = '/'
@@ -0,0 +1,125 @@
+"""
+Opt-in tuning for running CollabStory on a single SQLite file.
+
+With ``SQLITE_PROFILE['ENABLED']`` every new SQLite connection is set up with:
+
+- ``journal_mode=WAL``, so readers no longer wait for a writer to finish;
+- ``synchronous=NORMAL``, which is safe under WAL (a power cut can lose the
+  last commits but cannot corrupt the file) and avoids an fsync per commit;
+- a larger ``mmap_size`` and ``cache_size`` so hot pages stay in memory;
+- ``busy_timeout``, so a writer waits for the lock instead of failing with
+  "database is locked".
+
+SQLite still allows one writer at a time. Async consumers therefore run
+their writes through ``database_write_to_async``, which queues them on a
+single writer thread per process instead of letting every worker thread
+race for the lock. With the profile off it behaves exactly like
+``database_sync_to_async``.
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_config = None
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_config():
+    global _config
+    if _config is None:
+        config = getattr(settings, 'SQLITE_PROFILE', {})
+        _config = {
+            'ENABLED': config.get('ENABLED', False),
+            'JOURNAL_MODE': config.get('JOURNAL_MODE', 'WAL'),
+            'SYNCHRONOUS': config.get('SYNCHRONOUS', 'NORMAL'),
+            'MMAP_SIZE': config.get('MMAP_SIZE', 256 * 1024 * 1024),
+            'CACHE_SIZE': config.get('CACHE_SIZE', -64000),
+            'BUSY_TIMEOUT': config.get('BUSY_TIMEOUT', 5000),
+            'SERIALIZE_WRITES': config.get('SERIALIZE_WRITES', True),
+        }
+    return _config
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    global _config
+    if setting == 'SQLITE_PROFILE':
+        _config = None
+
+
+def profile_pragmas(config):
+    return [
+        f"PRAGMA journal_mode={config['JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SYNCHRONOUS']}",
+        f"PRAGMA mmap_size={int(config['MMAP_SIZE'])}",
+        f"PRAGMA cache_size={int(config['CACHE_SIZE'])}",
+        f"PRAGMA busy_timeout={int(config['BUSY_TIMEOUT'])}",
+    ]
+
+
+def apply_profile(raw_connection, config=None):
+    """Run the profile's pragmas on a DB-API sqlite3 connection"""
+    for pragma in profile_pragmas(config or get_config()):
+        raw_connection.execute(pragma).fetchall()
+
+
+@receiver(connection_created)
+def _configure_new_connection(connection, **kwargs):
+    if connection.vendor == 'sqlite' and get_config()['ENABLED']:
+        apply_profile(connection.connection)
+
+
+def serializes_writes(using=DEFAULT_DB_ALIAS):
+    config = get_config()
+    return config['ENABLED'] and config['SERIALIZE_WRITES'] and connections[using].vendor == 'sqlite'
+
+
+def get_writer():
+    """Return the process's single writer thread"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-writer')
+        return _writer
+
+
+def run_write(func, *args, **kwargs):
+    """Run a write on the writer thread and wait for it; callable from any sync code"""
+    return get_writer().submit(_run_write, contextvars.copy_context(), func, args, kwargs).result()
+
+
+def _run_write(context, func, args, kwargs):
+    try:
+        return context.run(func, *args, **kwargs)
+    finally:
+        # Unlike request threads the writer keeps its connection between
+        # writes, so it only drops one that has broken
+        for connection in connections.all(initialized_only=True):
+            if connection.errors_occurred:
+                if not connection.is_usable():
+                    connection.close()
+                connection.errors_occurred = False
+
+
+def database_write_to_async(func):
+    """``database_sync_to_async`` for writes: queued on the writer thread when the profile serializes them"""
+    unserialized = database_sync_to_async(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not serializes_writes():
+            return await unserialized(*args, **kwargs)
+        future = get_writer().submit(_run_write, contextvars.copy_context(), func, args, kwargs)
+        return await asyncio.wrap_future(future)
+    return wrapper
@@ -15,10 +15,13 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+
+from . import views
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -27,10 +30,13 @@ urlpatterns = [
     path("community/", include("community.urls")),
     path("ai/", include("ai_assistant.urls")),
     path("collaboration/", include("collaboration.urls")),
+    path("metrics", views.metrics, name="metrics"),
     #Django's built-in authentication URLs
     path("accounts/", include("django.contrib.auth.urls")),
 ]
 
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Serve media files in development, or when no web server sits in front
+if settings.DEBUG or settings.SERVE_MEDIA:
+    urlpatterns += [
+        re_path(rf"^{re.escape(settings.MEDIA_URL.lstrip('/'))}(?P<path>.*)$", views.media),
+    ]
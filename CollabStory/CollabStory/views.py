@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.static import serve
+
+from stories.storage import is_content_name
+
+from .metrics import CONTENT_TYPE, get_config, render_metrics
+
+
+def metrics(request):
+    """Prometheus metrics of every worker process, for staff or a scraper with the token"""
+    token = get_config()['TOKEN']
+    authorized = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not (authorized or request.user.is_staff):
+        raise PermissionDenied
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
+
+def media(request, path):
+    """Uploaded media; content-addressed files never change, so clients may cache them for good"""
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if is_content_name(path):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
@@ -1,11 +1,20 @@
-import google.generativeai as genai
+import json
+import logging
 import os
-import random
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from .cache import get_suggestion_cache, make_cache_key
+from .catalogue import get_catalogue, used_suggestion_hashes
+from .client import ProviderUnavailable, get_provider_client
 
-def generate_ai_suggestion(context, prompt_type, story_genre=None):
+logger = logging.getLogger(__name__)
+
+# Output budget per suggestion when several types share one batch request
+BATCH_TOKENS_PER_TYPE = 200
+
+def get_prompt_instruction(prompt_type, story_genre=None):
     """
-    Generate AI writing suggestions using Google Gemini API
+    Return the instruction line for a suggestion type
     """
     prompts = {
         'plot_twist': f"Generate an unexpected plot twist for this {story_genre or 'story'} context:",
@@ -17,119 +26,256 @@ def generate_ai_suggestion(context, prompt_type, story_genre=None):
         'description': "Add rich, descriptive details to enhance this scene:"
     }
     
-    prompt = f"{prompts.get(prompt_type, prompts['continuation'])}\n\nContext: {context}\n\nSuggestion:"
+    return prompts.get(prompt_type, prompts['continuation'])
+
+def build_prompt(context, prompt_type, story_genre=None):
+    """
+    Build the full provider prompt for a writing suggestion
+    """
+    prompt = f"{get_prompt_instruction(prompt_type, story_genre)}\n\nContext: {context}\n\nSuggestion:"
+    
+    # Create the full prompt with system instructions
+    return f"""You are a creative writing assistant. Provide concise, imaginative suggestions that inspire writers. Keep responses under 200 words and be creative and engaging.
+
+{prompt}"""
+
+def build_batch_prompt(context, prompt_types, story_genre=None):
+    """
+    Build one provider prompt that asks for several suggestion types at once
+    """
+    instructions = "\n".join(
+        f'- "{prompt_type}": {get_prompt_instruction(prompt_type, story_genre)}'
+        for prompt_type in prompt_types
+    )
+    
+    return f"""You are a creative writing assistant. Provide concise, imaginative suggestions that inspire writers. Keep each suggestion under 200 words and be creative and engaging.
+
+For the story context below, write one suggestion for each of these keys:
+{instructions}
+
+Respond with only a JSON object that maps each key to its suggestion text.
+
+Context: {context}"""
+
+def parse_batch_response(text, prompt_types):
+    """
+    Extract per-type suggestions from a batch response, skipping anything malformed
+    """
+    # Models often wrap JSON in prose or code fences; take the outermost object
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1 or end < start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
     
+    return {
+        prompt_type: data[prompt_type].strip()
+        for prompt_type in prompt_types
+        if isinstance(data.get(prompt_type), str) and data[prompt_type].strip()
+    }
+
+def generate_ai_suggestion(context, prompt_type, story_genre=None, story_id=None):
+    """
+    Generate AI writing suggestions using the configured provider (Google Gemini by default)
+    """
     try:
-        # Check if Gemini API key is configured
-        api_key = getattr(settings, 'GEMINI_API_KEY', None)
-        if not api_key or api_key == "your-gemini-api-key-here":
-            return get_fallback_suggestion(prompt_type, story_genre)
+        # Without a configured provider every suggestion comes from the fallbacks
+        client = get_provider_client()
+        if client is None:
+            return get_fallback_suggestion(prompt_type, story_genre, story_id)
         
-        # Configure Gemini
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-pro')
+        full_prompt = build_prompt(context, prompt_type, story_genre)
         
-        # Create the full prompt with system instructions
-        full_prompt = f"""You are a creative writing assistant. Provide concise, imaginative suggestions that inspire writers. Keep responses under 200 words and be creative and engaging.
+        # Identical requests within the cache TTL share one provider call
+        cache_key = make_cache_key(context, prompt_type, story_genre, client.cache_params())
+        return get_suggestion_cache().get_or_generate(
+            cache_key,
+            lambda: client.generate(full_prompt, prompt_type)
+        )
+    except ProviderUnavailable as e:
+        # Circuit open or no free slot: answer immediately from the fallbacks
+        logger.info("AI provider unavailable, using fallback: %s", e)
+        return get_fallback_suggestion(prompt_type, story_genre, story_id)
+    except Exception:
+        logger.exception("AI provider error, using fallback")
+        return get_fallback_suggestion(prompt_type, story_genre, story_id)
 
-{prompt}"""
+async def agenerate_ai_suggestion(context, prompt_type, story_genre=None, story_id=None):
+    """
+    generate_ai_suggestion for async callers: the provider call holds no thread while it waits
+    """
+    try:
+        client = get_provider_client()
+        if client is None:
+            return await aget_fallback_suggestion(prompt_type, story_genre, story_id)
         
-        response = model.generate_content(
-            full_prompt,
-            generation_config=genai.types.GenerationConfig(
-                max_output_tokens=200,
-                temperature=0.8,
-                top_p=0.8,
-                top_k=40
-            )
+        full_prompt = build_prompt(context, prompt_type, story_genre)
+        cache_key = make_cache_key(context, prompt_type, story_genre, client.cache_params())
+        return await get_suggestion_cache().aget_or_generate(
+            cache_key,
+            lambda: client.agenerate(full_prompt, prompt_type)
         )
-        
-        return response.text.strip()
-    except Exception as e:
-        print(f"Gemini API error: {e}")
-        return get_fallback_suggestion(prompt_type, story_genre)
-
-def get_fallback_suggestion(prompt_type, story_genre=None):
-    """Fallback suggestions if API fails"""
-    fallback_suggestions = {
-        'plot_twist': [
-            "The protagonist discovers they've been living in a simulation",
-            "The trusted mentor is actually the villain",
-            "The magical artifact was a distraction from the real power within",
-            "A character thought to be dead returns with crucial information",
-            "The entire adventure was a test of character"
-        ],
-        'character': [
-            "Introduce a character with a hidden connection to the past",
-            "Reveal a secret talent or fear in an existing character",
-            "Create a character who sees the world completely differently",
-            "Add a character who challenges the protagonist's beliefs",
-            "Introduce someone from the protagonist's forgotten past"
-        ],
-        'dialogue': [
-            "Add tension with a character who speaks in riddles",
-            "Create conflict through a heated argument",
-            "Reveal important information through casual conversation",
-            "Show character growth through their choice of words",
-            "Add humor with witty banter between characters"
-        ],
-        'setting': [
-            "Describe a mysterious location that changes the mood",
-            "Add atmospheric details that enhance the tension",
-            "Create a setting that reflects the characters' emotions",
-            "Describe a place that holds hidden secrets",
-            "Paint a vivid picture of an otherworldly environment"
-        ],
-        'conflict': [
-            "Introduce a moral dilemma that tests the protagonist",
-            "Create a physical obstacle that seems impossible to overcome",
-            "Add a time constraint that increases pressure",
-            "Introduce a character with conflicting goals",
-            "Create a situation where all choices have consequences"
-        ],
-        'continuation': [
-            "Continue with a surprising turn of events",
-            "Add a moment of reflection or character development",
-            "Introduce a new element that changes everything",
-            "Continue with action that builds tension",
-            "Add a scene that reveals important backstory"
-        ],
-        'description': [
-            "Add sensory details that bring the scene to life",
-            "Describe the emotional atmosphere of the moment",
-            "Include details that foreshadow future events",
-            "Add descriptions that reveal character personality",
-            "Create vivid imagery that engages all five senses"
-        ]
-    }
-    
-    suggestions = fallback_suggestions.get(prompt_type, fallback_suggestions['continuation'])
-    return random.choice(suggestions)
+    except ProviderUnavailable as e:
+        logger.info("AI provider unavailable, using fallback: %s", e)
+        return await aget_fallback_suggestion(prompt_type, story_genre, story_id)
+    except Exception:
+        logger.exception("AI provider error, using fallback")
+        return await aget_fallback_suggestion(prompt_type, story_genre, story_id)
 
-def analyze_writing_style(text):
+def stream_ai_suggestion(context, prompt_type, story_genre=None, story_id=None):
     """
-    Analyze writing style and provide suggestions
+    Yield an AI writing suggestion chunk by chunk as the provider produces it
     """
-    if not text:
-        return {"error": "No text provided"}
+    client = get_provider_client()
+    if client is None:
+        yield get_fallback_suggestion(prompt_type, story_genre, story_id)
+        return
     
-    words = text.split()
-    sentences = text.split('.')
+    streamed = False
+    try:
+        for chunk in client.stream(build_prompt(context, prompt_type, story_genre), prompt_type):
+            if chunk:
+                streamed = True
+                yield chunk
+    except ProviderUnavailable as e:
+        logger.info("AI provider unavailable, using fallback: %s", e)
+        yield get_fallback_suggestion(prompt_type, story_genre, story_id)
+    except Exception:
+        logger.exception("AI provider error during streaming")
+        # Only fall back if the writer hasn't seen partial text yet
+        if not streamed:
+            yield get_fallback_suggestion(prompt_type, story_genre, story_id)
+
+def generate_ai_suggestions_batch(context, prompt_types, story_genre=None, story_id=None):
+    """
+    Generate suggestions for several prompt types with a single provider call
+    """
+    suggestions = {}
+    try:
+        client = get_provider_client()
+        if client is not None:
+            max_output_tokens = BATCH_TOKENS_PER_TYPE * len(prompt_types)
+            
+            def generate():
+                response = client.generate(
+                    build_batch_prompt(context, prompt_types, story_genre),
+                    'batch',
+                    max_output_tokens=max_output_tokens
+                )
+                # Don't cache a response we can't use
+                if not parse_batch_response(response, prompt_types):
+                    raise ValueError("Batch response contained no usable suggestions")
+                return response
+            
+            cache_key = make_cache_key(
+                context,
+                'batch:' + ','.join(prompt_types),
+                story_genre,
+                {**client.cache_params(), 'max_output_tokens': max_output_tokens}
+            )
+            response = get_suggestion_cache().get_or_generate(cache_key, generate)
+            suggestions = parse_batch_response(response, prompt_types)
+    except ProviderUnavailable as e:
+        logger.info("AI provider unavailable, using fallback: %s", e)
+    except Exception:
+        logger.exception("AI provider error, using fallback")
     
-    # Basic metrics
-    word_count = len(words)
-    sentence_count = len([s for s in sentences if s.strip()])
-    avg_sentence_length = word_count / sentence_count if sentence_count > 0 else 0
+    # Any type the model skipped gets a fallback suggestion
+    return {
+        prompt_type: suggestions.get(prompt_type) or get_fallback_suggestion(prompt_type, story_genre, story_id)
+        for prompt_type in prompt_types
+    }
+
+async def agenerate_ai_suggestions_batch(context, prompt_types, story_genre=None, story_id=None):
+    """
+    generate_ai_suggestions_batch for async callers
+    """
+    suggestions = {}
+    try:
+        client = get_provider_client()
+        if client is not None:
+            max_output_tokens = BATCH_TOKENS_PER_TYPE * len(prompt_types)
+            
+            async def generate():
+                response = await client.agenerate(
+                    build_batch_prompt(context, prompt_types, story_genre),
+                    'batch',
+                    max_output_tokens=max_output_tokens
+                )
+                if not parse_batch_response(response, prompt_types):
+                    raise ValueError("Batch response contained no usable suggestions")
+                return response
+            
+            cache_key = make_cache_key(
+                context,
+                'batch:' + ','.join(prompt_types),
+                story_genre,
+                {**client.cache_params(), 'max_output_tokens': max_output_tokens}
+            )
+            response = await get_suggestion_cache().aget_or_generate(cache_key, generate)
+            suggestions = parse_batch_response(response, prompt_types)
+    except ProviderUnavailable as e:
+        logger.info("AI provider unavailable, using fallback: %s", e)
+    except Exception:
+        logger.exception("AI provider error, using fallback")
     
-    # Vocabulary diversity (simple measure)
-    unique_words = len(set(word.lower() for word in words))
-    vocabulary_diversity = unique_words / word_count if word_count > 0 else 0
+    missing = [prompt_type for prompt_type in prompt_types if not suggestions.get(prompt_type)]
+    if missing:
+        fallbacks = await sync_to_async(lambda: {
+            prompt_type: get_fallback_suggestion(prompt_type, story_genre, story_id) for prompt_type in missing
+        })()
+        suggestions = {**suggestions, **fallbacks}
+    return {prompt_type: suggestions[prompt_type] for prompt_type in prompt_types}
+
+def get_fallback_suggestion(prompt_type, story_genre=None, story_id=None):
+    """Fallback suggestions if API fails, avoiding ones the story has already had"""
+    exclude = used_suggestion_hashes(story_id, prompt_type) if story_id else ()
+    return get_catalogue().choose(prompt_type, story_genre, exclude)
+
+async def aget_fallback_suggestion(prompt_type, story_genre=None, story_id=None):
+    return await sync_to_async(get_fallback_suggestion)(prompt_type, story_genre, story_id)
+
+def count_style_features(text):
+    """
+    Tokenize text once and return (word_count, sentence_count, unique_words, dialogue_lines, content_lines)
+    """
+    word_count, sentence_count, vocabulary, dialogue_lines, content_lines = collect_style_features(text)
+    return word_count, sentence_count, len(vocabulary), dialogue_lines, content_lines
+
+def collect_style_features(text):
+    """
+    Like count_style_features, but return the lowercased vocabulary itself
+    """
+    word_count = 0
+    vocabulary = set()
+    dialogue_lines = 0
+    content_lines = 0
     
-    # Dialogue ratio
-    dialogue_lines = [line for line in text.split('\n') if line.strip().startswith('"')]
-    dialogue_ratio = len(dialogue_lines) / len([line for line in text.split('\n') if line.strip()]) if text.split('\n') else 0
+    # Words never span lines, so one walk over the lines covers words,
+    # vocabulary and dialogue; sentences can span lines and are the
+    # '.'-delimited pieces of the whole text that are not blank
+    for line in text.split('\n'):
+        words = line.lower().split()
+        if not words:
+            continue
+        content_lines += 1
+        word_count += len(words)
+        vocabulary.update(words)
+        if words[0][0] == '"':
+            dialogue_lines += 1
     
-    # Suggestions based on analysis
+    sentence_count = sum(1 for sentence in text.split('.') if sentence.strip())
+    return word_count, sentence_count, vocabulary, dialogue_lines, content_lines
+
+def get_style_suggestions(avg_sentence_length, vocabulary_diversity, dialogue_ratio):
+    """
+    Suggestions based on analysis
+    """
     suggestions = []
     
     if avg_sentence_length > 25:
@@ -145,68 +291,85 @@ def analyze_writing_style(text):
     elif dialogue_ratio > 0.7:
         suggestions.append("Consider adding more narrative description to balance dialogue")
     
+    return suggestions
+
+def analyze_writing_style(text):
+    """
+    Analyze writing style and provide suggestions
+    """
+    if not text:
+        return {"error": "No text provided"}
+    
+    word_count, sentence_count, unique_words, dialogue_lines, content_lines = count_style_features(text)
+    
+    # Basic metrics
+    avg_sentence_length = word_count / sentence_count if sentence_count > 0 else 0
+    
+    # Vocabulary diversity (simple measure)
+    vocabulary_diversity = unique_words / word_count if word_count > 0 else 0
+    
+    # Dialogue ratio
+    dialogue_ratio = dialogue_lines / content_lines if content_lines > 0 else 0
+    
     return {
         "word_count": word_count,
         "sentence_count": sentence_count,
         "avg_sentence_length": round(avg_sentence_length, 2),
         "vocabulary_diversity": round(vocabulary_diversity, 3),
         "dialogue_ratio": round(dialogue_ratio, 3),
-        "suggestions": suggestions
+        "suggestions": get_style_suggestions(avg_sentence_length, vocabulary_diversity, dialogue_ratio)
     }
 
-def generate_story_outline(genre, initial_prompt):
+def analyze_writing_style_batch(texts):
     """
-    Generate a basic story outline structure
+    Analyze many texts at once, computing the metrics as array operations
     """
-    outline_templates = {
-        'fantasy': [
-            "The Call to Adventure",
-            "Meeting the Mentor",
-            "Crossing the Threshold",
-            "Tests and Trials",
-            "The Ordeal",
-            "The Reward",
-            "The Return"
-        ],
-        'mystery': [
-            "The Crime is Discovered",
-            "Initial Investigation",
-            "Red Herrings and Clues",
-            "The Plot Thickens",
-            "The Breakthrough",
-            "The Revelation",
-            "Justice Served"
-        ],
-        'romance': [
-            "The Meet-Cute",
-            "Initial Attraction",
-            "The Obstacle",
-            "Growing Closer",
-            "The Crisis",
-            "The Resolution",
-            "The Happy Ending"
-        ],
-        'horror': [
-            "The Normal World",
-            "The First Sign",
-            "Escalating Tension",
-            "The Confrontation",
-            "The Climax",
-            "The Aftermath",
-            "The New Normal"
-        ]
-    }
+    # Imported here so web workers that never batch-analyze skip loading NumPy
+    import numpy as np
+    
+    counts = np.array(
+        [count_style_features(text) if text else (0, 0, 0, 0, 0) for text in texts],
+        dtype=np.float64
+    ).reshape(-1, 5)
+    words, sentences, unique_words, dialogue_lines, content_lines = counts.T
+    
+    avg_sentence_length = np.divide(words, sentences, out=np.zeros_like(words), where=sentences > 0)
+    vocabulary_diversity = np.divide(unique_words, words, out=np.zeros_like(words), where=words > 0)
+    dialogue_ratio = np.divide(dialogue_lines, content_lines, out=np.zeros_like(words), where=content_lines > 0)
     
-    template = outline_templates.get(genre, outline_templates['fantasy'])
+    # Evaluate every suggestion rule across the whole batch at once
+    rules = [
+        (avg_sentence_length > 25, "Consider breaking up long sentences for better readability"),
+        ((avg_sentence_length <= 25) & (avg_sentence_length < 8), "Try varying sentence length for more dynamic writing"),
+        (vocabulary_diversity < 0.3, "Consider using more varied vocabulary"),
+        (dialogue_ratio < 0.1, "Adding more dialogue can make scenes more engaging"),
+        (dialogue_ratio > 0.7, "Consider adding more narrative description to balance dialogue"),
+    ]
+    rule_hits = np.column_stack([mask for mask, _ in rules]) if len(texts) else np.zeros((0, len(rules)), bool)
     
+    results = []
+    for index, text in enumerate(texts):
+        if not text:
+            results.append({"error": "No text provided"})
+            continue
+        results.append({
+            "word_count": int(words[index]),
+            "sentence_count": int(sentences[index]),
+            "avg_sentence_length": round(float(avg_sentence_length[index]), 2),
+            "vocabulary_diversity": round(float(vocabulary_diversity[index]), 3),
+            "dialogue_ratio": round(float(dialogue_ratio[index]), 3),
+            "suggestions": [message for hit, (_, message) in zip(rule_hits[index], rules) if hit]
+        })
+    return results
+
+def generate_story_outline(genre, initial_prompt):
+    """
+    Generate a basic story outline structure
+    """
+    catalogue = get_catalogue()
     return {
         "genre": genre,
         "initial_prompt": initial_prompt,
-        "outline_points": template,
-        "suggestions": [
-            "Each point can be expanded into multiple story nodes",
-            "Consider adding subplots for character development",
-            "Remember to maintain consistency with your established world",
-            "Don't be afraid to deviate from the outline as the story develops"
-        ]
+        "outline_points": list(catalogue.outline(genre)),
+        "suggestions": list(catalogue.outline_suggestions)
     }
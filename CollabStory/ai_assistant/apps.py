@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AiAssistantConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "ai_assistant"
+
+    def ready(self):
+        # Compile the fallback catalogue once per process rather than on first use
+        from .catalogue import get_catalogue
+        get_catalogue()
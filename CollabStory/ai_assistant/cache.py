@@ -0,0 +1,253 @@
+"""
+In-process cache for AI suggestions.
+
+Suggestions are keyed by a hash of the normalized story context, the prompt
+type, the genre and the model parameters, so collaborators asking for the same
+kind of idea on the same passage share one upstream call. Entries expire after
+a TTL and the least recently used entry is evicted once the cache is full.
+
+Each key can hold a small pool of distinct variants; until the pool is full a
+lookup still goes upstream and adds its result, afterwards lookups rotate
+through the pool. Concurrent misses for the same key are coalesced onto a
+single upstream call, whether the callers are threads or coroutines.
+
+The cache lives in the process that generates suggestions (the job worker),
+so every worker process keeps its own copy. Lookups, upstream calls and
+evictions are also counted in ``CollabStory.metrics``, which adds up all
+processes when ``METRICS['MULTIPROCESS_DIR']`` is set; ``shared_stats``
+reports from those counters.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from CollabStory.metrics import AI_CACHE_EVICTIONS, AI_CACHE_LOOKUPS, AI_CACHE_UPSTREAM_CALLS, collect_all
+from CollabStory.perf import record_cache
+
+
+def make_cache_key(context, prompt_type, story_genre=None, params=None):
+    """Hash the inputs that determine an AI suggestion"""
+    normalized_context = " ".join((context or "").split())
+    payload = json.dumps(
+        [normalized_context, prompt_type, story_genre or "", params or {}],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("variants", "fills", "expires_at", "next_variant")
+
+    def __init__(self, expires_at):
+        self.variants = []
+        self.fills = 0
+        self.expires_at = expires_at
+        self.next_variant = 0
+
+    def pick(self):
+        text = self.variants[self.next_variant % len(self.variants)]
+        self.next_variant += 1
+        return text
+
+
+class _InFlight:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SuggestionCache:
+    """Thread-safe TTL/LRU cache with request coalescing and variant pools"""
+
+    def __init__(self, max_entries=1024, ttl=60, variants=1, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variants = max(1, variants)
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self.evictions = 0
+
+    def get_or_generate(self, key, generate):
+        """Return a cached suggestion for key, calling generate() on a miss"""
+        hit, value, leader = self._claim(key)
+        if hit:
+            return value
+        call = value
+        
+        if not leader:
+            call.event.wait()
+            return call.outcome()
+        
+        try:
+            call.result = generate()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            self._settle(key, call)
+        return call.result
+
+    async def aget_or_generate(self, key, agenerate):
+        """get_or_generate for async callers; awaits agenerate() on a miss"""
+        hit, value, leader = self._claim(key)
+        if hit:
+            return value
+        call = value
+        
+        if not leader:
+            # The leader may be a sync caller, so wait for it off the event loop
+            await sync_to_async(call.event.wait, thread_sensitive=False)()
+            return call.outcome()
+        
+        try:
+            call.result = await agenerate()
+        except BaseException as e:
+            # Including cancellation, so nothing half-done is cached
+            call.error = e
+            raise
+        finally:
+            self._settle(key, call)
+        return call.result
+
+    def _claim(self, key):
+        """(True, text, False) on a hit, else (False, in-flight call, whether this caller makes it)"""
+        with self._lock:
+            now = self._clock()
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            
+            if entry is not None and entry.fills >= self.variants:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                AI_CACHE_LOOKUPS.inc('hit')
+                record_cache(True)
+                return True, entry.pick(), False
+            
+            call = self._inflight.get(key)
+            if call is not None:
+                self.coalesced += 1
+                AI_CACHE_LOOKUPS.inc('coalesced')
+                leader = False
+            else:
+                call = self._inflight[key] = _InFlight()
+                self.misses += 1
+                AI_CACHE_LOOKUPS.inc('miss')
+                leader = True
+            # Sharing another request's upstream call counts as a hit
+            record_cache(not leader)
+            return False, call, leader
+
+    def _settle(self, key, call):
+        with self._lock:
+            del self._inflight[key]
+            self.upstream_calls += 1
+            AI_CACHE_UPSTREAM_CALLS.inc()
+            if call.error is None:
+                self._store(key, call.result)
+        call.event.set()
+
+    def _store(self, key, text):
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= self._clock():
+            entry = self._entries[key] = _Entry(self._clock() + self.ttl)
+        entry.fills += 1
+        if text not in entry.variants:
+            entry.variants.append(text)
+        self._entries.move_to_end(key)
+        
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            AI_CACHE_EVICTIONS.inc()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit rate and upstream calls saved since the cache was created"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                **summarize(self.hits, self.misses, self.coalesced, self.upstream_calls, self.evictions),
+            }
+
+
+def summarize(hits, misses, coalesced, upstream_calls, evictions):
+    lookups = hits + misses + coalesced
+    saved = hits + coalesced
+    return {
+        "hits": hits,
+        "misses": misses,
+        "coalesced": coalesced,
+        "upstream_calls": upstream_calls,
+        "upstream_calls_saved": saved,
+        "evictions": evictions,
+        "hit_rate": round(saved / lookups, 3) if lookups else 0.0,
+    }
+
+
+def shared_stats():
+    """Cache stats summed over every process that reports metrics, the job workers included"""
+    families = collect_all()
+
+    def total(metric, *labels):
+        family = families.get(metric)
+        return family['samples'].get(labels, 0) if family else 0
+
+    lookups = AI_CACHE_LOOKUPS.name
+    return summarize(
+        total(lookups, 'hit'),
+        total(lookups, 'miss'),
+        total(lookups, 'coalesced'),
+        total(AI_CACHE_UPSTREAM_CALLS.name),
+        total(AI_CACHE_EVICTIONS.name),
+    )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_suggestion_cache():
+    """Return the process-wide suggestion cache configured from settings"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = getattr(settings, "AI_SUGGESTION_CACHE", {})
+            _cache = SuggestionCache(
+                max_entries=config.get("MAX_ENTRIES", 1024),
+                ttl=config.get("TTL", 60),
+                variants=config.get("VARIANTS", 1),
+            )
+        return _cache
+
+
+def reset_suggestion_cache():
+    """Drop the process-wide cache so it is rebuilt from current settings"""
+    global _cache
+    with _cache_lock:
+        _cache = None
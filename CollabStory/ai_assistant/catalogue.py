@@ -0,0 +1,191 @@
+"""
+Precompiled catalogue of fallback suggestions and story outlines.
+
+The catalogue is read from ``AI_SUGGESTION_CATALOGUE['PATH']`` (a JSON file)
+once and compiled into per-(prompt type, genre) tuples of texts, text hashes
+and cumulative weights, so picking a suggestion allocates nothing unless
+some texts are excluded. The file's
+modification time is checked at most every ``RELOAD_INTERVAL`` seconds and a
+changed file is recompiled and swapped in without a restart.
+
+Fallback entries are either plain strings or objects with ``text`` and
+optional ``weight`` (a positive number, default 1) and ``genres`` (default:
+every genre).
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+DEFAULT_PATH = Path(__file__).resolve().parent / 'data' / 'suggestions.json'
+DEFAULT_PROMPT_TYPE = 'continuation'
+
+
+class SuggestionPool:
+    """Weighted suggestions for one prompt type and genre"""
+
+    __slots__ = ('texts', 'hashes', 'weights', 'cumulative', 'total')
+
+    def __init__(self, entries):
+        self.texts = tuple(text for text, _ in entries)
+        self.weights = tuple(weight for _, weight in entries)
+        self.hashes = tuple(hashlib.sha256(text.encode('utf-8')).hexdigest() for text in self.texts)
+        cumulative = []
+        total = 0
+        for _, weight in entries:
+            total += weight
+            cumulative.append(total)
+        self.cumulative = tuple(cumulative)
+        self.total = total
+
+    def __len__(self):
+        return len(self.texts)
+
+    def choose(self, rng=random, exclude=()):
+        """
+        Pick a text by weight, skipping texts whose hash is in ``exclude``
+
+        Once every text has been excluded the pool starts repeating rather
+        than returning nothing.
+        """
+        if exclude:
+            allowed = [index for index, key in enumerate(self.hashes) if key not in exclude]
+            if allowed and len(allowed) < len(self.texts):
+                # Sample over the remaining texts' own weights
+                cumulative = []
+                total = 0
+                for index in allowed:
+                    total += self.weights[index]
+                    cumulative.append(total)
+                position = bisect.bisect_right(cumulative, rng.random() * total)
+                return self.texts[allowed[min(position, len(allowed) - 1)]]
+        index = bisect.bisect_right(self.cumulative, rng.random() * self.total)
+        return self.texts[min(index, len(self.texts) - 1)]
+
+
+class SuggestionCatalogue:
+    """Fallback suggestions indexed by prompt type and genre, plus outlines"""
+
+    def __init__(self, data):
+        pools = {}
+        for prompt_type, items in data.get('fallbacks', {}).items():
+            generic = []
+            by_genre = {}
+            for item in items:
+                if isinstance(item, str):
+                    item = {'text': item}
+                weight = item.get('weight', 1)
+                if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight <= 0:
+                    raise ValueError(f"Suggestion {item['text']!r} has weight {weight!r}; weights must be positive")
+                entry = (item['text'], weight)
+                genres = item.get('genres')
+                if genres:
+                    for genre in genres:
+                        by_genre.setdefault(genre, []).append(entry)
+                else:
+                    generic.append(entry)
+            # A genre's pool holds the generic suggestions plus its own
+            pools[(prompt_type, None)] = SuggestionPool(generic)
+            for genre, entries in by_genre.items():
+                pools[(prompt_type, genre)] = SuggestionPool(generic + entries)
+        self.pools = pools
+
+        outlines = data.get('outlines', {})
+        self.outlines = {genre: tuple(points) for genre, points in outlines.get('genres', {}).items()}
+        self.default_outline = outlines.get('default')
+        self.outline_suggestions = tuple(outlines.get('suggestions', ()))
+
+    def pool(self, prompt_type, genre=None):
+        pools = self.pools
+        return (
+            pools.get((prompt_type, genre))
+            or pools.get((prompt_type, None))
+            or pools.get((DEFAULT_PROMPT_TYPE, genre))
+            or pools[(DEFAULT_PROMPT_TYPE, None)]
+        )
+
+    def choose(self, prompt_type, genre=None, exclude=(), rng=random):
+        return self.pool(prompt_type, genre).choose(rng, exclude)
+
+    def outline(self, genre):
+        return self.outlines.get(genre) or self.outlines.get(self.default_outline, ())
+
+
+class CatalogueLoader:
+    """Holds the compiled catalogue and recompiles it when its file changes"""
+
+    def __init__(self, path, reload_interval=5.0, clock=time.monotonic):
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._catalogue = None
+        self._mtime = None
+        self._checked_at = None
+
+    def get(self):
+        catalogue = self._catalogue
+        now = self.clock()
+        if catalogue is not None and now - self._checked_at < self.reload_interval:
+            return catalogue
+
+        with self._lock:
+            if self._catalogue is None or now - self._checked_at >= self.reload_interval:
+                self._checked_at = now
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime != self._mtime:
+                    with open(self.path, encoding='utf-8') as data_file:
+                        self._catalogue = SuggestionCatalogue(json.load(data_file))
+                    self._mtime = mtime
+            return self._catalogue
+
+
+_loader = None
+_loader_lock = threading.Lock()
+
+
+def get_catalogue():
+    """Return the current suggestion catalogue, reloading it if the file changed"""
+    global _loader
+    loader = _loader
+    if loader is None:
+        with _loader_lock:
+            if _loader is None:
+                config = getattr(settings, 'AI_SUGGESTION_CATALOGUE', {})
+                _loader = CatalogueLoader(
+                    config.get('PATH') or DEFAULT_PATH,
+                    reload_interval=config.get('RELOAD_INTERVAL', 5.0),
+                )
+            loader = _loader
+    return loader.get()
+
+
+def reset_catalogue():
+    global _loader
+    with _loader_lock:
+        _loader = None
+
+
+def used_suggestion_hashes(story_id, prompt_type):
+    """Hashes of suggestions the story has already been given for a prompt type"""
+    from stories.models import AIWritingPrompt
+
+    return set(
+        AIWritingPrompt.objects.filter(story_id=story_id, prompt_type=prompt_type)
+        .values_list('text_hash', flat=True)
+    )
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting == 'AI_SUGGESTION_CATALOGUE':
+        reset_catalogue()
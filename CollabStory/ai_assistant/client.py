@@ -0,0 +1,392 @@
+"""
+Long-lived AI provider client.
+
+``ProviderClient`` wraps the configured provider for the lifetime of the
+process and adds what the raw SDK call lacks: a cap on concurrent upstream
+requests, retries with exponential backoff and full jitter, and a circuit
+breaker. While the breaker is open calls fail immediately with
+``CircuitOpenError`` so callers can switch to ``get_fallback_suggestion``
+instead of waiting out a provider brownout.
+
+``agenerate`` does the same from async code. It shares the concurrency cap
+and breaker with ``generate``, waits for a slot and backs off without
+blocking the event loop, and awaits the provider's own ``agenerate``.
+
+Every attempt is recorded in ``ProviderMetrics`` (latency and errors per
+prompt type) and logged as a structured ``ai_provider_call`` record.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from CollabStory.metrics import AI_CALL_DURATION, AI_CALL_FAILURES
+from CollabStory.perf import record_ai_call
+
+from .providers import get_provider
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Seconds between attempts to take a slot from async code
+SLOT_POLL_INTERVAL = 0.01
+
+
+class ProviderUnavailable(Exception):
+    """The provider call was not attempted"""
+
+
+class CircuitOpenError(ProviderUnavailable):
+    """The circuit breaker is open because the provider is failing"""
+
+
+class ProviderBusyError(ProviderUnavailable):
+    """All provider slots stayed busy for the whole acquire timeout"""
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open probe after a cool-down"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+    
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+    
+    def allow(self):
+        """Whether a call may go upstream now"""
+        return self.admit() is not None
+    
+    def admit(self):
+        """None if a call may not go upstream now, else whether it is the half-open probe"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return False
+            if self._state == self.OPEN:
+                if self._clock() - self._opened_at < self.reset_timeout:
+                    return None
+                self._state = self.HALF_OPEN
+                self._probing = False
+            # Half-open lets a single probe through
+            if self._probing:
+                return None
+            self._probing = True
+            return True
+    
+    def release_probe(self):
+        """Give up a probe that ended without an outcome, so the next call can probe instead"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probing = False
+    
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("AI provider circuit opened after %d failures", self._failures)
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._probing = False
+
+
+class ProviderMetrics:
+    """Latency and error counts per prompt type"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_type = defaultdict(self._empty)
+    
+    @staticmethod
+    def _empty():
+        return {
+            'calls': 0,
+            'successes': 0,
+            'errors': defaultdict(int),
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+            'latency_buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+        }
+    
+    def observe(self, prompt_type, seconds, error=None):
+        with self._lock:
+            stats = self._by_type[prompt_type]
+            stats['calls'] += 1
+            if error is None:
+                stats['successes'] += 1
+            else:
+                stats['errors'][error] += 1
+            stats['latency_total'] += seconds
+            stats['latency_max'] = max(stats['latency_max'], seconds)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    break
+            else:
+                index = len(LATENCY_BUCKETS)
+            stats['latency_buckets'][index] += 1
+    
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for prompt_type, stats in self._by_type.items():
+                result[prompt_type] = {
+                    'calls': stats['calls'],
+                    'successes': stats['successes'],
+                    'errors': dict(stats['errors']),
+                    'latency_avg': round(stats['latency_total'] / stats['calls'], 4) if stats['calls'] else 0.0,
+                    'latency_max': round(stats['latency_max'], 4),
+                    'latency_buckets': dict(zip(
+                        [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                        stats['latency_buckets']
+                    )),
+                }
+            return result
+
+
+class ProviderClient:
+    """Bounded, retrying, circuit-broken access to an AI provider"""
+    
+    def __init__(self, provider, max_concurrency=8, acquire_timeout=2.0, retries=2,
+                 backoff_base=0.25, backoff_max=2.0, breaker=None, metrics=None, sleep=time.sleep):
+        self.provider = provider
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.acquire_timeout = acquire_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = metrics or ProviderMetrics()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._sleep = sleep
+    
+    def cache_params(self):
+        return self.provider.cache_params()
+    
+    def generate(self, prompt, prompt_type='continuation', **options):
+        """Generate text, retrying transient failures"""
+        probe = self._acquire(prompt_type)
+        try:
+            for attempt in range(self.retries + 1):
+                started = time.monotonic()
+                try:
+                    text = self.provider.generate(prompt, **options)
+                except Exception as e:
+                    self._record_failure(prompt_type, started, e, attempt)
+                    if attempt == self.retries or not self.breaker.allow():
+                        raise
+                    self._backoff(attempt)
+                else:
+                    self._record_success(prompt_type, started, attempt)
+                    return text
+        finally:
+            self._release(probe)
+    
+    async def agenerate(self, prompt, prompt_type='continuation', **options):
+        """Generate text from async code, retrying transient failures"""
+        probe = await self._aacquire(prompt_type)
+        try:
+            for attempt in range(self.retries + 1):
+                started = time.monotonic()
+                try:
+                    text = await self._provider_agenerate(prompt, **options)
+                except Exception as e:
+                    self._record_failure(prompt_type, started, e, attempt)
+                    if attempt == self.retries or not self.breaker.allow():
+                        raise
+                    await asyncio.sleep(self._backoff_delay(attempt))
+                else:
+                    self._record_success(prompt_type, started, attempt)
+                    return text
+        finally:
+            self._release(probe)
+    
+    def _provider_agenerate(self, prompt, **options):
+        agenerate = getattr(self.provider, 'agenerate', None)
+        if agenerate is None:
+            # Providers written against the sync interface only
+            return sync_to_async(self.provider.generate, thread_sensitive=False)(prompt, **options)
+        return agenerate(prompt, **options)
+    
+    def stream(self, prompt, prompt_type='continuation'):
+        """Yield text chunks; only retried until the first chunk arrives"""
+        probe = self._acquire(prompt_type)
+        try:
+            for attempt in range(self.retries + 1):
+                started = time.monotonic()
+                streamed = False
+                try:
+                    for chunk in self.provider.stream(prompt):
+                        streamed = True
+                        yield chunk
+                except Exception as e:
+                    self._record_failure(prompt_type, started, e, attempt)
+                    if streamed or attempt == self.retries or not self.breaker.allow():
+                        raise
+                    self._backoff(attempt)
+                else:
+                    self._record_success(prompt_type, started, attempt)
+                    return
+        finally:
+            self._release(probe)
+    
+    def _acquire(self, prompt_type):
+        """Take a slot, then pass the breaker; returns whether this call is the half-open probe"""
+        self._fail_fast(prompt_type)
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            self._busy(prompt_type)
+        return self._admit(prompt_type)
+    
+    async def _aacquire(self, prompt_type):
+        self._fail_fast(prompt_type)
+        # The slots are a threading semaphore shared with sync callers, so
+        # poll it rather than block the event loop
+        deadline = time.monotonic() + self.acquire_timeout
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                self._busy(prompt_type)
+            await asyncio.sleep(SLOT_POLL_INTERVAL)
+        return self._admit(prompt_type)
+    
+    def _fail_fast(self, prompt_type):
+        # Checked without claiming the probe, so an open circuit never waits for a slot
+        if self.breaker.state == CircuitBreaker.OPEN:
+            self._circuit_open(prompt_type)
+    
+    def _admit(self, prompt_type):
+        # Only asked once the slot is held: a probe granted before a slot wait
+        # that timed out (or was cancelled) would never report back
+        probe = self.breaker.admit()
+        if probe is None:
+            self._slots.release()
+            self._circuit_open(prompt_type)
+        return probe
+    
+    def _release(self, probe):
+        if probe:
+            # A no-op once the probe recorded its outcome; otherwise it was cut
+            # short (cancelled, stream closed) and the next call probes instead
+            self.breaker.release_probe()
+        self._slots.release()
+    
+    def _circuit_open(self, prompt_type):
+        self._log(prompt_type, 0.0, 'circuit_open', 0)
+        self.metrics.observe(prompt_type, 0.0, 'circuit_open')
+        AI_CALL_FAILURES.inc(prompt_type, 'circuit_open')
+        raise CircuitOpenError("AI provider circuit is open")
+    
+    def _busy(self, prompt_type):
+        self._log(prompt_type, self.acquire_timeout, 'busy', 0)
+        self.metrics.observe(prompt_type, self.acquire_timeout, 'busy')
+        AI_CALL_FAILURES.inc(prompt_type, 'busy')
+        raise ProviderBusyError("No AI provider slot became free")
+    
+    def _backoff(self, attempt):
+        self._sleep(self._backoff_delay(attempt))
+    
+    def _backoff_delay(self, attempt):
+        # Full jitter keeps retries from many workers from arriving together
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+    
+    def _record_success(self, prompt_type, started, attempt):
+        elapsed = time.monotonic() - started
+        record_ai_call(elapsed)
+        self.breaker.record_success()
+        self.metrics.observe(prompt_type, elapsed)
+        AI_CALL_DURATION.observe(elapsed, prompt_type)
+        self._log(prompt_type, elapsed, None, attempt)
+    
+    def _record_failure(self, prompt_type, started, error, attempt):
+        elapsed = time.monotonic() - started
+        record_ai_call(elapsed)
+        self.breaker.record_failure()
+        kind = type(error).__name__
+        self.metrics.observe(prompt_type, elapsed, kind)
+        AI_CALL_DURATION.observe(elapsed, prompt_type)
+        AI_CALL_FAILURES.inc(prompt_type, kind)
+        self._log(prompt_type, elapsed, kind, attempt)
+    
+    def _log(self, prompt_type, elapsed, error, attempt):
+        fields = {
+            'provider': self.provider.name,
+            'prompt_type': prompt_type,
+            'latency_ms': round(elapsed * 1000, 1),
+            'error': error,
+            'attempt': attempt,
+            'circuit': self.breaker.state,
+        }
+        logger.log(
+            logging.INFO if error is None else logging.WARNING,
+            "ai_provider_call %s",
+            " ".join(f"{key}={value}" for key, value in fields.items()),
+            extra=fields
+        )
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_provider_client():
+    """Return the process-wide provider client, or None when AI is not configured"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            provider = get_provider()
+            if provider is None:
+                return None
+            config = getattr(settings, 'AI_PROVIDER_CLIENT', {})
+            _client = ProviderClient(
+                provider,
+                max_concurrency=config.get('MAX_CONCURRENCY', 8),
+                acquire_timeout=config.get('ACQUIRE_TIMEOUT', 2.0),
+                retries=config.get('RETRIES', 2),
+                backoff_base=config.get('BACKOFF_BASE', 0.25),
+                backoff_max=config.get('BACKOFF_MAX', 2.0),
+                breaker=CircuitBreaker(
+                    failure_threshold=config.get('FAILURE_THRESHOLD', 5),
+                    reset_timeout=config.get('RESET_TIMEOUT', 30),
+                ),
+            )
+        return _client
+
+
+def reset_provider_client():
+    """Forget the process-wide client so it is rebuilt from current settings"""
+    global _client
+    with _client_lock:
+        _client = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ('AI_PROVIDER', 'GEMINI_API_KEY', 'AI_PROVIDER_CLIENT', 'AI_SIMULATED_PROVIDER'):
+        reset_provider_client()
@@ -0,0 +1,101 @@
+"""
+Google Gemini provider.
+
+The Gemini SDK takes a long time to import, so it is imported when the
+first provider is built rather than with this module, and not at all when no
+API key is configured.
+"""
+
+from django.conf import settings
+
+from .providers import Provider
+
+
+class GeminiProvider(Provider):
+    """
+    Google Gemini text generation
+
+    The SDK only accepts a single per-request deadline, so the connect and
+    read timeouts are combined into one deadline for each call.
+    """
+    
+    name = 'gemini'
+    params = {
+        'model': 'gemini-pro',
+        'max_output_tokens': 200,
+        'temperature': 0.8,
+        'top_p': 0.8,
+        'top_k': 40,
+    }
+    
+    def __init__(self, api_key, connect_timeout=3.0, read_timeout=15.0):
+        self.api_key = api_key
+        self.timeout = connect_timeout + read_timeout
+        
+        import google.generativeai as genai
+        self.genai = genai
+        
+        # Configure once; the model object is reused for every call
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(self.params['model'])
+        self.generation_config = genai.types.GenerationConfig(
+            max_output_tokens=self.params['max_output_tokens'],
+            temperature=self.params['temperature'],
+            top_p=self.params['top_p'],
+            top_k=self.params['top_k']
+        )
+    
+    def cache_params(self):
+        """Parameters that change the output; part of the suggestion cache key"""
+        return {'provider': self.name, **self.params}
+    
+    def generate(self, prompt, max_output_tokens=None):
+        response = self.model.generate_content(
+            prompt,
+            generation_config=self.get_generation_config(max_output_tokens),
+            request_options={'timeout': self.timeout}
+        )
+        return response.text.strip()
+    
+    async def agenerate(self, prompt, max_output_tokens=None):
+        # The SDK's async client awaits the response on the event loop
+        response = await self.model.generate_content_async(
+            prompt,
+            generation_config=self.get_generation_config(max_output_tokens),
+            request_options={'timeout': self.timeout}
+        )
+        return response.text.strip()
+    
+    def get_generation_config(self, max_output_tokens=None):
+        if not max_output_tokens:
+            return self.generation_config
+        return self.genai.types.GenerationConfig(
+            max_output_tokens=max_output_tokens,
+            temperature=self.params['temperature'],
+            top_p=self.params['top_p'],
+            top_k=self.params['top_k']
+        )
+    
+    def stream(self, prompt):
+        response = self.model.generate_content(
+            prompt,
+            generation_config=self.generation_config,
+            stream=True,
+            request_options={'timeout': self.timeout}
+        )
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+def make_gemini_provider():
+    """Build the Gemini provider from settings, or None without an API key"""
+    api_key = getattr(settings, 'GEMINI_API_KEY', None)
+    if not api_key or api_key == "your-gemini-api-key-here":
+        return None
+    config = getattr(settings, 'AI_PROVIDER_CLIENT', {})
+    return GeminiProvider(
+        api_key,
+        connect_timeout=config.get('CONNECT_TIMEOUT', 3.0),
+        read_timeout=config.get('READ_TIMEOUT', 15.0),
+    )
@@ -0,0 +1,121 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from ai_assistant.ai_helpers import generate_ai_suggestion, stream_ai_suggestion
+from ai_assistant.cache import get_suggestion_cache, reset_suggestion_cache
+from ai_assistant.client import get_provider_client
+
+PROMPT_TYPES = ('continuation', 'character', 'plot_twist', 'dialogue', 'description')
+GENRES = ('fantasy', 'mystery', 'sci-fi', None)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = "Benchmark the AI suggestion pipeline end to end against the simulated provider"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--contexts', type=int, default=50, help="Distinct story contexts; fewer means more cache hits")
+        parser.add_argument('--latency', default='lognormal', choices=('fixed', 'uniform', 'lognormal'))
+        parser.add_argument('--latency-median', type=float, default=0.8)
+        parser.add_argument('--latency-spread', type=float, default=0.5)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--timeout-rate', type=float, default=0.0)
+        parser.add_argument('--words', type=int, default=40)
+        parser.add_argument('--stream', action='store_true', help="Measure time to first chunk as well as total time")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        contexts = [
+            ' '.join(f'Passage {index} word{rng.randint(0, 500)}.' for _ in range(20))
+            for index in range(options['contexts'])
+        ]
+        workload = [
+            (rng.choice(contexts), rng.choice(PROMPT_TYPES), rng.choice(GENRES))
+            for _ in range(options['requests'])
+        ]
+
+        simulated = {
+            'SEED': options['seed'],
+            'WORDS': options['words'],
+            'WORDS_JITTER': options['words'] // 4,
+            'CHUNK_WORDS': 4,
+            'LATENCY': options['latency'],
+            'LATENCY_MEDIAN': options['latency_median'],
+            'LATENCY_SPREAD': options['latency_spread'],
+            'ERROR_RATE': options['error_rate'],
+            'TIMEOUT_RATE': options['timeout_rate'],
+        }
+        with override_settings(AI_PROVIDER='simulated', AI_SIMULATED_PROVIDER=simulated):
+            reset_suggestion_cache()
+            run = self.run_streamed if options['stream'] else self.run_generated
+
+            # Injected failures would otherwise log a traceback per request
+            logging.disable(logging.ERROR)
+            try:
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                    results = list(executor.map(lambda request: run(*request), workload))
+                elapsed = time.perf_counter() - started
+            finally:
+                logging.disable(logging.NOTSET)
+
+            provider_stats = get_provider_client().metrics.snapshot()
+            cache_stats = get_suggestion_cache().stats()
+            reset_suggestion_cache()
+
+        self.stdout.write(
+            f"{len(workload)} requests, concurrency {options['concurrency']}, "
+            f"{options['latency']} latency median {options['latency_median']}s, "
+            f"error rate {options['error_rate']}, timeout rate {options['timeout_rate']}"
+        )
+        self.stdout.write(f"  wall time     {elapsed:8.2f} s  ({len(workload) / elapsed:.1f} req/s)")
+        self.report("total", [total for total, _ in results])
+        if options['stream']:
+            self.report("first chunk", [first for _, first in results])
+
+        calls = sum(stats['calls'] for stats in provider_stats.values())
+        successes = sum(stats['successes'] for stats in provider_stats.values())
+        errors = {}
+        for stats in provider_stats.values():
+            for name, count in stats['errors'].items():
+                errors[name] = errors.get(name, 0) + count
+        self.stdout.write(f"  provider      {calls} calls, {successes} succeeded, errors {errors or 'none'}")
+        if not options['stream']:
+            self.stdout.write(
+                f"  cache         hit rate {cache_stats['hit_rate']:.2f}, "
+                f"{cache_stats['coalesced']} coalesced, {cache_stats['upstream_calls']} upstream calls"
+            )
+
+    def run_generated(self, context, prompt_type, genre):
+        started = time.perf_counter()
+        generate_ai_suggestion(context, prompt_type, genre)
+        return time.perf_counter() - started, None
+
+    def run_streamed(self, context, prompt_type, genre):
+        started = time.perf_counter()
+        first = None
+        for _ in stream_ai_suggestion(context, prompt_type, genre):
+            if first is None:
+                first = time.perf_counter() - started
+        return time.perf_counter() - started, first
+
+    def report(self, label, latencies):
+        self.stdout.write(
+            f"  {label:<13} p50 {percentile(latencies, 0.5) * 1000:8.1f} ms  "
+            f"p95 {percentile(latencies, 0.95) * 1000:8.1f} ms  "
+            f"p99 {percentile(latencies, 0.99) * 1000:8.1f} ms"
+        )
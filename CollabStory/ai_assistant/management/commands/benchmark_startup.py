@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# What a fresh web worker does before it can serve its first request
+STARTUP_SCRIPT = """
+import importlib
+import django
+django.setup()
+from django.conf import settings
+importlib.import_module(settings.ROOT_URLCONF)
+for path in (getattr(settings, 'ASGI_APPLICATION', None), settings.WSGI_APPLICATION):
+    if path:
+        importlib.import_module(path.rsplit('.', 1)[0])
+"""
+
+WATCHED_MODULES = ('google.generativeai', 'numpy', 'celery')
+
+
+def parse_importtime(output):
+    """Yield (module, self_us, cumulative_us) from ``python -X importtime`` output"""
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        yield module.strip(), int(self_us), int(cumulative_us)
+
+
+class Command(BaseCommand):
+    help = "Measure cold-start import time of a web worker, broken down by app and package"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help="Runs to take the fastest of")
+        parser.add_argument('--top', type=int, default=10, help="Third-party packages to list")
+
+    def handle(self, *args, **options):
+        best = None
+        for _ in range(options['repeat']):
+            run = self.measure()
+            if best is None or run[0] < best[0]:
+                best = run
+        wall, modules = best
+
+        app_roots = {config.name.split('.')[0] for config in apps.get_app_configs()}
+        by_root = defaultdict(int)
+        for module, self_us, _ in modules:
+            by_root[module.split('.')[0]] += self_us
+
+        self.stdout.write(f"Worker startup: {wall * 1000:.0f} ms wall, {sum(by_root.values()) / 1000:.0f} ms importing")
+        self.stdout.write("\nProject apps (self time, excluding their dependencies):")
+        for config in apps.get_app_configs():
+            root = config.name.split('.')[0]
+            if root != 'django':
+                self.stdout.write(f"  {config.label:<20} {by_root.get(root, 0) / 1000:8.1f} ms")
+        project = settings.SETTINGS_MODULE.split('.')[0]
+        self.stdout.write(f"  {project + ' (project)':<20} {by_root.get(project, 0) / 1000:8.1f} ms")
+
+        self.stdout.write(f"\nTop {options['top']} packages:")
+        others = sorted(
+            ((root, us) for root, us in by_root.items() if root not in app_roots or root == 'django'),
+            key=lambda item: -item[1]
+        )
+        for root, us in others[:options['top']]:
+            self.stdout.write(f"  {root:<20} {us / 1000:8.1f} ms")
+
+        imported = {module: cumulative for module, _, cumulative in modules}
+        self.stdout.write("\nHeavy optional dependencies:")
+        for module in WATCHED_MODULES:
+            if module in imported:
+                self.stdout.write(f"  {module:<20} imported ({imported[module] / 1000:.1f} ms cumulative)")
+            else:
+                self.stdout.write(f"  {module:<20} not imported")
+
+    def measure(self):
+        """Start a fresh interpreter and return (wall seconds, import timings)"""
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+            env=env, capture_output=True, text=True, cwd=settings.BASE_DIR, check=True
+        )
+        return time.perf_counter() - started, list(parse_importtime(result.stderr))
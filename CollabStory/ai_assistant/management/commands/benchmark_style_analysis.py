@@ -0,0 +1,103 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from ai_assistant.ai_helpers import analyze_writing_style, analyze_writing_style_batch
+
+WORDS = (
+    'the', 'lantern', 'flickered', 'as', 'a', 'stranger', 'stepped', 'through', 'door',
+    'carrying', 'map', 'nobody', 'had', 'seen', 'before', 'and', 'silence', 'fell', 'over',
+    'room', 'while', 'storm', 'gathered', 'beyond', 'hills', 'where', 'old', 'promises',
+    'Waited', 'To', 'Be', 'Kept', 'quietly', 'under', 'moonlight', 'captain', 'river',
+)
+
+
+def legacy_analyze_writing_style(text):
+    """The multi-pass analyzer this benchmark compares against"""
+    if not text:
+        return {"error": "No text provided"}
+    
+    words = text.split()
+    sentences = text.split('.')
+    word_count = len(words)
+    sentence_count = len([s for s in sentences if s.strip()])
+    avg_sentence_length = word_count / sentence_count if sentence_count > 0 else 0
+    unique_words = len(set(word.lower() for word in words))
+    vocabulary_diversity = unique_words / word_count if word_count > 0 else 0
+    dialogue_lines = [line for line in text.split('\n') if line.strip().startswith('"')]
+    dialogue_ratio = len(dialogue_lines) / len([line for line in text.split('\n') if line.strip()]) if text.split('\n') else 0
+    
+    return {
+        "word_count": word_count,
+        "sentence_count": sentence_count,
+        "avg_sentence_length": round(avg_sentence_length, 2),
+        "vocabulary_diversity": round(vocabulary_diversity, 3),
+        "dialogue_ratio": round(dialogue_ratio, 3),
+    }
+
+
+def make_paragraph(rng):
+    sentences = []
+    for _ in range(rng.randint(1, 4)):
+        sentences.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 30))) + '.')
+    paragraph = ' '.join(sentences)
+    return f'"{paragraph}"' if rng.random() < 0.3 else paragraph
+
+
+def make_text(rng, size):
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = make_paragraph(rng)
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return '\n\n'.join(paragraphs)
+
+
+class Command(BaseCommand):
+    help = "Benchmark analyze_writing_style against the legacy multi-pass analyzer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=float, default=4.0, help="Size of the single large text")
+        parser.add_argument('--nodes', type=int, default=5000, help="Number of node-sized texts in the batch test")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        repeat = options['repeat']
+        
+        text = make_text(rng, int(options['size_mb'] * 1024 * 1024))
+        self.stdout.write(f"Single text: {len(text) / 1024 / 1024:.1f} MB")
+        legacy = self.best_of(repeat, legacy_analyze_writing_style, text)
+        current = self.best_of(repeat, analyze_writing_style, text)
+        self.report("legacy", legacy, len(text))
+        self.report("single-pass", current, len(text))
+        
+        # The rewrite must not change any metric
+        expected = legacy_analyze_writing_style(text)
+        actual = analyze_writing_style(text)
+        mismatched = [key for key in expected if expected[key] != actual[key]]
+        if mismatched:
+            self.stderr.write(self.style.ERROR(f"Metrics differ from legacy: {', '.join(mismatched)}"))
+        
+        nodes = [make_text(rng, rng.randint(200, 2000)) for _ in range(options['nodes'])]
+        total = sum(len(node) for node in nodes)
+        self.stdout.write(f"\nBatch: {len(nodes)} texts, {total / 1024 / 1024:.1f} MB")
+        legacy = self.best_of(repeat, lambda: [legacy_analyze_writing_style(node) for node in nodes])
+        batch = self.best_of(repeat, analyze_writing_style_batch, nodes)
+        self.report("legacy, one call per text", legacy, total)
+        self.report("batch", batch, total)
+
+    def best_of(self, repeat, func, *args):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func(*args)
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    def report(self, label, seconds, size):
+        throughput = size / 1024 / 1024 / seconds if seconds else float('inf')
+        self.stdout.write(f"  {label:<28} {seconds * 1000:9.1f} ms  {throughput:8.1f} MB/s")
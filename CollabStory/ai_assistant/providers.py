@@ -0,0 +1,217 @@
+"""
+AI text providers.
+
+A provider turns a prompt into text, either all at once with ``generate`` (or
+``agenerate`` from async code) or incrementally with ``stream``.
+``AI_PROVIDER`` selects the provider: "gemini" talks to Google Gemini,
+"simulated" (alias "fake") produces deterministic text locally with
+configurable latency and failures so the suggestion pipeline can be exercised
+and benchmarked without network access. A dotted path to any provider class
+or factory can be given instead of a name.
+
+Providers are registered by dotted path and imported on first use, so
+processes that never generate a suggestion never import a vendor SDK.
+"""
+
+import asyncio
+import hashlib
+import math
+import random
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+class Provider:
+    """
+    Interface every AI provider implements
+
+    Subclasses must implement ``generate``; ``stream`` defaults to yielding
+    the whole response as a single chunk and ``agenerate`` to running
+    ``generate`` on a worker thread. Providers whose SDK has an async API
+    override ``agenerate`` so a waiting call holds no thread.
+    """
+    
+    name = None
+    
+    def cache_params(self):
+        """Parameters that change the output; part of the suggestion cache key"""
+        return {'provider': self.name}
+    
+    def generate(self, prompt, max_output_tokens=None):
+        raise NotImplementedError
+    
+    async def agenerate(self, prompt, max_output_tokens=None):
+        return await sync_to_async(self.generate, thread_sensitive=False)(prompt, max_output_tokens)
+    
+    def stream(self, prompt):
+        yield self.generate(prompt)
+
+
+class SimulatedProviderError(Exception):
+    """Failure injected by the simulated provider"""
+
+
+class SimulatedProvider(Provider):
+    """
+    Offline provider with deterministic text and injected latency and errors
+
+    The text depends only on ``seed`` and the prompt, so runs are repeatable.
+    Latency and failures are drawn from a separate generator seeded with the
+    same ``seed``; across a run they follow the configured distributions.
+    Latency is split between the time to the first chunk and the remaining
+    chunks so streaming looks like a real model.
+    """
+    
+    name = 'simulated'
+    WORDS = (
+        'the', 'lantern', 'flickered', 'as', 'a', 'stranger', 'stepped', 'through',
+        'door', 'carrying', 'map', 'nobody', 'had', 'seen', 'before', 'and',
+        'silence', 'fell', 'over', 'room', 'while', 'storm', 'gathered', 'beyond',
+        'hills', 'where', 'old', 'promises', 'waited', 'to', 'be', 'kept',
+    )
+    LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+    
+    def __init__(self, seed=0, words=40, words_jitter=0, chunk_words=4,
+                 latency='fixed', latency_median=0.0, latency_spread=0.0,
+                 first_chunk_share=0.3, error_rate=0.0, timeout_rate=0.0,
+                 timeout=18.0, sleep=time.sleep, async_sleep=asyncio.sleep):
+        if latency not in self.LATENCY_DISTRIBUTIONS:
+            raise ImproperlyConfigured(
+                f"Unknown simulated latency distribution {latency!r}; "
+                f"expected one of {', '.join(self.LATENCY_DISTRIBUTIONS)}"
+            )
+        self.seed = seed
+        self.words = words
+        self.words_jitter = words_jitter
+        self.chunk_words = max(1, chunk_words)
+        self.latency = latency
+        self.latency_median = latency_median
+        self.latency_spread = latency_spread
+        self.first_chunk_share = first_chunk_share
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        self.sleep = sleep
+        self.async_sleep = async_sleep
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+    
+    def cache_params(self):
+        return {'provider': self.name, 'seed': self.seed, 'words': self.words}
+    
+    def generate(self, prompt, max_output_tokens=None):
+        return ''.join(self.stream(prompt, max_output_tokens)).strip()
+    
+    async def agenerate(self, prompt, max_output_tokens=None):
+        latency, outcome = self._draw()
+        chunks = self._chunks(prompt, max_output_tokens)
+        
+        if outcome == 'timeout':
+            await self.async_sleep(self.timeout)
+            raise TimeoutError(f"Simulated provider timed out after {self.timeout}s")
+        
+        await self.async_sleep(latency * self.first_chunk_share)
+        if outcome == 'error':
+            raise SimulatedProviderError("Simulated provider error")
+        if len(chunks) > 1:
+            await self.async_sleep(latency * (1 - self.first_chunk_share))
+        return ''.join(chunks).strip()
+    
+    def stream(self, prompt, max_output_tokens=None):
+        latency, outcome = self._draw()
+        chunks = self._chunks(prompt, max_output_tokens)
+        
+        if outcome == 'timeout':
+            self.sleep(self.timeout)
+            raise TimeoutError(f"Simulated provider timed out after {self.timeout}s")
+        
+        self.sleep(latency * self.first_chunk_share)
+        if outcome == 'error':
+            raise SimulatedProviderError("Simulated provider error")
+        
+        per_chunk = latency * (1 - self.first_chunk_share) / max(1, len(chunks) - 1)
+        for index, chunk in enumerate(chunks):
+            if index:
+                self.sleep(per_chunk)
+            yield chunk
+    
+    def _draw(self):
+        """Draw this call's latency and outcome from the shared generator"""
+        with self._rng_lock:
+            roll = self._rng.random()
+            if self.latency == 'uniform':
+                latency = self._rng.uniform(
+                    max(0.0, self.latency_median - self.latency_spread),
+                    self.latency_median + self.latency_spread
+                )
+            elif self.latency == 'lognormal' and self.latency_median > 0:
+                # latency_spread is the sigma of the underlying normal
+                latency = self._rng.lognormvariate(math.log(self.latency_median), self.latency_spread)
+            else:
+                latency = self.latency_median
+        
+        if roll < self.timeout_rate:
+            return latency, 'timeout'
+        if roll < self.timeout_rate + self.error_rate:
+            return latency, 'error'
+        return latency, 'ok'
+    
+    def _chunks(self, prompt, max_output_tokens=None):
+        rng = random.Random(hashlib.sha256(f'{self.seed}:{prompt}'.encode('utf-8')).hexdigest())
+        count = self.words + rng.randint(-self.words_jitter, self.words_jitter)
+        if max_output_tokens:
+            # Roughly three words per four tokens
+            count = min(count, max_output_tokens * 3 // 4)
+        words = [rng.choice(self.WORDS) for _ in range(max(1, count))]
+        return [
+            ' '.join(words[start:start + self.chunk_words]) + ' '
+            for start in range(0, len(words), self.chunk_words)
+        ]
+
+
+def make_simulated_provider():
+    config = getattr(settings, 'AI_SIMULATED_PROVIDER', {})
+    client_config = getattr(settings, 'AI_PROVIDER_CLIENT', {})
+    return SimulatedProvider(
+        seed=config.get('SEED', 0),
+        words=config.get('WORDS', 40),
+        words_jitter=config.get('WORDS_JITTER', 0),
+        chunk_words=config.get('CHUNK_WORDS', 4),
+        latency=config.get('LATENCY', 'fixed'),
+        latency_median=config.get('LATENCY_MEDIAN', 0.0),
+        latency_spread=config.get('LATENCY_SPREAD', 0.0),
+        first_chunk_share=config.get('FIRST_CHUNK_SHARE', 0.3),
+        error_rate=config.get('ERROR_RATE', 0.0),
+        timeout_rate=config.get('TIMEOUT_RATE', 0.0),
+        timeout=client_config.get('CONNECT_TIMEOUT', 3.0) + client_config.get('READ_TIMEOUT', 15.0),
+    )
+
+
+# Provider name -> dotted path of a callable returning a provider (or None
+# when the provider is not configured). Modules are imported on first use.
+PROVIDERS = {
+    'gemini': 'ai_assistant.gemini.make_gemini_provider',
+    'simulated': 'ai_assistant.providers.make_simulated_provider',
+    'fake': 'ai_assistant.providers.make_simulated_provider',
+}
+
+
+def register_provider(name, path):
+    """Make a provider factory available under an AI_PROVIDER name"""
+    PROVIDERS[name] = path
+
+
+def get_provider():
+    """Return the configured AI provider, or None when AI is not configured"""
+    name = getattr(settings, 'AI_PROVIDER', 'gemini')
+    path = PROVIDERS.get(name, name if '.' in name else None)
+    if path is None:
+        raise ImproperlyConfigured(
+            f"Unknown AI_PROVIDER {name!r}; expected one of {', '.join(PROVIDERS)} or a dotted path"
+        )
+    return import_string(path)()
@@ -0,0 +1,65 @@
+"""
+HyperLogLog sketch for approximate distinct-word counts.
+
+A sketch is a fixed-size array of registers that can be updated one word at a
+time and merged with another sketch by taking the register-wise maximum, so
+per-node vocabularies can be rolled into per-story and per-author totals
+without ever storing the words themselves. With the default precision of 11
+the sketch takes 2 KiB and the typical error is about 2.3%.
+"""
+
+import hashlib
+import math
+
+DEFAULT_PRECISION = 11
+
+
+class HyperLogLog:
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            registers = bytearray(self.size)
+        elif len(registers) != self.size:
+            raise ValueError(f"Expected {self.size} registers, got {len(registers)}")
+        self.registers = bytearray(registers)
+
+    @classmethod
+    def from_bytes(cls, data, precision=DEFAULT_PRECISION):
+        if not data:
+            return cls(precision)
+        return cls(precision, bytes(data))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    def add(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Estimated number of distinct values added"""
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        if estimate <= 2.5 * size:
+            # Small-range correction: linear counting over empty registers
+            empty = self.registers.count(0)
+            if empty:
+                estimate = size * math.log(size / empty)
+        return int(round(estimate))
@@ -0,0 +1,149 @@
+import logging
+
+from asgiref.sync import async_to_sync, sync_to_async
+from celery import shared_task
+from channels.layers import get_channel_layer
+from django.utils import timezone
+
+from CollabStory.jobs import async_body
+from CollabStory.metrics import GROUP_SENDS
+from stories.models import AISuggestionJob
+from stories.prompts import record_ai_prompts
+from .ai_helpers import (
+    agenerate_ai_suggestion, agenerate_ai_suggestions_batch, generate_ai_suggestion, generate_ai_suggestions_batch,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def run_suggestion_job(job_id):
+    """Generate the suggestion for an AISuggestionJob and push it to the story room"""
+    started = start_job(job_id)
+    if started is None:
+        return
+    
+    job, context = started
+    try:
+        suggestions = generate_job_suggestions(job, context)
+    except Exception as e:
+        fail_job(job, e)
+        return
+    
+    for prompt in finish_job(job, context, suggestions):
+        broadcast_suggestion(job, prompt)
+
+
+@async_body(run_suggestion_job)
+async def arun_suggestion_job(job_id):
+    """run_suggestion_job for an event loop; waiting on the provider holds no thread"""
+    started = await sync_to_async(start_job)(job_id)
+    if started is None:
+        return
+    
+    job, context = started
+    try:
+        suggestions = await agenerate_job_suggestions(job, context)
+    except Exception as e:
+        await sync_to_async(fail_job)(job, e)
+        return
+    
+    for prompt in await sync_to_async(finish_job)(job, context, suggestions):
+        await abroadcast_suggestion(job, prompt)
+
+
+def generate_job_suggestions(job, context):
+    """{prompt type: suggestion} for everything the job asked for"""
+    story = job.story
+    if job.is_batch:
+        # One provider call and one INSERT for every requested type
+        return generate_ai_suggestions_batch(context, job.prompt_types, story.genre, story_id=story.id)
+    return {job.prompt_type: generate_ai_suggestion(context, job.prompt_type, story.genre, story_id=story.id)}
+
+
+async def agenerate_job_suggestions(job, context):
+    story = job.story
+    if job.is_batch:
+        return await agenerate_ai_suggestions_batch(context, job.prompt_types, story.genre, story_id=story.id)
+    return {job.prompt_type: await agenerate_ai_suggestion(context, job.prompt_type, story.genre, story_id=story.id)}
+
+
+def start_job(job_id):
+    """Claim the job and build its story context; None if there is nothing to do"""
+    job = claim_job(job_id)
+    if job is None:
+        return None
+    try:
+        return job, job.story.get_ai_context()
+    except Exception as e:
+        fail_job(job, e)
+        return None
+
+
+def finish_job(job, context, suggestions):
+    """Store the suggestions and complete the job; returns the prompts, or [] if the job failed"""
+    try:
+        prompts = record_ai_prompts(job.story, suggestions.items(), context, job=job)
+    except Exception as e:
+        fail_job(job, e)
+        return []
+    complete_job(job)
+    return prompts
+
+
+def claim_job(job_id):
+    """Load a pending job and mark it running, or return None if it is gone or already claimed"""
+    try:
+        job = AISuggestionJob.objects.select_related('story').get(id=job_id)
+    except AISuggestionJob.DoesNotExist:
+        logger.warning("AI suggestion job %s no longer exists", job_id)
+        return None
+    
+    # Celery may redeliver a task; only the first delivery does the work
+    claimed = AISuggestionJob.objects.filter(
+        id=job.id, status=AISuggestionJob.STATUS_PENDING
+    ).update(status=AISuggestionJob.STATUS_RUNNING, started_at=timezone.now())
+    return job if claimed else None
+
+
+def fail_job(job, error):
+    # exc_info from the error itself: this may run on another thread than the one that caught it
+    logger.error("AI suggestion job %s failed", job.id, exc_info=error)
+    job.status = AISuggestionJob.STATUS_FAILED
+    job.error = str(error)
+    job.completed_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'completed_at'])
+
+
+def complete_job(job):
+    job.status = AISuggestionJob.STATUS_COMPLETED
+    job.completed_at = timezone.now()
+    job.save(update_fields=['status', 'completed_at'])
+
+
+def broadcast_suggestion(job, prompt):
+    """Send a finished suggestion to everyone connected to the story"""
+    async_to_sync(abroadcast_suggestion)(job, prompt)
+
+
+async def abroadcast_suggestion(job, prompt):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    
+    GROUP_SENDS.inc('ai_suggestion_update')
+    try:
+        await channel_layer.group_send(
+            f'story_{job.story_id}',
+            {
+                'type': 'ai_suggestion_update',
+                'suggestion': prompt.generated_text,
+                'prompt_type': prompt.prompt_type,
+                'author': 'AI Assistant',
+                'prompt_id': prompt.id,
+                'job_id': job.id,
+            }
+        )
+    except Exception:
+        # The result stays pollable even when the channel layer is down
+        logger.warning("Could not broadcast AI suggestion job %s", job.id, exc_info=True)
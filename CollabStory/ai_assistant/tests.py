@@ -1,3 +1,520 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import random
+import subprocess
+import tempfile
+import sys
+import threading
+import time
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from .catalogue import CatalogueLoader, SuggestionCatalogue
+from .cache import SuggestionCache, make_cache_key, reset_suggestion_cache
+from .views import cache_stats
+from CollabStory.metrics import REGISTRY
+from .client import CircuitBreaker, CircuitOpenError, ProviderBusyError, ProviderClient
+from .ai_helpers import (
+    analyze_writing_style, analyze_writing_style_batch, generate_ai_suggestion,
+    generate_ai_suggestions_batch, parse_batch_response,
+)
+from .management.commands.benchmark_style_analysis import legacy_analyze_writing_style
+from .management.commands.benchmark_startup import STARTUP_SCRIPT
+from .providers import SimulatedProvider, SimulatedProviderError, get_provider
+from .sketch import HyperLogLog
 
-# Create your tests here.
+
+class SuggestionCacheTest(SimpleTestCase):
+    def test_key_ignores_whitespace_but_not_inputs(self):
+        """Keys normalize whitespace and change with any other input"""
+        key = make_cache_key("The  door\nopened.", 'plot_twist', 'horror', {'temperature': 0.8})
+        self.assertEqual(key, make_cache_key("The door opened. ", 'plot_twist', 'horror', {'temperature': 0.8}))
+        self.assertNotEqual(key, make_cache_key("The door opened.", 'dialogue', 'horror', {'temperature': 0.8}))
+        self.assertNotEqual(key, make_cache_key("The door opened.", 'plot_twist', 'horror', {'temperature': 0.9}))
+        
+    def test_ttl_and_lru_eviction(self):
+        """Entries expire after the TTL and the least recently used is evicted"""
+        now = [0.0]
+        cache = SuggestionCache(max_entries=2, ttl=10, clock=lambda: now[0])
+        cache.get_or_generate('a', lambda: 'A')
+        cache.get_or_generate('b', lambda: 'B')
+        cache.get_or_generate('a', lambda: 'unused')
+        cache.get_or_generate('c', lambda: 'C')
+        self.assertEqual(cache.get_or_generate('a', lambda: 'A2'), 'A')
+        self.assertEqual(cache.get_or_generate('b', lambda: 'B2'), 'B2')
+        
+        now[0] = 11
+        self.assertEqual(cache.get_or_generate('a', lambda: 'A3'), 'A3')
+        self.assertEqual(cache.evictions, 2)
+        
+    def test_concurrent_misses_share_one_upstream_call(self):
+        """Concurrent identical requests are coalesced"""
+        cache = SuggestionCache()
+        release = threading.Event()
+        calls = []
+        
+        def generate():
+            calls.append(1)
+            release.wait(5)
+            return 'shared'
+        
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_generate('k', generate)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while cache.stats()['coalesced'] < 4 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(cache.stats()['coalesced'], 4)
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['shared'] * 5)
+        self.assertEqual(cache.stats()['upstream_calls_saved'], 4)
+        
+    def test_async_misses_share_one_upstream_call(self):
+        """Coroutines asking for the same key are coalesced like threads"""
+        cache = SuggestionCache()
+        calls = []
+        
+        async def generate():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'shared'
+        
+        async def lookups():
+            return await asyncio.gather(*(cache.aget_or_generate('k', generate) for _ in range(3)))
+        
+        self.assertEqual(async_to_sync(lookups)(), ['shared'] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(async_to_sync(cache.aget_or_generate)('k', generate), 'shared')
+        self.assertEqual(cache.stats()['upstream_calls_saved'], 3)
+        
+    def test_variant_pool_rotates_distinct_suggestions(self):
+        """With a variant pool, users see different cached suggestions"""
+        cache = SuggestionCache(variants=2)
+        texts = iter(['first', 'second', 'third'])
+        seen = [cache.get_or_generate('k', lambda: next(texts)) for _ in range(4)]
+        self.assertEqual(seen, ['first', 'second', 'first', 'second'])
+        stats = cache.stats()
+        self.assertEqual(stats['upstream_calls'], 2)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+
+@override_settings(
+    GEMINI_API_KEY='test-key',
+    AI_SUGGESTION_CACHE={'VARIANTS': 1, 'TTL': 60},
+    AI_PROVIDER_CLIENT={'RETRIES': 0},
+)
+class GenerateSuggestionCacheTest(SimpleTestCase):
+    def setUp(self):
+        reset_suggestion_cache()
+        self.addCleanup(reset_suggestion_cache)
+        
+    def test_repeated_request_hits_cache(self):
+        """The same prompt on the same context only reaches Gemini once"""
+        with mock.patch('ai_assistant.gemini.GeminiProvider.generate', return_value='A twist') as upstream:
+            first = generate_ai_suggestion("She ran.", 'plot_twist', 'thriller')
+            second = generate_ai_suggestion("She  ran.", 'plot_twist', 'thriller')
+        self.assertEqual(first, second)
+        upstream.assert_called_once()
+        
+    def test_errors_fall_back_and_are_not_cached(self):
+        """Upstream failures use the fallback and leave nothing cached"""
+        with mock.patch('ai_assistant.gemini.GeminiProvider.generate', side_effect=RuntimeError('down')):
+            generate_ai_suggestion("She ran.", 'setting')
+        with mock.patch('ai_assistant.gemini.GeminiProvider.generate', return_value='A forest') as upstream:
+            self.assertEqual(generate_ai_suggestion("She ran.", 'setting'), 'A forest')
+        upstream.assert_called_once()
+
+
+class CacheStatsViewTest(SimpleTestCase):
+    def setUp(self):
+        REGISTRY.reset()
+        self.addCleanup(REGISTRY.reset)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_stats_include_other_processes(self):
+        """A job worker's lookups reach the web process's stats through the metrics snapshots"""
+        worker = {
+            'pid': os.getpid(),
+            'metrics': {
+                'collabstory_ai_cache_lookups_total': {
+                    'type': 'counter', 'help': '', 'labels': ['result'],
+                    'samples': [[['hit'], 3], [['miss'], 1]],
+                },
+                'collabstory_ai_cache_upstream_calls_total': {
+                    'type': 'counter', 'help': '', 'labels': [], 'samples': [[[], 1]],
+                },
+            },
+        }
+        with open(os.path.join(self.directory.name, 'worker.json'), 'w') as file:
+            json.dump(worker, file)
+        SuggestionCache().get_or_generate('k', lambda: 'local')
+
+        request = RequestFactory().get('/')
+        request.user = mock.Mock(is_active=True, is_staff=True)
+        with override_settings(METRICS={'MULTIPROCESS_DIR': self.directory.name}):
+            stats = json.loads(cache_stats(request).content)
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['upstream_calls'], 2)
+        self.assertEqual(stats['upstream_calls_saved'], 3)
+        self.assertEqual(stats['hit_rate'], 0.6)
+
+
+class FlakyProvider:
+    name = 'flaky'
+    
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+    
+    def generate(self, prompt):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise TimeoutError('slow upstream')
+        return 'ok'
+
+
+class StreamingProvider(FlakyProvider):
+    """Streams two chunks; agenerate waits forever while ``hang`` is set"""
+    
+    def __init__(self):
+        super().__init__()
+        self.hang = True
+        self.started = asyncio.Event()
+    
+    def stream(self, prompt):
+        yield 'one'
+        yield 'two'
+    
+    async def agenerate(self, prompt):
+        self.started.set()
+        while self.hang:
+            await asyncio.sleep(0.01)
+        return 'ok'
+
+
+class ProviderClientTest(SimpleTestCase):
+    def test_retries_transient_failures_with_jitter(self):
+        """Failed attempts are retried after a jittered backoff"""
+        sleeps = []
+        client = ProviderClient(FlakyProvider(failures=2), retries=2, sleep=sleeps.append)
+        self.assertEqual(client.generate('prompt', 'dialogue'), 'ok')
+        self.assertEqual(len(sleeps), 2)
+        self.assertTrue(0 <= sleeps[1] <= 0.5)
+        
+        stats = client.metrics.snapshot()['dialogue']
+        self.assertEqual(stats['calls'], 3)
+        self.assertEqual(stats['successes'], 1)
+        self.assertEqual(stats['errors'], {'TimeoutError': 2})
+        
+    def test_open_circuit_fails_fast_until_reset(self):
+        """An open breaker skips the provider until the cool-down passes"""
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+        provider = FlakyProvider(failures=2)
+        client = ProviderClient(provider, retries=0, breaker=breaker)
+        for _ in range(2):
+            with self.assertRaises(TimeoutError):
+                client.generate('prompt')
+        
+        with self.assertRaises(CircuitOpenError):
+            client.generate('prompt')
+        self.assertEqual(provider.calls, 2)
+        
+        now[0] = 31
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(client.generate('prompt'), 'ok')
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        
+    def test_concurrency_is_bounded(self):
+        """Calls beyond max_concurrency give up after the acquire timeout"""
+        client = ProviderClient(FlakyProvider(failures=0), max_concurrency=1, acquire_timeout=0.01)
+        client._slots.acquire()
+        with self.assertRaises(ProviderBusyError):
+            client.generate('prompt')
+        client._slots.release()
+        self.assertEqual(client.generate('prompt'), 'ok')
+        
+    def test_async_generate_retries_sync_only_providers(self):
+        """agenerate applies the same retries and runs a sync-only provider off the loop"""
+        provider = FlakyProvider(failures=1)
+        client = ProviderClient(provider, retries=1, backoff_base=0)
+        self.assertEqual(async_to_sync(client.agenerate)('prompt', 'dialogue'), 'ok')
+        self.assertEqual(provider.calls, 2)
+        self.assertEqual(client.metrics.snapshot()['dialogue']['errors'], {'TimeoutError': 1})
+        
+        client._slots = threading.BoundedSemaphore(1)
+        client._slots.acquire()
+        client.acquire_timeout = 0.02
+        with self.assertRaises(ProviderBusyError):
+            async_to_sync(client.agenerate)('prompt')
+        
+    def half_open_client(self, provider, **options):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+        breaker.record_failure()
+        now[0] = 31
+        return ProviderClient(provider, retries=0, breaker=breaker, **options)
+        
+    def test_busy_probe_leaves_breaker_probing(self):
+        """A half-open call that times out waiting for a slot does not use up the probe"""
+        client = self.half_open_client(FlakyProvider(failures=0), max_concurrency=1, acquire_timeout=0.01)
+        client._slots.acquire()
+        with self.assertRaises(ProviderBusyError):
+            client.generate('prompt')
+        client._slots.release()
+        self.assertEqual(client.generate('prompt'), 'ok')
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+        
+    def test_closed_stream_releases_probe(self):
+        """A probe stream closed by its consumer lets the next call probe"""
+        client = self.half_open_client(StreamingProvider())
+        chunks = client.stream('prompt')
+        self.assertEqual(next(chunks), 'one')
+        chunks.close()
+        self.assertEqual(client.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(client.generate('prompt'), 'ok')
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+        
+    def test_cancelled_async_probe_releases_probe(self):
+        """Cancelling a half-open agenerate lets the next call probe"""
+        provider = StreamingProvider()
+        client = self.half_open_client(provider)
+        
+        async def cancel_then_retry():
+            task = asyncio.ensure_future(client.agenerate('prompt'))
+            await provider.started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            provider.hang = False
+            return await client.agenerate('prompt')
+        
+        self.assertEqual(async_to_sync(cancel_then_retry)(), 'ok')
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+        
+    def test_open_circuit_uses_fallback_immediately(self):
+        """generate_ai_suggestion answers from the fallbacks while the circuit is open"""
+        with mock.patch('ai_assistant.ai_helpers.get_provider_client') as get_client:
+            get_client.return_value.generate.side_effect = CircuitOpenError()
+            get_client.return_value.cache_params.return_value = {}
+            reset_suggestion_cache()
+            suggestion = generate_ai_suggestion("She ran.", 'conflict')
+        self.assertTrue(suggestion)
+
+
+class BatchSuggestionTest(SimpleTestCase):
+    def test_parse_ignores_prose_and_unknown_keys(self):
+        """Batch parsing pulls the JSON object out of surrounding text"""
+        text = 'Sure! {"plot_twist": " The map is fake. ", "extra": "x", "dialogue": 3} Enjoy.'
+        self.assertEqual(parse_batch_response(text, ['plot_twist', 'dialogue']), {'plot_twist': 'The map is fake.'})
+        self.assertEqual(parse_batch_response('no json here', ['plot_twist']), {})
+        
+    def test_missing_types_get_fallbacks(self):
+        """Types the model skipped are filled from the fallback suggestions"""
+        reset_suggestion_cache()
+        self.addCleanup(reset_suggestion_cache)
+        client = mock.Mock()
+        client.cache_params.return_value = {}
+        client.generate.return_value = '{"conflict": "A flood."}'
+        with mock.patch('ai_assistant.ai_helpers.get_provider_client', return_value=client):
+            suggestions = generate_ai_suggestions_batch("Rain.", ['conflict', 'character'])
+        self.assertEqual(list(suggestions), ['conflict', 'character'])
+        self.assertEqual(suggestions['conflict'], 'A flood.')
+        self.assertTrue(suggestions['character'])
+
+
+class WritingStyleTest(SimpleTestCase):
+    SAMPLES = [
+        'One sentence only',
+        'Short. Very short. Tiny.\n\n"Hello," she said. "Is anyone there?"\n  "No."',
+        'Mr. Smith went to Washington...   and then?\n\t\n\u00c9COLE école ÉCOLE.',
+        '"' + 'word ' * 60 + '.\n' + 'Another line with Words words WORDS.',
+    ]
+    
+    def test_single_pass_matches_legacy_metrics(self):
+        """The single-pass analyzer reports the same numbers as the old one"""
+        for text in self.SAMPLES:
+            with self.subTest(text=text):
+                result = analyze_writing_style(text)
+                for key, value in legacy_analyze_writing_style(text).items():
+                    self.assertEqual(result[key], value)
+                    
+    def test_whitespace_only_text_does_not_crash(self):
+        """Text with no content lines reports zero ratios"""
+        self.assertEqual(analyze_writing_style('  \n ')['dialogue_ratio'], 0)
+
+    def test_long_blank_runs_take_linear_time(self):
+        """A megabyte of whitespace between periods is counted in well under a second"""
+        text = 'Start.' + ' ' * 1_000_000 + '.End'
+        started = time.perf_counter()
+        result = analyze_writing_style(text)
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual(result['avg_sentence_length'], 1)
+        
+    def test_batch_matches_single_analysis(self):
+        """Batch results are identical to analyzing each text on its own"""
+        texts = self.SAMPLES + ['']
+        self.assertEqual(
+            analyze_writing_style_batch(texts),
+            [analyze_writing_style(text) for text in texts]
+        )
+        self.assertEqual(analyze_writing_style_batch([]), [])
+
+
+class HyperLogLogTest(SimpleTestCase):
+    def test_estimate_is_close_and_merge_is_a_union(self):
+        """Merged sketches estimate the size of the union"""
+        first, second = HyperLogLog(), HyperLogLog()
+        first.update(f'word{i}' for i in range(6000))
+        second.update(f'word{i}' for i in range(4000, 10000))
+        self.assertAlmostEqual(first.count(), 6000, delta=6000 * 0.08)
+        
+        merged = HyperLogLog.from_bytes(first.to_bytes()).merge(second)
+        self.assertAlmostEqual(merged.count(), 10000, delta=10000 * 0.08)
+        
+    def test_small_counts_are_exact_enough(self):
+        """Linear counting keeps small vocabularies accurate"""
+        sketch = HyperLogLog()
+        sketch.update(['the', 'cat', 'sat', 'the'])
+        self.assertEqual(sketch.count(), 3)
+        self.assertEqual(HyperLogLog.from_bytes(b'').count(), 0)
+
+
+class SimulatedProviderTest(SimpleTestCase):
+    def test_text_is_deterministic_per_seed(self):
+        """The same seed and prompt always give the same text"""
+        first = SimulatedProvider(seed=7, words=30, words_jitter=5)
+        second = SimulatedProvider(seed=7, words=30, words_jitter=5)
+        self.assertEqual(first.generate('prompt'), second.generate('prompt'))
+        self.assertNotEqual(first.generate('prompt'), SimulatedProvider(seed=8).generate('prompt'))
+        self.assertEqual(len(SimulatedProvider(words=30, chunk_words=4).generate('prompt').split()), 30)
+        self.assertEqual(len(list(SimulatedProvider(words=30, chunk_words=4).stream('prompt'))), 8)
+        
+    def test_latency_is_spread_across_chunks(self):
+        """The first chunk carries its share of the latency, the rest is split evenly"""
+        sleeps = []
+        provider = SimulatedProvider(words=12, chunk_words=4, latency_median=1.0, first_chunk_share=0.4, sleep=sleeps.append)
+        provider.generate('prompt')
+        self.assertEqual(len(sleeps), 3)
+        self.assertAlmostEqual(sleeps[0], 0.4)
+        self.assertAlmostEqual(sum(sleeps), 1.0)
+        
+    def test_async_generate_matches_sync_text(self):
+        """agenerate returns the same text and waits the same latency without blocking"""
+        sleeps = []
+        
+        async def sleep(seconds):
+            sleeps.append(seconds)
+        
+        provider = SimulatedProvider(seed=3, words=12, latency_median=1.0, first_chunk_share=0.4, async_sleep=sleep)
+        text = async_to_sync(provider.agenerate)('prompt')
+        self.assertEqual(text, SimulatedProvider(seed=3, words=12).generate('prompt'))
+        self.assertAlmostEqual(sleeps[0], 0.4)
+        self.assertAlmostEqual(sum(sleeps), 1.0)
+        
+    def test_injected_failures_follow_the_rates(self):
+        """Error and timeout rates are honoured and reproducible"""
+        def outcomes(seed):
+            sleeps = []
+            provider = SimulatedProvider(seed=seed, error_rate=0.2, timeout_rate=0.1, timeout=5, sleep=sleeps.append)
+            results = []
+            for _ in range(1000):
+                try:
+                    provider.generate('prompt')
+                    results.append('ok')
+                except SimulatedProviderError:
+                    results.append('error')
+                except TimeoutError:
+                    results.append('timeout')
+            return results
+        
+        results = outcomes(3)
+        self.assertAlmostEqual(results.count('error'), 200, delta=40)
+        self.assertAlmostEqual(results.count('timeout'), 100, delta=30)
+        self.assertEqual(results, outcomes(3))
+        
+    @override_settings(AI_PROVIDER='ai_assistant.tests.FlakyProvider')
+    def test_provider_can_be_a_dotted_path(self):
+        """AI_PROVIDER accepts a dotted path to a provider class"""
+        self.assertIsInstance(get_provider(), FlakyProvider)
+
+    def test_worker_startup_does_not_import_the_sdk(self):
+        """A fresh worker loads the Gemini SDK only when a provider is built"""
+        script = STARTUP_SCRIPT + "import sys; print('google.generativeai' in sys.modules)"
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+
+class SuggestionCatalogueTest(SimpleTestCase):
+    DATA = {
+        'fallbacks': {
+            'continuation': ['Go on.', {'text': 'Run!', 'weight': 3}],
+            'setting': ['A hall.', {'text': 'A moon base.', 'genres': ['sci-fi'], 'weight': 2}],
+        },
+        'outlines': {'default': 'fantasy', 'genres': {'fantasy': ['Call', 'Return']}},
+    }
+    
+    def test_selection_is_weighted_and_genre_indexed(self):
+        """Genre entries join the generic pool and weights shape the picks"""
+        catalogue = SuggestionCatalogue(self.DATA)
+        rng = random.Random(1)
+        picks = [catalogue.choose('continuation', rng=rng) for _ in range(1000)]
+        self.assertAlmostEqual(picks.count('Run!'), 750, delta=60)
+        self.assertEqual({catalogue.choose('setting', 'mystery', rng=rng) for _ in range(50)}, {'A hall.'})
+        self.assertEqual({catalogue.choose('setting', 'sci-fi', rng=rng) for _ in range(50)}, {'A hall.', 'A moon base.'})
+        self.assertIn(catalogue.choose('unknown'), ('Go on.', 'Run!'))
+        self.assertEqual(catalogue.outline('western'), ('Call', 'Return'))
+        
+    def test_excluded_texts_are_skipped_until_exhausted(self):
+        """Already-used suggestions are not repeated while others remain"""
+        catalogue = SuggestionCatalogue(self.DATA)
+        pool = catalogue.pool('continuation')
+        used = {pool.hashes[pool.texts.index('Run!')]}
+        self.assertEqual({catalogue.choose('continuation', exclude=used) for _ in range(50)}, {'Go on.'})
+        self.assertIn(catalogue.choose('continuation', exclude=set(pool.hashes)), pool.texts)
+        
+    def test_weights_must_be_positive(self):
+        """A zero or negative weight is rejected when the catalogue is compiled"""
+        for weight in (0, -1, 'heavy'):
+            with self.assertRaises(ValueError):
+                SuggestionCatalogue({'fallbacks': {'continuation': ['Go on.', {'text': 'Stop.', 'weight': weight}]}})
+        
+    def test_sampling_skips_excluded_weight(self):
+        """Picks among the remaining texts follow their weights, with no retry loop"""
+        catalogue = SuggestionCatalogue({'fallbacks': {'continuation': [
+            {'text': 'Heavy.', 'weight': 1000}, 'Left.', {'text': 'Right.', 'weight': 3},
+        ]}})
+        pool = catalogue.pool('continuation')
+        used = {pool.hashes[0]}
+        rng = mock.Mock()
+        rng.random.side_effect = [0.2, 0.3, 0.5, 0.99]
+        picks = [pool.choose(rng, used) for _ in range(4)]
+        self.assertEqual(picks, ['Left.', 'Right.', 'Right.', 'Right.'])
+        self.assertEqual(rng.random.call_count, 4)
+        
+    def test_loader_reloads_a_changed_file(self):
+        """Edits to the data file are picked up after the reload interval"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'suggestions.json')
+            with open(path, 'w') as data_file:
+                json.dump(self.DATA, data_file)
+            now = [0.0]
+            loader = CatalogueLoader(path, reload_interval=5, clock=lambda: now[0])
+            first = loader.get()
+            self.assertIs(loader.get(), first)
+            
+            with open(path, 'w') as data_file:
+                json.dump({'fallbacks': {'continuation': ['Fresh.']}}, data_file)
+            os.utime(path, ns=(1, 10 ** 18))
+            self.assertIs(loader.get(), first)
+            now[0] = 6
+            self.assertEqual(loader.get().choose('continuation'), 'Fresh.')
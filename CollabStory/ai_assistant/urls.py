@@ -5,4 +5,6 @@ app_name = 'ai_assistant'
 
 urlpatterns = [
     path('', views.ai_dashboard, name='dashboard'),
+    path('cache/stats/', views.cache_stats, name='cache_stats'),
+    path('provider/stats/', views.provider_stats, name='provider_stats'),
 ]
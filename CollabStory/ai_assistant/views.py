@@ -1,4 +1,25 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.shortcuts import render
+from .cache import shared_stats
+from .client import get_provider_client
 
 def ai_dashboard(request):
     return render(request, 'ai_assistant/dashboard.html')
+
+@staff_member_required
+def cache_stats(request):
+    """Report suggestion cache hit rate and upstream calls saved, across all worker processes"""
+    return JsonResponse(shared_stats())
+
+@staff_member_required
+def provider_stats(request):
+    """Report AI provider latency, errors and circuit state per prompt type"""
+    client = get_provider_client()
+    if client is None:
+        return JsonResponse({'provider': None})
+    return JsonResponse({
+        'provider': client.provider.name,
+        'circuit': client.breaker.state,
+        'prompt_types': client.metrics.snapshot(),
+    })
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Story, StoryNode, Contribution, WritingSession, AIWritingPrompt, StoryBranch, StoryComment
+from django.db import transaction
+from CollabStory.jobs import submit
+from .models import Story, StoryNode, Contribution, WritingSession, AIWritingPrompt, AIPromptContext, StoryBranch, StoryComment, StorySummary, StyleStats
+from .tasks import process_cover_image
 
 @admin.register(Story)
 class StoryAdmin(admin.ModelAdmin):
@@ -27,6 +30,17 @@ class StoryAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'cover_image' in form.changed_data:
+            previous = form.initial.get('cover_image')
+            if previous:
+                # Storage counts references; this story no longer holds one
+                obj.cover_image.storage.delete(previous.name)
+            # Renders the new cover's derivatives, or removes them if it was cleared
+            name = obj.cover_image.name or ''
+            transaction.on_commit(lambda: submit(process_cover_image, obj.id, name))
 
 @admin.register(StoryNode)
 class StoryNodeAdmin(admin.ModelAdmin):
@@ -52,6 +66,24 @@ class AIWritingPromptAdmin(admin.ModelAdmin):
     list_display = ['story', 'prompt_type', 'used', 'created_at']
     list_filter = ['prompt_type', 'used', 'created_at']
     search_fields = ['story__title', 'generated_text']
+    raw_id_fields = ['prompt_context', 'jobs']
+
+@admin.register(AIPromptContext)
+class AIPromptContextAdmin(admin.ModelAdmin):
+    list_display = ['hash', 'created_at']
+    search_fields = ['hash', 'text']
+
+@admin.register(StorySummary)
+class StorySummaryAdmin(admin.ModelAdmin):
+    list_display = ['story', 'level', 'first_node_id', 'last_node_id', 'node_count', 'token_count']
+    list_filter = ['level']
+    search_fields = ['story__title', 'summary']
+
+@admin.register(StyleStats)
+class StyleStatsAdmin(admin.ModelAdmin):
+    list_display = ['story', 'user', 'node_count', 'word_count', 'sentence_count', 'updated_at']
+    search_fields = ['story__title', 'user__username']
+    exclude = ['vocabulary_sketch']
 
 @admin.register(StoryBranch)
 class StoryBranchAdmin(admin.ModelAdmin):
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class StoriesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "stories"
+
+    def ready(self):
+        # Tunes new SQLite connections when SQLITE_PROFILE is enabled
+        from CollabStory import sqlite  # noqa: F401
+        # Releases a deleted story's cover files
+        from . import covers  # noqa: F401
+        # Releases a deleted export's archive
+        from . import export  # noqa: F401
+        # Keeps completed stories' static pages up to date
+        from . import snapshots  # noqa: F401
+        # Keeps templates on hashed static file names
+        from CollabStory import checks  # noqa: F401
@@ -0,0 +1,102 @@
+"""
+Async versions of the hot story views.
+
+Under ASGI a sync view runs on a thread for the whole request. These run on
+the event loop instead: ORM calls go through the async ORM, and the
+independent reads of the story page are made concurrently with
+``gather_reads``. ``ASYNC_VIEWS`` picks these or the sync versions in
+views.py; ``manage.py benchmark_async_views`` compares the two.
+"""
+
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.db import transaction
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+from django.urls import reverse
+
+from ai_assistant.tasks import run_suggestion_job
+from CollabStory.db import gather_reads
+from CollabStory.jobs import submit
+from CollabStory.metrics import VIEW_DURATION, timed
+from .forms import StoryCommentForm, StoryNodeForm
+from .models import AISuggestionJob, Story, WritingSession
+
+
+def async_login_required(view):
+    """login_required for async views, which Django 4.2's decorator does not support"""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # Loads the session and user off the event loop; later reads of
+        # request.user (templates included) use the loaded user
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def get_story_or_404(queryset, story_id):
+    story = await queryset.filter(id=story_id).afirst()
+    if story is None:
+        raise Http404("No Story matches the given query.")
+    return story
+
+
+@async_login_required
+@timed(VIEW_DURATION, 'story_detail')
+async def story_detail(request, story_id):
+    """Display story detail and writing interface"""
+    story = await get_story_or_404(Story.objects.select_related('created_by'), story_id)
+
+    writing_session, created = await WritingSession.objects.aget_or_create(
+        story=story,
+        user=request.user,
+        defaults={'is_active': True}
+    )
+
+    # Everything the template shows, evaluated here so rendering runs no queries
+    nodes, active_writers, recent_prompts, comments, contributor_count = await gather_reads(
+        lambda: list(story.nodes.select_related('author')),
+        lambda: list(story.get_active_writers()),
+        lambda: list(story.ai_prompts.filter(used=False)[:5]),
+        lambda: list(story.comments.filter(is_resolved=False).select_related('user')[:10]),
+        lambda: story.get_contributors().count(),
+    )
+
+    context = {
+        'story': story,
+        'nodes': nodes,
+        'writing_session': writing_session,
+        'active_writers': active_writers,
+        'recent_prompts': recent_prompts,
+        'comments': comments,
+        'contributor_count': contributor_count,
+        'node_form': StoryNodeForm(),
+        'comment_form': StoryCommentForm(),
+    }
+    return render(request, 'stories/story_detail.html', context)
+
+
+@async_login_required
+async def get_ai_suggestion(request, story_id):
+    """Queue an AI writing suggestion and return its job id"""
+    story = await get_story_or_404(Story.objects.all(), story_id)
+    prompt_type = request.GET.get('type', 'continuation')
+
+    job = await AISuggestionJob.objects.acreate(
+        story=story,
+        requested_by=request.user,
+        prompt_type=prompt_type
+    )
+
+    # on_commit looks at the connection of the thread the ORM ran on
+    await sync_to_async(transaction.on_commit)(lambda: submit(run_suggestion_job, job.id))
+
+    return JsonResponse({
+        'job_id': job.id,
+        'status': job.status,
+        'prompt_type': prompt_type,
+        'status_url': reverse('stories:ai_suggestion_job', args=[job.id])
+    }, status=202)
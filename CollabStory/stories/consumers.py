@@ -1,13 +1,34 @@
+import asyncio
 import json
+import uuid
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
+from django.db import connections
 from .models import Story, WritingSession
+from .prompts import record_ai_prompts
+from ai_assistant.ai_helpers import stream_ai_suggestion
+from CollabStory.metrics import GROUP_SENDS, WEBSOCKET_CONNECTIONS
+from CollabStory.perf import instrumented
+from CollabStory.db import recycle_connections
+from CollabStory.sqlite import database_write_to_async, serializes_writes
+
+def _next_chunk(chunks):
+    try:
+        return next(chunks, None)
+    finally:
+        # Runs on a pool thread, where the fallback's lookup of used
+        # suggestions would otherwise leave a connection open
+        connections.close_all()
+
 
 class StoryConsumer(AsyncWebsocketConsumer):
+    @instrumented
     async def connect(self):
         self.story_id = self.scope['url_route']['kwargs']['story_id']
         self.room_group_name = f'story_{self.story_id}'
+        await recycle_connections()
         
         # Check if story exists
         story = await self.get_story()
@@ -22,23 +43,31 @@ class StoryConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        WEBSOCKET_CONNECTIONS.inc(self.story_id)
+        self.counted = True
         
         # Notify others that user joined
         if not isinstance(self.scope['user'], AnonymousUser):
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_activity',
-                    'message': f'{self.scope["user"].username} joined the writing session',
-                    'user': self.scope['user'].username,
-                    'activity_type': 'joined'
-                }
-            )
+            await self.broadcast({
+                'type': 'user_activity',
+                'message': f'{self.scope["user"].username} joined the writing session',
+                'user': self.scope['user'].username,
+                'activity_type': 'joined'
+            })
             
             # Update writing session
             await self.update_writing_session(True)
 
+    @instrumented
     async def disconnect(self, close_code):
+        # Nobody is left to send the suggestion to
+        if getattr(self, 'ai_task', None) is not None:
+            self.ai_task.cancel()
+        if getattr(self, 'counted', False):
+            WEBSOCKET_CONNECTIONS.dec(self.story_id)
+            self.counted = False
+        await recycle_connections()
+        
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -47,19 +76,17 @@ class StoryConsumer(AsyncWebsocketConsumer):
         
         # Notify others that user left
         if not isinstance(self.scope['user'], AnonymousUser):
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_activity',
-                    'message': f'{self.scope["user"].username} left the writing session',
-                    'user': self.scope['user'].username,
-                    'activity_type': 'left'
-                }
-            )
+            await self.broadcast({
+                'type': 'user_activity',
+                'message': f'{self.scope["user"].username} left the writing session',
+                'user': self.scope['user'].username,
+                'activity_type': 'left'
+            })
             
             # Update writing session
             await self.update_writing_session(False)
 
+    @instrumented
     async def receive(self, text_data):
         try:
             data = json.loads(text_data)
@@ -67,75 +94,66 @@ class StoryConsumer(AsyncWebsocketConsumer):
             
             if message_type == 'new_node':
                 # Broadcast new story node to all users
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'story_update',
-                        'node_content': data['content'],
-                        'author': data['author'],
-                        'node_id': data['node_id'],
-                        'created_at': data.get('created_at'),
-                        'word_count': data.get('word_count', 0)
-                    }
-                )
+                await self.broadcast({
+                    'type': 'story_update',
+                    'node_content': data['content'],
+                    'author': data['author'],
+                    'node_id': data['node_id'],
+                    'created_at': data.get('created_at'),
+                    'word_count': data.get('word_count', 0)
+                })
             
             elif message_type == 'user_typing':
                 # Broadcast typing indicator
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'typing_indicator',
-                        'user': data['user'],
-                        'is_typing': data['is_typing']
-                    }
-                )
+                await self.broadcast({
+                    'type': 'typing_indicator',
+                    'user': data['user'],
+                    'is_typing': data['is_typing']
+                })
             
             elif message_type == 'cursor_position':
                 # Broadcast cursor position for collaborative editing
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'cursor_update',
-                        'user': data['user'],
-                        'position': data['position'],
-                        'selection': data.get('selection')
-                    }
-                )
+                await self.broadcast({
+                    'type': 'cursor_update',
+                    'user': data['user'],
+                    'position': data['position'],
+                    'selection': data.get('selection')
+                })
             
             elif message_type == 'ai_suggestion':
                 # Broadcast AI suggestion
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'ai_suggestion_update',
-                        'suggestion': data['suggestion'],
-                        'prompt_type': data['prompt_type'],
-                        'author': data.get('author', 'AI Assistant')
-                    }
+                await self.broadcast({
+                    'type': 'ai_suggestion_update',
+                    'suggestion': data['suggestion'],
+                    'prompt_type': data['prompt_type'],
+                    'author': data.get('author', 'AI Assistant')
+                })
+            
+            elif message_type == 'ai_suggestion_request':
+                # Stream a new AI suggestion back as it is generated
+                await self.start_ai_suggestion(
+                    data.get('prompt_type', 'continuation'),
+                    broadcast=data.get('broadcast', False)
                 )
             
             elif message_type == 'comment':
                 # Broadcast new comment
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'comment_update',
-                        'comment': data['comment'],
-                        'author': data['author'],
-                        'comment_id': data['comment_id']
-                    }
-                )
+                await self.broadcast({
+                    'type': 'comment_update',
+                    'comment': data['comment'],
+                    'author': data['author'],
+                    'comment_id': data['comment_id']
+                })
                 
         except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'Invalid JSON data'
-            }))
+            await self.send_error('Invalid JSON data')
         except Exception as e:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': str(e)
-            }))
+            await self.send_error(str(e))
+
+    async def broadcast(self, event):
+        """Send an event to everyone connected to the story"""
+        GROUP_SENDS.inc(event['type'])
+        await self.channel_layer.group_send(self.room_group_name, event)
 
     async def story_update(self, event):
         # Send new story node to WebSocket
@@ -172,13 +190,79 @@ class StoryConsumer(AsyncWebsocketConsumer):
         }))
 
     async def ai_suggestion_update(self, event):
-        await self.send(text_data=json.dumps({
+        message = {
             'type': 'ai_suggestion',
-            'suggestion': event['suggestion'],
             'prompt_type': event['prompt_type'],
-            'author': event['author']
+            'author': event['author'],
+        }
+        # Streamed suggestions arrive as chunk frames followed by a final
+        # frame with the whole suggestion and done=True
+        for key in ('suggestion', 'prompt_id', 'job_id', 'stream_id', 'chunk', 'done'):
+            if key in event:
+                message[key] = event[key]
+        await self.send(text_data=json.dumps(message))
+
+    async def start_ai_suggestion(self, prompt_type, broadcast=False):
+        """Stream a suggestion in a task of its own, so this socket keeps handling events meanwhile"""
+        if not self.scope['user'].is_authenticated:
+            await self.send_error('Log in to request AI suggestions')
+            return
+        if getattr(self, 'ai_task', None) is not None and not self.ai_task.done():
+            await self.send_error('An AI suggestion is already being generated')
+            return
+        self.ai_task = asyncio.create_task(self.run_ai_suggestion(prompt_type, broadcast))
+
+    async def run_ai_suggestion(self, prompt_type, broadcast):
+        try:
+            await self.stream_ai_suggestion(prompt_type, broadcast)
+        except Exception as e:
+            await self.send_error(str(e))
+
+    async def send_error(self, message):
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'message': message
         }))
 
+    async def stream_ai_suggestion(self, prompt_type, broadcast=False):
+        """Generate a suggestion and forward it chunk by chunk"""
+        story, context = await self.get_ai_context()
+        if story is None:
+            return
+        
+        stream_id = uuid.uuid4().hex
+        chunks = stream_ai_suggestion(context, prompt_type, story.genre, story.id)
+        next_chunk = sync_to_async(_next_chunk, thread_sensitive=False)
+        parts = []
+        while True:
+            chunk = await next_chunk(chunks)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            await self.send_ai_frame(broadcast, {
+                'prompt_type': prompt_type,
+                'stream_id': stream_id,
+                'chunk': chunk,
+                'done': False,
+            })
+        
+        suggestion = ''.join(parts).strip()
+        prompt = await self.save_ai_prompt(story, prompt_type, suggestion, context)
+        await self.send_ai_frame(broadcast, {
+            'prompt_type': prompt_type,
+            'stream_id': stream_id,
+            'suggestion': suggestion,
+            'prompt_id': prompt.id,
+            'done': True,
+        })
+
+    async def send_ai_frame(self, broadcast, frame):
+        event = {'type': 'ai_suggestion_update', 'author': 'AI Assistant', **frame}
+        if broadcast:
+            await self.broadcast(event)
+        else:
+            await self.ai_suggestion_update(event)
+
     async def comment_update(self, event):
         await self.send(text_data=json.dumps({
             'type': 'comment',
@@ -187,27 +271,30 @@ class StoryConsumer(AsyncWebsocketConsumer):
             'comment_id': event['comment_id']
         }))
 
+    async def get_story(self):
+        return await Story.objects.filter(id=self.story_id).afirst()
+
     @database_sync_to_async
-    def get_story(self):
+    def get_ai_context(self):
         try:
-            return Story.objects.get(id=self.story_id)
+            story = Story.objects.get(id=self.story_id)
         except Story.DoesNotExist:
-            return None
+            return None, ''
+        return story, story.get_ai_context()
 
-    @database_sync_to_async
-    def update_writing_session(self, is_active):
+    @database_write_to_async
+    def save_ai_prompt(self, story, prompt_type, suggestion, context):
+        return record_ai_prompts(story, [(prompt_type, suggestion)], context)[0]
+
+    async def update_writing_session(self, is_active):
         if isinstance(self.scope['user'], AnonymousUser):
             return
+        if not await Story.objects.filter(id=self.story_id).aexists():
+            return
         
-        try:
-            story = Story.objects.get(id=self.story_id)
-            writing_session, created = WritingSession.objects.get_or_create(
-                story=story,
-                user=self.scope['user'],
-                defaults={'is_active': is_active}
-            )
-            if not created:
-                writing_session.is_active = is_active
-                writing_session.save()
-        except Story.DoesNotExist:
-            pass
+        lookup = {'story_id': self.story_id, 'user': self.scope['user'], 'defaults': {'is_active': is_active}}
+        if serializes_writes():
+            # Queue behind the process's other SQLite writes
+            await database_write_to_async(WritingSession.objects.update_or_create)(**lookup)
+        else:
+            await WritingSession.objects.aupdate_or_create(**lookup)
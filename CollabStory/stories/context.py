@@ -0,0 +1,188 @@
+"""
+Token-budgeted story context for the AI assistant.
+
+Recent nodes are sent verbatim; everything older is represented by stored
+``StorySummary`` rows. Summaries are extractive (the opening sentence of each
+node, trimmed to a word limit), so they are cheap enough to compute inline
+whenever a node is appended. Every ``SEGMENT_SIZE`` nodes that fall out of the
+recent window become one level-0 summary, and once a level holds
+``2 * FANOUT`` summaries the oldest ``FANOUT`` are merged into one summary a
+level up. A story of any length is therefore covered by a logarithmic number
+of summaries, and assembling the context never reads more than a window's
+worth of node text.
+
+Appends to the same story summarize one at a time: each holds the story
+row's lock while it works. An append writes at most ``SEGMENTS_PER_APPEND``
+segments. A longer backlog, such as an imported story's, is left to the
+``summarize_story_backlog`` job.
+"""
+
+import math
+import re
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Story, StorySummary
+
+DEFAULTS = {
+    'TOKEN_BUDGET': 1500,
+    'RECENT_SHARE': 0.6,
+    'RECENT_WINDOW': 5,
+    'SEGMENT_SIZE': 10,
+    'SUMMARY_WORDS': 80,
+    'FANOUT': 4,
+    'SEGMENTS_PER_APPEND': 2,
+}
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def get_context_settings():
+    return {**DEFAULTS, **getattr(settings, 'AI_CONTEXT', {})}
+
+
+def estimate_tokens(text):
+    """Rough token count; English prose averages about 4/3 tokens per word"""
+    return math.ceil(len(text.split()) * 4 / 3)
+
+
+def truncate_words(text, max_words, keep_end=False):
+    words = text.split()
+    if len(words) <= max_words:
+        return text.strip()
+    if keep_end:
+        return '... ' + ' '.join(words[-max_words:])
+    return ' '.join(words[:max_words]) + ' ...'
+
+
+def summarize(texts, max_words):
+    """Join the opening sentence of each text, trimmed to max_words"""
+    leads = []
+    for text in texts:
+        text = text.strip()
+        if text:
+            leads.append(SENTENCE_END.split(text, 1)[0])
+    return truncate_words(' '.join(leads), max_words)
+
+
+def update_story_summaries(story, max_segments=None):
+    """
+    Summarize nodes that have left the recent window; called after each append
+
+    Writes at most ``max_segments`` segments (``SEGMENTS_PER_APPEND`` by
+    default) and returns whether more are waiting.
+    """
+    config = get_context_settings()
+    segment_size = config['SEGMENT_SIZE']
+    max_segments = max_segments or config['SEGMENTS_PER_APPEND']
+    
+    with transaction.atomic():
+        # Concurrent appends would otherwise summarize the same nodes twice
+        if Story.objects.select_for_update().filter(id=story.id).values_list('id', flat=True).first() is None:
+            return False
+        last_covered = (
+            StorySummary.objects.filter(story=story)
+            .order_by('-last_node_id')
+            .values_list('last_node_id', flat=True)
+            .first()
+        ) or 0
+        uncovered = story.nodes.filter(id__gt=last_covered).order_by('id')
+        
+        waiting = max(0, (uncovered.count() - config['RECENT_WINDOW']) // segment_size)
+        segments = min(waiting, max_segments)
+        nodes = list(uncovered.values_list('id', 'content')[:segments * segment_size])
+        for start in range(0, len(nodes), segment_size):
+            segment = nodes[start:start + segment_size]
+            _create_summary(
+                story, config, 0, segment[0][0], segment[-1][0], len(segment),
+                [content for _, content in segment]
+            )
+        
+        _compact(story, config)
+    return waiting > segments
+
+
+def summarize_backlog(story_id):
+    """Summarize everything a story's appends left waiting, a few segments per transaction"""
+    story = Story.objects.filter(id=story_id).first()
+    while story is not None and update_story_summaries(story):
+        pass
+
+
+def _create_summary(story, config, level, first_node_id, last_node_id, node_count, texts):
+    text = summarize(texts, config['SUMMARY_WORDS'])
+    return StorySummary.objects.create(
+        story=story,
+        level=level,
+        first_node_id=first_node_id,
+        last_node_id=last_node_id,
+        node_count=node_count,
+        summary=text,
+        token_count=estimate_tokens(text),
+    )
+
+
+def _compact(story, config):
+    fanout = config['FANOUT']
+    level = 0
+    while True:
+        summaries = list(StorySummary.objects.filter(story=story, level=level).order_by('first_node_id'))
+        if len(summaries) < 2 * fanout:
+            if not summaries:
+                break
+            level += 1
+            continue
+        
+        group = summaries[:fanout]
+        _create_summary(
+            story, config, level + 1, group[0].first_node_id, group[-1].last_node_id,
+            sum(summary.node_count for summary in group),
+            [summary.summary for summary in group]
+        )
+        StorySummary.objects.filter(id__in=[summary.id for summary in group]).delete()
+
+
+def build_story_context(story, token_budget=None):
+    """Premise, rolling summaries and recent nodes, oldest first, within token_budget"""
+    config = get_context_settings()
+    budget = token_budget or config['TOKEN_BUDGET']
+    
+    premise = truncate_words(story.initial_prompt, max(1, budget // 10))
+    remaining = budget - estimate_tokens(premise)
+    
+    # Recent nodes verbatim, newest first until their share of the budget is used
+    recent_budget = int(remaining * config['RECENT_SHARE'])
+    recent = []
+    nodes = story.nodes.order_by('-id').values_list('id', 'content')
+    for node_id, content in nodes[:config['RECENT_WINDOW'] + config['SEGMENT_SIZE']]:
+        tokens = estimate_tokens(content)
+        if tokens > recent_budget:
+            if recent_budget > 20:
+                # Keep the end of the passage; it is what the suggestion continues from
+                content = truncate_words(content, int(recent_budget * 3 / 4), keep_end=True)
+                recent.append((node_id, content))
+                recent_budget = 0
+            break
+        recent.append((node_id, content))
+        recent_budget -= tokens
+    
+    if not recent:
+        return premise
+    remaining -= sum(estimate_tokens(content) for _, content in recent)
+    
+    # Summaries of everything before the recent passages, newest first
+    summaries = []
+    oldest_recent = recent[-1][0]
+    earlier = story.summaries.filter(last_node_id__lt=oldest_recent).order_by('-last_node_id')
+    for text, tokens in earlier.values_list('summary', 'token_count'):
+        if tokens > remaining:
+            break
+        summaries.append(text)
+        remaining -= tokens
+    
+    parts = [f"Premise: {premise}"]
+    if summaries:
+        parts.append("Earlier in the story:\n" + "\n".join(f"- {text}" for text in reversed(summaries)))
+    parts.append("Most recent passages:\n" + "\n\n".join(content for _, content in reversed(recent)))
+    return "\n\n".join(parts)
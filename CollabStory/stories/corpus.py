@@ -0,0 +1,332 @@
+"""
+JSONL import and export of story corpora.
+
+A corpus file starts with a header record. The header lists the lowest and
+highest story and node ids in the file. After it come one JSON object per
+line for each Story, StoryNode, Contribution, StoryBranch and StoryComment,
+in that order. Within each type, records are ordered by id, so a node's
+parent always comes before the node.
+
+Users are referred to by username. The importer creates any user it does
+not find, with an unusable password.
+
+``import_records`` runs in chunks of lines, one transaction per chunk, and
+uses batched ``bulk_create``. Every story and node id is shifted by a fixed
+offset. The offset is chosen once per import so that the new ids lie above
+the ids already in the database. ``parent_node`` and the other references
+are shifted by the same offset, so a chunk never needs ids from the
+database. The whole range is reserved when the import starts: the table's
+id sequence is moved past it, so rows the application inserts meanwhile
+(between chunks, or before a resumed run) never take one of its ids. The offsets and the number of finished lines are saved in a
+``StoryImport`` row, in the same transaction as each chunk. After a failure,
+the same file can be imported again from the first unfinished chunk.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils.dateparse import parse_datetime
+
+from .models import Contribution, Story, StoryBranch, StoryComment, StoryImport, StoryNode
+
+FORMAT = 'collabstory-stories'
+VERSION = 1
+
+# Record type -> how it is written: the model, its plain fields, and its
+# references to users (by username), stories and nodes. Stories and nodes
+# keep their (offset) ids; the others get new ones.
+RECORD_TYPES = {
+    'story': {
+        'model': Story,
+        'fields': [
+            'title', 'genre', 'initial_prompt', 'created_at', 'updated_at', 'is_public', 'max_contributors',
+            'current_state', 'is_completed', 'word_count', 'is_archived', 'archived_at', 'archive_reason',
+        ],
+        'users': ['created_by', 'archived_by'],
+        'stories': [],
+        'nodes': [],
+    },
+    'node': {
+        'model': StoryNode,
+        'fields': ['content', 'created_at', 'order', 'ai_generated', 'word_count', 'is_branch_point'],
+        'users': ['author'],
+        'stories': ['story'],
+        'nodes': ['parent_node'],
+    },
+    'contribution': {
+        'model': Contribution,
+        'fields': ['nodes_created', 'words_contributed', 'first_contribution', 'last_contribution'],
+        'users': ['user'],
+        'stories': ['story'],
+        'nodes': [],
+    },
+    'branch': {
+        'model': StoryBranch,
+        'fields': ['branch_name', 'description', 'created_at', 'is_active'],
+        'users': ['created_by'],
+        'stories': ['story'],
+        'nodes': ['parent_node'],
+    },
+    'comment': {
+        'model': StoryComment,
+        'fields': ['content', 'created_at', 'is_resolved'],
+        'users': ['user'],
+        'stories': ['story'],
+        'nodes': ['node'],
+    },
+}
+
+# Types whose ids are kept, shifted by the import's offset
+OFFSET_TYPES = ('story', 'node')
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let bulk_create store the timestamps we provide instead of now()"""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def next_id(model):
+    return (model.objects.aggregate(top=Max('id'))['top'] or 0) + 1
+
+
+def story_rows(record_type, story_ids=None):
+    queryset = RECORD_TYPES[record_type]['model'].objects.all()
+    if story_ids is not None:
+        lookup = 'id__in' if record_type == 'story' else 'story_id__in'
+        queryset = queryset.filter(**{lookup: story_ids})
+    return queryset
+
+
+def export_records(story_ids=None, chunk_size=2000):
+    """Yield the header and then every record of the selected stories (all by default) as dicts"""
+    ids = {}
+    for record_type in OFFSET_TYPES:
+        bounds = story_rows(record_type, story_ids).aggregate(low=Min('id'), high=Max('id'))
+        ids[record_type] = [bounds['low'], bounds['high']] if bounds['low'] is not None else None
+    yield {'type': 'header', 'format': FORMAT, 'version': VERSION, 'ids': ids}
+
+    for record_type, spec in RECORD_TYPES.items():
+        columns = [
+            *spec['fields'],
+            *(f'{name}__username' for name in spec['users']),
+            *(f'{name}_id' for name in spec['stories'] + spec['nodes']),
+        ]
+        if record_type in OFFSET_TYPES:
+            columns.insert(0, 'id')
+        rows = story_rows(record_type, story_ids).order_by('id').values(*columns).iterator(chunk_size=chunk_size)
+        for row in rows:
+            record = {'type': record_type}
+            for column, value in row.items():
+                record[column.removesuffix('__username').removesuffix('_id') if column != 'id' else column] = value
+            yield record
+
+
+def encode_value(value):
+    # Full precision, where DjangoJSONEncoder would cut datetimes to milliseconds
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot write {type(value).__name__} to a corpus file")
+
+
+def dump_record(record):
+    return json.dumps(record, default=encode_value, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def read_header(line):
+    try:
+        header = json.loads(line)
+    except json.JSONDecodeError:
+        header = None
+    if not isinstance(header, dict) or header.get('type') != 'header' or header.get('format') != FORMAT:
+        raise ValueError("Not a story corpus file: the first line is not its header")
+    if header.get('version') != VERSION:
+        raise ValueError(f"Unsupported corpus version {header.get('version')}")
+    return header
+
+
+def start_import(source, header, resume=False):
+    """The StoryImport to continue from, or a new one with fresh id offsets"""
+    unfinished = next(
+        (run for run in StoryImport.objects.filter(source=source, completed=False) if run.header == header), None
+    )
+    if unfinished is not None:
+        if not resume:
+            raise ValueError(
+                f"An import of {source} stopped after line {unfinished.lines_done}; pass --resume to continue it"
+            )
+        return unfinished
+    offsets = {}
+    with transaction.atomic():
+        for record_type in OFFSET_TYPES:
+            bounds = header['ids'].get(record_type)
+            if bounds:
+                first = reserve_ids(RECORD_TYPES[record_type]['model'], bounds[1] - bounds[0] + 1)
+                offsets[record_type] = first - bounds[0]
+            else:
+                offsets[record_type] = 0
+        return StoryImport.objects.create(source=source, header=header, id_offsets=offsets)
+
+
+def reserve_ids(model, count):
+    """The first of ``count`` consecutive ids that the table's own inserts will no longer hand out"""
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # One statement, so an insert elsewhere cannot take an id in between
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                f"GREATEST(nextval(pg_get_serial_sequence(%s, 'id')), (SELECT COALESCE(MAX(id), 0) + 1 FROM {table})) "
+                "+ %s - 1)",
+                [model._meta.db_table, model._meta.db_table, count],
+            )
+            return cursor.fetchone()[0] - count + 1
+        first = next_id(model)
+        if connection.vendor == 'sqlite':
+            # AUTOINCREMENT tables never hand out an id at or below sqlite_sequence's
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [model._meta.db_table])
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [model._meta.db_table, first + count - 1]
+                )
+            else:
+                first = max(first, row[0] + 1)
+                cursor.execute(
+                    "UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [first + count - 1, model._meta.db_table]
+                )
+        return first
+
+
+class Importer:
+    """Buffers records for one chunk and writes them in a single transaction"""
+
+    def __init__(self, progress, batch_size=1000):
+        self.progress = progress
+        self.batch_size = batch_size
+        self.offsets = progress.id_offsets
+        self.pending = {record_type: [] for record_type in RECORD_TYPES}
+        self.usernames = set()
+        self.datetime_fields = {
+            record_type: {
+                name for name in spec['fields']
+                if spec['model']._meta.get_field(name).get_internal_type() == 'DateTimeField'
+            }
+            for record_type, spec in RECORD_TYPES.items()
+        }
+
+    def add(self, record):
+        record_type = record.get('type')
+        spec = RECORD_TYPES.get(record_type)
+        if spec is None:
+            raise ValueError(f"Unknown record type {record_type!r}")
+        values = {}
+        for name in spec['fields']:
+            value = record.get(name)
+            if value is not None and name in self.datetime_fields[record_type]:
+                value = parse_datetime(value)
+            if value is not None:
+                values[name] = value
+        for name in spec['users']:
+            if record.get(name):
+                self.usernames.add(record[name])
+        self.pending[record_type].append((record, values))
+
+    def build(self, record_type, record, values, users):
+        spec = RECORD_TYPES[record_type]
+        if record_type in OFFSET_TYPES:
+            values['id'] = record['id'] + self.offsets[record_type]
+        for name in spec['users']:
+            values[f'{name}_id'] = users[record[name]] if record.get(name) else None
+        for name in spec['stories']:
+            values[f'{name}_id'] = record[name] + self.offsets['story']
+        for name in spec['nodes']:
+            values[f'{name}_id'] = record[name] + self.offsets['node'] if record.get(name) is not None else None
+        return spec['model'](**values)
+
+    def resolve_users(self):
+        users = {}
+        names = sorted(self.usernames)
+        # Stays under SQLite's limit on query parameters
+        for start in range(0, len(names), 500):
+            batch = names[start:start + 500]
+            users.update(User.objects.filter(username__in=batch).values_list('username', 'id'))
+        missing = [name for name in names if name not in users]
+        if missing:
+            password = make_password(None)
+            User.objects.bulk_create(
+                [User(username=name, password=password) for name in missing], batch_size=self.batch_size
+            )
+            for start in range(0, len(missing), 500):
+                batch = missing[start:start + 500]
+                users.update(User.objects.filter(username__in=batch).values_list('username', 'id'))
+        return users
+
+    def flush(self, lines_done):
+        """Write the buffered records and the progress up to ``lines_done``; returns the node count"""
+        nodes = len(self.pending['node'])
+        with transaction.atomic(), explicit_timestamps(*(spec['model'] for spec in RECORD_TYPES.values())):
+            users = self.resolve_users()
+            for record_type, spec in RECORD_TYPES.items():
+                objects = [
+                    self.build(record_type, record, values, users) for record, values in self.pending[record_type]
+                ]
+                spec['model'].objects.bulk_create(objects, batch_size=self.batch_size)
+            StoryImport.objects.filter(id=self.progress.id).update(
+                lines_done=lines_done, nodes_imported=self.progress.nodes_imported + nodes
+            )
+        self.progress.lines_done = lines_done
+        self.progress.nodes_imported += nodes
+        for records in self.pending.values():
+            records.clear()
+        self.usernames.clear()
+        return nodes
+
+
+def import_records(lines, progress, chunk_size=10000, batch_size=1000, report=None):
+    """
+    Import the records in ``lines`` (the file after its header) from where ``progress`` stopped
+
+    ``report(progress, nodes_per_second)`` is called after each chunk.
+    Returns the overall nodes per second of this run.
+    """
+    importer = Importer(progress, batch_size)
+    started = time.perf_counter()
+    imported = 0
+    buffered = 0
+    line_number = 1
+    for line_number, line in enumerate(lines, start=2):
+        if line_number <= progress.lines_done or not line.strip():
+            continue
+        try:
+            importer.add(json.loads(line))
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"Line {line_number}: {e}") from e
+        buffered += 1
+        if buffered >= chunk_size:
+            imported += importer.flush(line_number)
+            buffered = 0
+            if report:
+                report(progress, imported / (time.perf_counter() - started))
+    if buffered:
+        imported += importer.flush(line_number)
+    StoryImport.objects.filter(id=progress.id).update(completed=True)
+    progress.completed = True
+    return imported / max(time.perf_counter() - started, 1e-9)
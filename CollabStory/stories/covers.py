@@ -0,0 +1,257 @@
+"""
+Story cover image processing.
+
+Uploads are stored as they arrive and handed to a background job
+(``process_cover_image``). The job validates the image, replaces the upload
+with a re-encoding that keeps the pixels (upright) and colour profile but
+drops EXIF, XMP and comments, and renders a WebP and a JPEG derivative for
+each of ``COVER_IMAGES['SIZES']``, cropped to that size. The derivative names
+are kept in ``Story.cover_derivatives``; ``Story.cover_sources`` turns them
+into ``srcset`` values. Until a cover has been processed templates fall back
+to the original file.
+
+``render_cover`` needs nothing but Pillow and the file's bytes, so the
+``process_covers`` backfill command runs it in a process pool.
+"""
+
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.signals import setting_changed
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Pillow format name -> (file extension, content type)
+OUTPUT_FORMATS = {
+    'WEBP': ('webp', 'image/webp'),
+    'JPEG': ('jpg', 'image/jpeg'),
+}
+
+_config = None
+
+
+def get_config():
+    global _config
+    if _config is None:
+        config = getattr(settings, 'COVER_IMAGES', {})
+        _config = {
+            # (width, height) of each derivative; 1x, 2x and 3x of the story card
+            'SIZES': [tuple(size) for size in config.get('SIZES', [(360, 200), (720, 400), (1080, 600)])],
+            # Derivative format -> encoder quality
+            'FORMATS': dict(config.get('FORMATS', {'WEBP': 80, 'JPEG': 82})),
+            'MAX_UPLOAD_SIZE': config.get('MAX_UPLOAD_SIZE', 10 * 1024 * 1024),
+            'MAX_PIXELS': config.get('MAX_PIXELS', 40_000_000),
+            'ALLOWED_FORMATS': set(config.get('ALLOWED_FORMATS', ['JPEG', 'PNG', 'WEBP', 'GIF'])),
+            'DIRECTORY': config.get('DIRECTORY', 'story_covers/derived'),
+        }
+    return _config
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    global _config
+    if setting == 'COVER_IMAGES':
+        _config = None
+
+
+def validate_image(file, config=None):
+    """Raise ValidationError unless ``file`` is an allowed image within the size limits"""
+    config = config or get_config()
+    if file.size > config['MAX_UPLOAD_SIZE']:
+        raise ValidationError(
+            f"Cover images must be smaller than {config['MAX_UPLOAD_SIZE'] // (1024 * 1024)} MB."
+        )
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            check_image(image, config)
+            image.verify()
+    except (OSError, SyntaxError, UnidentifiedImageError, Image.DecompressionBombError):
+        raise ValidationError("Upload a valid image.")
+    finally:
+        file.seek(0)
+
+
+def check_image(image, config):
+    if image.format not in config['ALLOWED_FORMATS']:
+        raise ValidationError(
+            f"Cover images must be one of: {', '.join(sorted(config['ALLOWED_FORMATS']))}."
+        )
+    # Checked from the header, before any pixels are decoded
+    if image.width * image.height > config['MAX_PIXELS']:
+        raise ValidationError("Cover image dimensions are too large.")
+
+
+def render_cover(data, config):
+    """
+    Render one cover from its bytes; runs in the job worker or a backfill process
+
+    Returns the metadata-free original as ``(extension, bytes)`` and a list
+    of ``(format, width, height, bytes)`` derivatives. Sizes larger than the
+    original are skipped, except that the smallest is always rendered.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        check_image(source, config)
+        source_format = source.format
+        icc_profile = source.info.get('icc_profile')
+        # Apply the EXIF orientation to the pixels, since the tag is dropped
+        image = ImageOps.exif_transpose(source)
+        image.load()
+
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    save_options = {'icc_profile': icc_profile} if icc_profile else {}
+
+    # Animated GIFs keep their first frame only
+    original_format = source_format if source_format in ('JPEG', 'PNG', 'WEBP') else 'PNG'
+    if original_format == 'JPEG':
+        original = encode(flatten(image), 'JPEG', quality=95, **save_options)
+    elif original_format == 'WEBP':
+        original = encode(image, 'WEBP', lossless=True, **save_options)
+    else:
+        original = encode(image, 'PNG', optimize=True, **save_options)
+
+    sizes = sorted(config['SIZES'])
+    fitting = [size for size in sizes if size[0] <= image.width and size[1] <= image.height] or sizes[:1]
+    derivatives = []
+    for width, height in fitting:
+        resized = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+        for output_format, quality in config['FORMATS'].items():
+            if output_format == 'JPEG':
+                data = encode(
+                    flatten(resized), 'JPEG', quality=quality, optimize=True, progressive=True, **save_options
+                )
+            else:
+                data = encode(resized, output_format, quality=quality, method=4, **save_options)
+            derivatives.append((output_format, width, height, data))
+
+    return (original_format.lower().replace('jpeg', 'jpg'), original), derivatives
+
+
+def flatten(image):
+    """Composite transparency onto white for formats without alpha"""
+    if image.mode != 'RGBA':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def encode(image, image_format, **options):
+    output = io.BytesIO()
+    image.save(output, image_format, **options)
+    return output.getvalue()
+
+
+def derivative_name(story_id, digest, output_format, width, height, config):
+    return f"{config['DIRECTORY']}/{story_id}-{digest}-{width}x{height}.{OUTPUT_FORMATS[output_format][0]}"
+
+
+def read_cover(story):
+    with story.cover_image.open('rb') as file:
+        return file.read()
+
+
+def process_cover(story_id, name, rendered=None):
+    """
+    Bring a story's derivatives in line with its cover ``name``
+
+    ``rendered`` is ``render_cover``'s result when it was computed elsewhere.
+    Does nothing if the cover has changed since ``name`` was queued; the
+    job queued for the newer cover handles it. Returns whether the story
+    was updated.
+    """
+    from .models import Story
+
+    story = Story.objects.filter(id=story_id).only('id', 'cover_image', 'cover_derivatives').first()
+    if story is None or (story.cover_image.name or '') != (name or ''):
+        return False
+    config = get_config()
+    storage = story.cover_image.storage
+    previous = derivative_names(story.cover_derivatives)
+
+    if not name:
+        # Cover removed
+        updated = Story.objects.filter(
+            Q(cover_image='') | Q(cover_image__isnull=True), id=story.id
+        ).update(cover_derivatives={})
+        if updated:
+            delete_files(storage, previous)
+        return bool(updated)
+
+    try:
+        if rendered is None:
+            rendered = render_cover(read_cover(story), config)
+    except (ValidationError, OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning("Cover image %s of story %s could not be processed: %s", name, story_id, e)
+        return False
+    (extension, original), images = rendered
+
+    digest = hashlib.sha256(original).hexdigest()[:12]
+    written = []
+    derivatives = {}
+    for output_format, width, height, image_data in images:
+        path = storage.save(
+            derivative_name(story.id, digest, output_format, width, height, config), ContentFile(image_data)
+        )
+        written.append(path)
+        derivatives.setdefault(OUTPUT_FORMATS[output_format][0], []).append(
+            {'width': width, 'height': height, 'name': path}
+        )
+    clean_name = storage.save(f"{name.rsplit('.', 1)[0]}.{extension}", ContentFile(original))
+    written.append(clean_name)
+
+    updated = Story.objects.filter(id=story.id, cover_image=name).update(
+        cover_image=clean_name, cover_derivatives=derivatives
+    )
+    if not updated:
+        # Replaced while we worked
+        delete_files(storage, written)
+        return False
+    delete_files(storage, [name, *previous])
+    return True
+
+
+def derivative_names(derivatives):
+    return [image['name'] for images in (derivatives or {}).values() for image in images]
+
+
+def delete_files(storage, names):
+    for name in names:
+        try:
+            storage.delete(name)
+        except OSError:
+            logger.warning("Could not delete cover file %s", name, exc_info=True)
+
+
+def cover_sources(story):
+    """``srcset`` strings per format plus a fallback ``src``, or None before processing"""
+    derivatives = story.cover_derivatives
+    if not derivatives:
+        return None
+    storage = story.cover_image.storage
+    sources = {
+        extension: ', '.join(f"{storage.url(image['name'])} {image['width']}w" for image in images)
+        for extension, images in derivatives.items()
+    }
+    fallback = (derivatives.get('jpg') or next(iter(derivatives.values())))[0]
+    sources.update(src=storage.url(fallback['name']), width=fallback['width'], height=fallback['height'])
+    return sources
+
+
+@receiver(post_delete, sender='stories.Story')
+def _release_cover_files(sender, instance, **kwargs):
+    # The storage counts references, so shared files stay for their other users
+    if instance.cover_image:
+        delete_files(
+            instance.cover_image.storage,
+            [instance.cover_image.name, *derivative_names(instance.cover_derivatives)],
+        )
@@ -0,0 +1,294 @@
+"""
+Story export as plain text, Markdown or EPUB.
+
+Exports are generators, so a story of any length is written out a chunk at
+a time. Nodes are read with ``.iterator()``, so only ``CHUNK_SIZE`` rows are
+in memory at once. Each node's author comes from the same query.
+``buffered`` groups the output into blocks of about ``BUFFER_SIZE`` bytes.
+The block size keeps per-chunk overhead low when a response is streamed.
+An EPUB is a zip file, and ``render_epub`` writes it as it goes.
+
+A selected branch is the path from the first node to a chosen node, found
+with one recursive query. Multi-story exports are zipped into a file by the
+``export_stories_archive`` job. ``purge_expired_exports`` deletes them
+``STORY_EXPORT_RETENTION['TTL_DAYS']`` after they finish, and deleting a
+StoryExport releases its file's reference in the storage. The
+``export_story`` command writes one story or an archive from the shell.
+"""
+
+import logging
+import tempfile
+import zipfile
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.html import escape
+from django.utils.text import slugify
+
+from .models import Story, StoryExport, StoryNode
+from .prompts import delete_in_batches
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+BUFFER_SIZE = 64 * 1024
+
+# Format -> (content type, file extension)
+FORMATS = {
+    'txt': ('text/plain; charset=utf-8', 'txt'),
+    'md': ('text/markdown; charset=utf-8', 'md'),
+    'epub': ('application/epub+zip', 'epub'),
+}
+
+
+def exportable_stories(queryset, user):
+    """Stories in ``queryset`` that ``user`` may download"""
+    if user.is_staff:
+        return queryset
+    return queryset.filter(Q(is_public=True, is_archived=False) | Q(created_by=user))
+
+
+def story_nodes(story, chunk_size=CHUNK_SIZE):
+    """Every node of the story, in the order the story page shows them"""
+    return story.nodes.select_related('author').order_by('created_at', 'id').iterator(chunk_size=chunk_size)
+
+
+def branch_path_ids(story, node_id):
+    """Ids of the nodes from the start of the story to ``node_id``, or [] if it is not in the story"""
+    table = StoryNode._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH RECURSIVE path(id, parent_node_id, depth) AS (
+                SELECT id, parent_node_id, 0 FROM {table} WHERE id = %s AND story_id = %s
+                UNION ALL
+                SELECT node.id, node.parent_node_id, path.depth + 1
+                FROM {table} node JOIN path ON node.id = path.parent_node_id
+            )
+            SELECT id FROM path ORDER BY depth DESC
+            """,
+            [node_id, story.id],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def branch_nodes(ids, chunk_size=CHUNK_SIZE):
+    """The nodes with ``ids``, in that order, fetched ``chunk_size`` at a time"""
+    for start in range(0, len(ids), chunk_size):
+        batch = ids[start:start + chunk_size]
+        nodes = StoryNode.objects.select_related('author').in_bulk(batch)
+        for node_id in batch:
+            yield nodes[node_id]
+
+
+def export_story(story, export_format, node_ids=None, chunk_size=CHUNK_SIZE):
+    """The story, or the branch path ``node_ids``, as an iterator of bytes blocks"""
+    nodes = story_nodes(story, chunk_size) if node_ids is None else branch_nodes(node_ids, chunk_size)
+    if export_format == 'epub':
+        return render_epub(story, nodes)
+    render = render_markdown if export_format == 'md' else render_text
+    return buffered(render(story, nodes))
+
+
+def export_filename(story, export_format):
+    return f"{slugify(story.title) or f'story-{story.id}'}.{FORMATS[export_format][1]}"
+
+
+def buffered(parts, size=BUFFER_SIZE):
+    """Encode string ``parts`` and regroup them into blocks of about ``size`` bytes"""
+    block = []
+    length = 0
+    for part in parts:
+        data = part.encode('utf-8')
+        block.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(block)
+            block = []
+            length = 0
+    if block:
+        yield b''.join(block)
+
+
+def byline(story):
+    return f"{story.get_genre_display()}, started by {story.created_by.username}"
+
+
+def render_text(story, nodes):
+    yield f"{story.title}\n{'=' * len(story.title)}\n\n{byline(story)}\n\n{story.initial_prompt}\n\n"
+    for node in nodes:
+        yield f"{node.content}\n    — {node.author.username}\n\n"
+
+
+def render_markdown(story, nodes):
+    prompt = '\n'.join(f'> {line}' if line else '>' for line in story.initial_prompt.splitlines())
+    yield f"# {story.title}\n\n*{byline(story)}*\n\n{prompt}\n\n"
+    for node in nodes:
+        yield f"{node.content}\n\n*— {node.author.username}*\n\n"
+
+
+def xhtml_paragraphs(text):
+    paragraphs = [part.strip() for part in text.replace('\r\n', '\n').split('\n\n') if part.strip()]
+    return ''.join(f"<p>{'<br/>'.join(escape(line) for line in part.splitlines())}</p>\n" for part in paragraphs)
+
+
+def render_xhtml(story, nodes):
+    yield (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<!DOCTYPE html>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+        f'<head><title>{escape(story.title)}</title></head>\n<body>\n'
+        f'<h1>{escape(story.title)}</h1>\n<p><em>{escape(byline(story))}</em></p>\n'
+        f'<blockquote>{xhtml_paragraphs(story.initial_prompt)}</blockquote>\n'
+    )
+    for node in nodes:
+        yield f'<section>\n{xhtml_paragraphs(node.content)}<p><em>— {escape(node.author.username)}</em></p>\n</section>\n'
+    yield '</body>\n</html>\n'
+
+
+class _Pipe:
+    """Write-only file object whose contents are taken out as they are written"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def epub_package(story):
+    modified = story.updated_at.astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    title = escape(story.title)
+    return {
+        'META-INF/container.xml': (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>\n'
+            '</container>\n'
+        ),
+        'OEBPS/content.opf': (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="story-id">\n'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            f'<dc:identifier id="story-id">urn:collabstory:story:{story.id}</dc:identifier>\n'
+            f'<dc:title>{title}</dc:title>\n'
+            f'<dc:creator>{escape(story.created_by.username)}</dc:creator>\n'
+            '<dc:language>en</dc:language>\n'
+            f'<meta property="dcterms:modified">{modified}</meta>\n'
+            '</metadata>\n'
+            '<manifest>\n'
+            '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>\n'
+            '<item id="story" href="story.xhtml" media-type="application/xhtml+xml"/>\n'
+            '</manifest>\n'
+            '<spine><itemref idref="story"/></spine>\n'
+            '</package>\n'
+        ),
+        'OEBPS/nav.xhtml': (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<!DOCTYPE html>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+            f'<head><title>{title}</title></head>\n<body>\n'
+            f'<nav epub:type="toc"><ol><li><a href="story.xhtml">{title}</a></li></ol></nav>\n'
+            '</body>\n</html>\n'
+        ),
+    }
+
+
+def render_epub(story, nodes):
+    """Write the EPUB zip into a pipe and hand over what it has written after each block"""
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w', zipfile.ZIP_DEFLATED) as archive:
+        # Must come first and uncompressed, so readers can identify the file
+        archive.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        for name, content in epub_package(story).items():
+            archive.writestr(name, content)
+        yield pipe.drain()
+        with archive.open('OEBPS/story.xhtml', 'w', force_zip64=True) as chapter:
+            for block in buffered(render_xhtml(story, nodes)):
+                chapter.write(block)
+                data = pipe.drain()
+                if data:
+                    yield data
+    yield pipe.drain()
+
+
+def write_archive(stories, export_format, file):
+    """Zip one export per story into the writable binary ``file``"""
+    with zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED) as archive:
+        names = set()
+        for story in stories:
+            name = export_filename(story, export_format)
+            if name in names:
+                name = f'{story.id}-{name}'
+            names.add(name)
+            # EPUBs are zip files already
+            compression = zipfile.ZIP_STORED if export_format == 'epub' else zipfile.ZIP_DEFLATED
+            info = zipfile.ZipInfo(name, date_time=story.updated_at.timetuple()[:6])
+            info.compress_type = compression
+            with archive.open(info, 'w', force_zip64=True) as member:
+                for block in export_story(story, export_format):
+                    member.write(block)
+
+
+def run_export(export_id):
+    """Write a StoryExport's archive to a temporary file, then store it"""
+    claimed = StoryExport.objects.filter(id=export_id, status=StoryExport.STATUS_PENDING).update(
+        status=StoryExport.STATUS_RUNNING, started_at=timezone.now()
+    )
+    if not claimed:
+        return
+    export = StoryExport.objects.select_related('requested_by').get(id=export_id)
+    try:
+        stories = exportable_stories(
+            Story.objects.filter(id__in=export.story_ids), export.requested_by
+        ).select_related('created_by').order_by('id')
+        with tempfile.TemporaryFile() as file:
+            write_archive(stories.iterator(), export.export_format, file)
+            file.seek(0)
+            export.file.save(f'stories-{export.id}.zip', File(file), save=False)
+    except Exception as e:
+        logger.exception("Story export %s failed", export_id)
+        StoryExport.objects.filter(id=export_id).update(
+            status=StoryExport.STATUS_FAILED, error=str(e), completed_at=timezone.now()
+        )
+        return
+    StoryExport.objects.filter(id=export_id).update(
+        status=StoryExport.STATUS_COMPLETED, file=export.file.name, completed_at=timezone.now()
+    )
+
+
+def purge_expired_exports(ttl_days=None, batch_size=None):
+    """Delete finished exports older than the retention period; returns how many went"""
+    config = getattr(settings, 'STORY_EXPORT_RETENTION', {})
+    ttl_days = config.get('TTL_DAYS', 7) if ttl_days is None else ttl_days
+    batch_size = batch_size or config.get('BATCH_SIZE', 100)
+    expired = StoryExport.objects.filter(
+        status__in=[StoryExport.STATUS_COMPLETED, StoryExport.STATUS_FAILED],
+        completed_at__lt=timezone.now() - timedelta(days=ttl_days),
+    )
+    return delete_in_batches(expired, batch_size, pause=0)
+
+
+@receiver(post_delete, sender=StoryExport)
+def _release_export_file(sender, instance, **kwargs):
+    # The storage counts references, so an identical archive stays for its other exports
+    if instance.file:
+        try:
+            instance.file.storage.delete(instance.file.name)
+        except OSError:
+            logger.warning("Could not delete export file %s", instance.file.name, exc_info=True)
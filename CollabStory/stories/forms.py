@@ -1,4 +1,6 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+from .covers import validate_image
 from .models import Story, StoryNode, StoryComment
 
 class StoryForm(forms.ModelForm):
@@ -36,6 +38,13 @@ class StoryForm(forms.ModelForm):
             'is_public': 'Make this story public',
             'max_contributors': 'Maximum Contributors'
         }
+    
+    def clean_cover_image(self):
+        cover_image = self.cleaned_data.get('cover_image')
+        # Only new uploads; an unchanged cover was checked when it was uploaded
+        if isinstance(cover_image, UploadedFile):
+            validate_image(cover_image)
+        return cover_image
 
 class StoryNodeForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,153 @@
+import asyncio
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import include, path
+
+from CollabStory.db import close_request_connections
+from stories import async_views, views
+from stories.models import Story
+
+from .generate_corpus import BENCHMARK_USERNAME
+
+
+class URLConf:
+    """Root URLconf serving both versions of the story page next to the real routes"""
+
+    urlpatterns = [
+        path('benchmark/sync/<int:story_id>/', views.story_detail),
+        path('benchmark/async/<int:story_id>/', async_views.story_detail),
+        path('', include(settings.ROOT_URLCONF)),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the throughput of the sync and async story_detail views under concurrent requests, "
+        "served in-process by Django's ASGI handler against the current database (see generate_corpus). "
+        "conn/req is the number of database connections opened per request, setup included in the timings"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32],
+                            help="Requests in flight at once; one run per value")
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds per run")
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=BENCHMARK_USERNAME)
+        except User.DoesNotExist:
+            raise CommandError(f"No '{BENCHMARK_USERNAME}' user; run generate_corpus first")
+        story = (
+            Story.objects.filter(created_by=owner).annotate(size=Count('nodes')).order_by('-size', 'id').first()
+        )
+        if story is None:
+            raise CommandError(f"'{BENCHMARK_USERNAME}' owns no stories; run generate_corpus with --owner-stories")
+
+        with override_settings(ROOT_URLCONF=URLConf, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            client = Client()
+            client.force_login(owner)
+            cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+            application = get_asgi_application()
+            # As asgi.py does, so each request's thread leaves no connection behind
+            request_finished.connect(close_request_connections)
+            try:
+                self.stdout.write(
+                    f"story_detail for a {story.size}-node story, {options['duration']:.0f}s per run\n"
+                    f"  {'view':<6} {'concurrency':>11} {'req/s':>8} {'p50':>9} {'p95':>9} {'conn/req':>8} {'errors':>7}"
+                )
+                for concurrency in options['concurrency']:
+                    for mode in ('sync', 'async'):
+                        result = asyncio.run(self.run(
+                            application, f'/benchmark/{mode}/{story.id}/', cookie, concurrency, options['duration']
+                        ))
+                        self.stdout.write(
+                            f"  {mode:<6} {concurrency:>11d} {result['requests'] / options['duration']:8.1f} "
+                            f"{result['p50']:7.1f}ms {result['p95']:7.1f}ms "
+                            f"{result['connections'] / max(result['requests'], 1):8.2f} {result['errors']:7d}"
+                        )
+            finally:
+                request_finished.disconnect(close_request_connections)
+
+    async def run(self, application, url, cookie, concurrency, duration):
+        deadline = time.perf_counter() + duration
+        latencies = []
+        errors = 0
+        connections = 0
+
+        def count_connection(**kwargs):
+            nonlocal connections
+            connections += 1
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                status = await asgi_get(application, url, cookie)
+                if status == 200:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors += 1
+
+        connection_created.connect(count_connection)
+        try:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        finally:
+            connection_created.disconnect(count_connection)
+        return {
+            'requests': len(latencies),
+            'connections': connections,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'errors': errors,
+        }
+
+
+async def asgi_get(application, url, cookie):
+    """Send one GET through the ASGI application and return the response status"""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': url,
+        'raw_path': url.encode(),
+        'query_string': b'',
+        'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    request_sent = False
+    status = None
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client stays connected until the handler is done with it
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+def percentile(values, percent):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[percent - 1]
@@ -0,0 +1,166 @@
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+from django.test.utils import override_settings
+
+from CollabStory.sqlite import run_write
+from stories.models import Contribution, Story, StoryNode, WritingSession
+
+ALIAS = 'sqlite_benchmark'
+
+# (label, profile enabled, writes queued on the writer thread)
+MODES = (
+    ('defaults', False, False),
+    ('profile', True, False),
+    ('profile + writer', True, True),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent node appends and story reads on a scratch SQLite file "
+        "with default pragmas, with SQLITE_PROFILE, and with SQLITE_PROFILE plus the single writer"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help="Threads appending nodes")
+        parser.add_argument('--readers', type=int, default=8, help="Threads reading the story")
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds per mode")
+        parser.add_argument('--nodes', type=int, default=500, help="Nodes in the story before the run")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            template = Path(directory) / 'template.sqlite3'
+            with self.database(template, profile=False):
+                self.stdout.write("Migrating a scratch database...")
+                call_command('migrate', database=ALIAS, verbosity=0)
+                story_id, user_ids = self.seed(options['writers'], options['nodes'])
+
+            self.stdout.write(
+                f"{options['writers']} writers, {options['readers']} readers, {options['duration']:.0f}s per mode\n"
+                f"  {'mode':<18} {'writes/s':>9} {'reads/s':>9} {'write p95':>10} {'read p95':>10} {'locked':>7}"
+            )
+            for label, profile, queued in MODES:
+                path = Path(directory) / f"{label.replace(' + ', '-')}.sqlite3"
+                shutil.copy(template, path)
+                with self.database(path, profile):
+                    result = self.run(story_id, user_ids, options, queued)
+                self.stdout.write(
+                    f"  {label:<18} {result['writes'] / options['duration']:9.0f} "
+                    f"{result['reads'] / options['duration']:9.0f} "
+                    f"{result['write_p95']:8.1f}ms {result['read_p95']:8.1f}ms {result['locked']:7d}"
+                )
+
+    def database(self, path, profile):
+        """Point the benchmark alias at ``path`` with the profile on or off"""
+        command = self
+
+        class Database:
+            def __enter__(self):
+                connections.settings[ALIAS] = {**connections.settings['default'], 'NAME': str(path)}
+                self.override = override_settings(SQLITE_PROFILE={**settings.SQLITE_PROFILE, 'ENABLED': profile})
+                self.override.enable()
+
+            def __exit__(self, *exc_info):
+                connections[ALIAS].close()
+                self.override.disable()
+                del connections[ALIAS]
+                del connections.settings[ALIAS]
+                command.stdout.flush()
+
+        return Database()
+
+    def seed(self, writers, nodes):
+        users = User.objects.using(ALIAS).bulk_create(
+            [User(username=f'sqlite_writer{index}') for index in range(writers)]
+        )
+        story = Story.objects.using(ALIAS).create(title='Contended', initial_prompt='It begins.', created_by=users[0])
+        StoryNode.objects.using(ALIAS).bulk_create([
+            StoryNode(story=story, author=users[index % writers], content='An earlier line of the story.', word_count=6)
+            for index in range(nodes)
+        ])
+        Contribution.objects.using(ALIAS).bulk_create([Contribution(story=story, user=user) for user in users])
+        WritingSession.objects.using(ALIAS).bulk_create([WritingSession(story=story, user=user) for user in users])
+        return story.id, [user.id for user in users]
+
+    def run(self, story_id, user_ids, options, queued):
+        deadline = time.perf_counter() + options['duration']
+        lock = threading.Lock()
+        result = {'write_latencies': [], 'read_latencies': [], 'locked': 0}
+
+        def append_node(user_id):
+            # What add_story_node writes, in one transaction that reads before
+            # it writes, as get_or_create and select_for_update blocks do
+            with transaction.atomic(using=ALIAS):
+                story = Story.objects.using(ALIAS).get(id=story_id)
+                node = StoryNode(story=story, author_id=user_id, content='One more line joins the story.')
+                node.save(using=ALIAS)
+                Contribution.objects.using(ALIAS).filter(story_id=story_id, user_id=user_id).update(
+                    nodes_created=F('nodes_created') + 1, words_contributed=F('words_contributed') + node.word_count
+                )
+                WritingSession.objects.using(ALIAS).filter(story_id=story_id, user_id=user_id).update(current_node=node)
+
+        def read_story():
+            # What story_detail reads
+            story = Story.objects.using(ALIAS).get(id=story_id)
+            list(story.nodes.select_related('author').order_by('-created_at')[:50])
+            WritingSession.objects.using(ALIAS).filter(story_id=story_id, is_active=True).count()
+
+        def worker(operation, latencies):
+            try:
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        operation()
+                    except OperationalError as e:
+                        if 'locked' not in str(e):
+                            raise
+                        with lock:
+                            result['locked'] += 1
+                        continue
+                    with lock:
+                        latencies.append((time.perf_counter() - started) * 1000)
+            finally:
+                connections[ALIAS].close()
+
+        threads = []
+        for index in range(options['writers']):
+            user_id = user_ids[index % len(user_ids)]
+            if queued:
+                operation = lambda user_id=user_id: run_write(append_node, user_id)
+            else:
+                operation = lambda user_id=user_id: append_node(user_id)
+            threads.append(threading.Thread(target=worker, args=(operation, result['write_latencies'])))
+        for _ in range(options['readers']):
+            threads.append(threading.Thread(target=worker, args=(read_story, result['read_latencies'])))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # The writer thread keeps its connection between writes
+        if queued:
+            run_write(lambda: connections[ALIAS].close())
+
+        return {
+            'writes': len(result['write_latencies']),
+            'reads': len(result['read_latencies']),
+            'write_p95': percentile(result['write_latencies'], 95),
+            'read_p95': percentile(result['read_latencies'], 95),
+            'locked': result['locked'],
+        }
+
+
+def percentile(values, percent):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[percent - 1]
@@ -0,0 +1,117 @@
+import json
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from stories.context import summarize_backlog
+from stories.models import Story, StoryNode
+
+from .generate_corpus import BENCHMARK_USERNAME
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'views.json'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency and SQL query counts of the main views against the current database "
+        "(see generate_corpus) and fail if they regress from the saved baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help="Baseline JSON file")
+        parser.add_argument('--save', action='store_true', help="Write the results as the new baseline")
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--latency-tolerance', type=float, default=0.5,
+                            help="Allowed fractional slowdown of the median before failing")
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=BENCHMARK_USERNAME)
+        except User.DoesNotExist:
+            raise CommandError(f"No '{BENCHMARK_USERNAME}' user; run generate_corpus first")
+        story = (
+            Story.objects.filter(created_by=owner).annotate(size=Count('nodes')).order_by('-size', 'id').first()
+        )
+        if story is None:
+            raise CommandError(f"'{BENCHMARK_USERNAME}' owns no stories; run generate_corpus with --owner-stories")
+        # Every measured request is rolled back, so a story whose AI summaries
+        # lag behind would make each add_story_node pay for the backlog again
+        summarize_backlog(story.id)
+
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            client = Client()
+            client.force_login(owner)
+            requests = {
+                'story_list': lambda: client.get(reverse('stories:story_list')),
+                'story_detail': lambda: client.get(reverse('stories:story_detail', args=[story.id])),
+                'add_story_node': lambda: client.post(
+                    reverse('stories:add_story_node', args=[story.id]),
+                    data=json.dumps({'content': 'The benchmark adds one more line to the tale.'}),
+                    content_type='application/json',
+                ),
+                'profile': lambda: client.get(reverse('users:profile')),
+                'story_management': lambda: client.get(reverse('stories:story_management')),
+            }
+            results = {name: self.measure(name, request, options['repeat']) for name, request in requests.items()}
+
+        corpus = {
+            'stories': Story.objects.count(),
+            'nodes': StoryNode.objects.count(),
+            'owner_stories': Story.objects.filter(created_by=owner).count(),
+            'detail_story_nodes': story.size,
+        }
+        self.stdout.write(
+            f"Corpus: {corpus['stories']} stories, {corpus['nodes']} nodes; "
+            f"detail story has {corpus['detail_story_nodes']} nodes"
+        )
+
+        baseline_path = Path(options['baseline'])
+        baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else None
+        regressions = []
+        for name, result in results.items():
+            line = f"  {name:<18} {result['latency_ms']:9.1f} ms  {result['queries']:5d} queries"
+            previous = baseline['views'].get(name) if baseline else None
+            if previous:
+                line += f"   (baseline {previous['latency_ms']:.1f} ms, {previous['queries']} queries)"
+                if result['queries'] > previous['queries']:
+                    regressions.append(f"{name}: {previous['queries']} -> {result['queries']} queries")
+                if result['latency_ms'] > previous['latency_ms'] * (1 + options['latency_tolerance']):
+                    regressions.append(f"{name}: {previous['latency_ms']:.1f} -> {result['latency_ms']:.1f} ms")
+            self.stdout.write(line)
+
+        if baseline and baseline.get('corpus') != corpus:
+            self.stdout.write(self.style.WARNING("Corpus differs from the baseline's; comparisons may not be meaningful"))
+
+        if options['save']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps({'corpus': corpus, 'views': results}, indent=2) + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline to {baseline_path}"))
+        elif regressions:
+            raise CommandError("Performance regressed:\n  " + "\n  ".join(regressions))
+        elif baseline is None:
+            self.stdout.write(f"No baseline at {baseline_path}; run with --save to record one")
+
+    def measure(self, name, request, repeat):
+        """Median latency and the query count of one request, leaving the database unchanged"""
+        latencies = []
+        queries = 0
+        for _ in range(repeat):
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = request()
+                    latencies.append((time.perf_counter() - started) * 1000)
+                transaction.set_rollback(True)
+            if response.status_code != 200:
+                raise CommandError(f"{name} returned {response.status_code}")
+            queries = max(queries, len(captured))
+        return {'latency_ms': round(statistics.median(latencies), 2), 'queries': queries}
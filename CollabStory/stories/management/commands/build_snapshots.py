@@ -0,0 +1,34 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from stories.models import Story
+from stories.snapshots import delete_snapshot, get_config, write_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Render static pages for every completed, public story and remove those of stories "
+        "that no longer qualify (see stories/snapshots.py)"
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        stories = Story.objects.filter(is_completed=True, is_public=True, is_archived=False)
+        written = set()
+        for story in stories.select_related('created_by').order_by('id').iterator(chunk_size=100):
+            write_snapshot(story)
+            written.add(story.id)
+
+        removed = 0
+        directory = get_config()['DIRECTORY']
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                story_id = name.removesuffix('.html')
+                if name.endswith('.html') and story_id.isdigit() and int(story_id) not in written:
+                    delete_snapshot(story_id)
+                    removed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(written)} snapshots and removed {removed} in {time.perf_counter() - started:.1f}s"
+        ))
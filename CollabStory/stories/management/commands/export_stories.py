@@ -0,0 +1,40 @@
+import gzip
+import time
+
+from django.core.management.base import BaseCommand
+
+from stories.corpus import dump_record, export_records
+
+
+def open_corpus(path, mode):
+    """Open a corpus file as text, gzipped when its name ends in .gz"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class Command(BaseCommand):
+    help = (
+        "Write stories with their node trees, contributions, branches and comments as JSONL "
+        "(see stories/corpus.py), for import_stories on another instance"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('story_ids', type=int, nargs='*', help="Stories to export; all by default")
+        parser.add_argument('--output', '-o', required=True, help="File to write; gzipped if it ends in .gz")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per query")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        counts = {}
+        with open_corpus(options['output'], 'w') as file:
+            for record in export_records(options['story_ids'] or None, options['chunk_size']):
+                file.write(dump_record(record))
+                counts[record['type']] = counts.get(record['type'], 0) + 1
+        elapsed = time.perf_counter() - started
+        counts.pop('header')
+        summary = ', '.join(f"{count} {record_type}s" for record_type, count in counts.items()) or "nothing"
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {summary} to {options['output']} in {elapsed:.1f}s "
+            f"({counts.get('node', 0) / max(elapsed, 1e-9):.0f} nodes/s)"
+        ))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stories.export import CHUNK_SIZE, FORMATS, branch_path_ids, export_story, write_archive
+from stories.models import Story
+
+
+class Command(BaseCommand):
+    help = (
+        "Export a story (or the branch ending at --node) as text, Markdown or EPUB; "
+        "several stories are zipped into one archive"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('story_ids', type=int, nargs='+')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='txt')
+        parser.add_argument('--node', type=int, help="Export only the path from the first node to this one")
+        parser.add_argument('--output', '-o', help="File to write; a single story goes to stdout by default")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Nodes fetched per query")
+
+    def handle(self, *args, **options):
+        stories = Story.objects.filter(id__in=options['story_ids']).select_related('created_by').order_by('id')
+        missing = set(options['story_ids']) - set(stories.values_list('id', flat=True))
+        if missing:
+            raise CommandError(f"No stories with ids {', '.join(map(str, sorted(missing)))}")
+
+        if len(options['story_ids']) > 1:
+            if options['node']:
+                raise CommandError("--node selects a branch of a single story")
+            if not options['output']:
+                raise CommandError("Exporting several stories needs --output for the zip archive")
+            with open(options['output'], 'wb') as file:
+                write_archive(stories.iterator(), options['format'], file)
+            self.stderr.write(f"Wrote {len(options['story_ids'])} stories to {options['output']}")
+            return
+
+        story = stories.get()
+        if options['format'] == 'epub' and not options['output']:
+            raise CommandError("EPUB is binary; write it to a file with --output")
+        node_ids = None
+        if options['node']:
+            node_ids = branch_path_ids(story, options['node'])
+            if not node_ids:
+                raise CommandError(f"Node {options['node']} is not part of story {story.id}")
+        blocks = export_story(story, options['format'], node_ids, options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'wb') as file:
+                for block in blocks:
+                    file.write(block)
+        else:
+            # Blocks end between whole strings, so each decodes on its own
+            for block in blocks:
+                self.stdout.write(block.decode('utf-8'), ending='')
@@ -0,0 +1,212 @@
+import hashlib
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from stories.corpus import explicit_timestamps, next_id
+from stories.models import (
+    AIWritingPrompt, Contribution, Story, StoryBranch, StoryComment, StoryNode, WritingSession,
+)
+
+BENCHMARK_USERNAME = 'bench_owner'
+BENCHMARK_PASSWORD = 'benchmark'
+
+WORDS = (
+    'the', 'lantern', 'flickered', 'as', 'a', 'stranger', 'stepped', 'through', 'door',
+    'carrying', 'map', 'nobody', 'had', 'seen', 'before', 'and', 'silence', 'fell', 'over',
+    'room', 'while', 'storm', 'gathered', 'beyond', 'hills', 'where', 'old', 'promises',
+    'waited', 'to', 'be', 'kept', 'quietly', 'under', 'moonlight', 'captain', 'river',
+)
+
+
+class Command(BaseCommand):
+    help = "Bulk-generate a synthetic corpus of users, stories, branching node trees and activity"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--stories', type=int, default=100)
+        parser.add_argument('--nodes-per-story', type=int, default=50, help="Average nodes per story")
+        parser.add_argument('--branch-probability', type=float, default=0.1,
+                            help="Chance that a node continues from an earlier branch point")
+        parser.add_argument('--writers-per-story', type=int, default=4)
+        parser.add_argument('--comments-per-story', type=int, default=10)
+        parser.add_argument('--prompts-per-story', type=int, default=10)
+        parser.add_argument('--owner-stories', type=int, default=20,
+                            help=f"Stories owned by the '{BENCHMARK_USERNAME}' user the view benchmark logs in as")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.paragraphs = [
+            ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(20, 120))) + '.'
+            for _ in range(500)
+        ]
+        started = time.perf_counter()
+
+        with explicit_timestamps(User, Story, StoryNode, Contribution, WritingSession,
+                                 StoryBranch, StoryComment, AIWritingPrompt):
+            # Before the explicit-id users: once they exist, the sequence lags behind their ids
+            owner_id = self.get_owner()
+            user_ids = self.create_users(options['users'])
+            story_ids = self.create_stories(options['stories'], user_ids, owner_id, options['owner_stories'])
+            node_count = self.create_story_content(story_ids, user_ids, owner_id, options)
+
+        # Explicit ids bypass the sequences on databases that have them
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [User, Story, StoryNode]):
+                cursor.execute(sql)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(user_ids)} users, {len(story_ids)} stories and {node_count} nodes "
+            f"in {elapsed:.1f}s ({node_count / elapsed:.0f} nodes/s)"
+        ))
+        self.stdout.write(f"Benchmark user: {BENCHMARK_USERNAME} / {BENCHMARK_PASSWORD}")
+
+    def timestamp(self, max_days=365):
+        return self.now - timedelta(seconds=self.rng.randint(0, max_days * 86400))
+
+    def create_users(self, count):
+        password = make_password(BENCHMARK_PASSWORD)
+        first_id = next_id(User)
+        users = []
+        for user_id in range(first_id, first_id + count):
+            users.append(User(
+                id=user_id, username=f'writer{user_id}', email=f'writer{user_id}@example.com',
+                password=password, date_joined=self.timestamp(),
+            ))
+        self.bulk_create(User, users)
+        self.stdout.write(f"  users: {count}")
+        return list(range(first_id, first_id + count))
+
+    def get_owner(self):
+        owner, created = User.objects.get_or_create(username=BENCHMARK_USERNAME)
+        if created:
+            owner.set_password(BENCHMARK_PASSWORD)
+            owner.save()
+        return owner.id
+
+    def create_stories(self, count, user_ids, owner_id, owner_stories):
+        genres = [choice for choice, _ in Story.GENRE_CHOICES]
+        first_id = next_id(Story)
+        stories = []
+        for offset in range(count):
+            created_at = self.timestamp()
+            stories.append(Story(
+                id=first_id + offset,
+                title=f'Synthetic story {first_id + offset}',
+                genre=self.rng.choice(genres),
+                initial_prompt=self.rng.choice(self.paragraphs),
+                created_by_id=owner_id if offset < owner_stories else self.rng.choice(user_ids),
+                created_at=created_at,
+                updated_at=created_at,
+                is_public=self.rng.random() < 0.9,
+                is_completed=self.rng.random() < 0.2,
+            ))
+        self.bulk_create(Story, stories)
+        self.stdout.write(f"  stories: {count}")
+        return [story.id for story in stories]
+
+    def create_story_content(self, story_ids, user_ids, owner_id, options):
+        """Nodes, branches, contributions, sessions, comments and prompts, story by story"""
+        node_id = next_id(StoryNode)
+        pending = {model: [] for model in (StoryNode, StoryBranch, Contribution, WritingSession, StoryComment, AIWritingPrompt)}
+        story_words = {}
+        node_count = 0
+        reported = time.perf_counter()
+        prompt_types = [choice for choice, _ in AIWritingPrompt.PROMPT_TYPE_CHOICES]
+
+        for index, story_id in enumerate(story_ids):
+            writers = self.rng.sample(user_ids, min(len(user_ids), options['writers_per_story']))
+            if index < options['owner_stories']:
+                writers.append(owner_id)
+            size = max(1, int(self.rng.expovariate(1 / options['nodes_per_story'])))
+            created_at = self.timestamp()
+
+            # A main line that sometimes continues from an earlier branch point
+            story_node_ids = []
+            branch_points = []
+            totals = {}
+            words = 0
+            previous = None
+            for position in range(size):
+                parent = previous
+                if branch_points and self.rng.random() < options['branch_probability']:
+                    parent = self.rng.choice(branch_points)
+                content = self.rng.choice(self.paragraphs)
+                word_count = len(content.split())
+                author = self.rng.choice(writers)
+                is_branch_point = self.rng.random() < 0.05
+                created_at += timedelta(seconds=self.rng.randint(30, 3600))
+                pending[StoryNode].append(StoryNode(
+                    id=node_id, story_id=story_id, content=content, author_id=author,
+                    parent_node_id=parent, order=position, word_count=word_count,
+                    is_branch_point=is_branch_point, created_at=created_at,
+                ))
+                if is_branch_point:
+                    branch_points.append(node_id)
+                    pending[StoryBranch].append(StoryBranch(
+                        story_id=story_id, parent_node_id=node_id, branch_name=f'Branch at {position}',
+                        created_by_id=author, created_at=created_at,
+                    ))
+                nodes, author_words = totals.get(author, (0, 0))
+                totals[author] = (nodes + 1, author_words + word_count)
+                words += word_count
+                story_node_ids.append(node_id)
+                previous = node_id
+                node_id += 1
+            story_words[story_id] = words
+            node_count += size
+
+            for author, (nodes, author_words) in totals.items():
+                pending[Contribution].append(Contribution(
+                    user_id=author, story_id=story_id, nodes_created=nodes, words_contributed=author_words,
+                    first_contribution=created_at, last_contribution=created_at,
+                ))
+            for writer in set(writers):
+                pending[WritingSession].append(WritingSession(
+                    story_id=story_id, user_id=writer, is_active=writer == owner_id or self.rng.random() < 0.3,
+                    current_node_id=story_node_ids[-1], joined_at=created_at, last_activity=created_at,
+                ))
+            for _ in range(options['comments_per_story']):
+                pending[StoryComment].append(StoryComment(
+                    story_id=story_id, node_id=self.rng.choice(story_node_ids), user_id=self.rng.choice(user_ids),
+                    content=self.rng.choice(self.paragraphs)[:200], created_at=created_at,
+                    is_resolved=self.rng.random() < 0.5,
+                ))
+            for _ in range(options['prompts_per_story']):
+                text = self.rng.choice(self.paragraphs)[:300]
+                pending[AIWritingPrompt].append(AIWritingPrompt(
+                    story_id=story_id, prompt_type=self.rng.choice(prompt_types), generated_text=text,
+                    text_hash=hashlib.sha256(text.encode('utf-8')).hexdigest(),
+                    used=self.rng.random() < 0.3, created_at=created_at,
+                ))
+
+            # One transaction per batch; nodes first so everything referring to them can be inserted
+            if len(pending[StoryNode]) >= self.batch_size or index == len(story_ids) - 1:
+                with transaction.atomic():
+                    for model, objects in pending.items():
+                        self.bulk_create(model, objects)
+                        objects.clear()
+                if time.perf_counter() - reported > 5:
+                    reported = time.perf_counter()
+                    self.stdout.write(f"  nodes: {node_count} ({index + 1}/{len(story_ids)} stories)")
+
+        stories = [Story(id=story_id, word_count=words) for story_id, words in story_words.items()]
+        Story.objects.bulk_update(stories, ['word_count'], batch_size=self.batch_size)
+        self.stdout.write(f"  nodes: {node_count}")
+        return node_count
+
+    def bulk_create(self, model, objects):
+        with transaction.atomic():
+            model.objects.bulk_create(objects, batch_size=self.batch_size)
@@ -0,0 +1,45 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from stories.corpus import import_records, read_header, start_import
+
+from .export_stories import open_corpus
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a JSONL story corpus written by export_stories, in transaction chunks that "
+        "a failed run can --resume from"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=10000, help="Records committed per transaction")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per bulk INSERT")
+        parser.add_argument('--resume', action='store_true',
+                            help="Continue an earlier import of this file after its last committed chunk")
+
+    def handle(self, *args, **options):
+        source = os.path.abspath(options['path'])
+        try:
+            with open_corpus(source, 'r') as file:
+                header = read_header(file.readline())
+                progress = start_import(source, header, options['resume'])
+                if progress.lines_done:
+                    self.stdout.write(
+                        f"Resuming after line {progress.lines_done} ({progress.nodes_imported} nodes imported)"
+                    )
+                rate = import_records(
+                    file, progress, options['chunk_size'], options['batch_size'], report=self.report
+                )
+        except (OSError, ValueError, DatabaseError) as e:
+            # Chunks committed before the failure stay; --resume carries on after them
+            raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {progress.nodes_imported} nodes from {options['path']} ({rate:.0f} nodes/s)"
+        ))
+
+    def report(self, progress, rate):
+        self.stdout.write(f"  line {progress.lines_done}: {progress.nodes_imported} nodes ({rate:.0f} nodes/s)")
@@ -0,0 +1,71 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from stories.covers import get_config, process_cover, read_cover, render_cover
+from stories.models import Story
+
+
+class Command(BaseCommand):
+    help = (
+        "Render derivatives for story covers that have none (or all covers with --all), "
+        "decoding and resizing in a pool of processes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Rendering processes")
+        parser.add_argument('--all', action='store_true', help="Re-render covers that already have derivatives")
+
+    def handle(self, *args, **options):
+        stories = Story.objects.exclude(cover_image='').exclude(cover_image__isnull=True)
+        if not options['all']:
+            stories = stories.filter(cover_derivatives={})
+        pending = list(stories.order_by('id').only('id', 'cover_image'))
+        if not pending:
+            self.stdout.write("No covers to process")
+            return
+
+        config = get_config()
+        started = time.perf_counter()
+        processed = failed = 0
+        # Forked workers must not inherit open database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            in_flight = {}
+            queue = iter(pending)
+            while True:
+                # Only a few covers' bytes are held in memory at once
+                while len(in_flight) < options['workers'] * 2:
+                    story = next(queue, None)
+                    if story is None:
+                        break
+                    try:
+                        data = read_cover(story)
+                    except OSError as e:
+                        self.stderr.write(f"Story {story.id}: cannot read {story.cover_image.name}: {e}")
+                        failed += 1
+                        continue
+                    in_flight[pool.submit(render_cover, data, config)] = story
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    story = in_flight.pop(future)
+                    try:
+                        rendered = future.result()
+                    except Exception as e:
+                        self.stderr.write(f"Story {story.id}: {story.cover_image.name}: {e}")
+                        failed += 1
+                        continue
+                    if process_cover(story.id, story.cover_image.name, rendered):
+                        processed += 1
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {processed} of {len(pending)} covers in {elapsed:.1f}s "
+            f"({processed / elapsed:.1f}/s, {options['workers']} workers); {failed} failed"
+        ))
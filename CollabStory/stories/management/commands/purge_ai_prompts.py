@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from stories.prompts import purge_stale_prompts
+
+
+class Command(BaseCommand):
+    help = "Delete unused AI prompts older than the retention period, in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-days', type=int, help="Override AI_PROMPT_RETENTION['TTL_DAYS']")
+        parser.add_argument('--batch-size', type=int, help="Override AI_PROMPT_RETENTION['BATCH_SIZE']")
+
+    def handle(self, *args, **options):
+        prompts_deleted, contexts_deleted = purge_stale_prompts(
+            ttl_days=options['ttl_days'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {prompts_deleted} stale prompts and {contexts_deleted} unused contexts"
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from stories.export import purge_expired_exports
+
+
+class Command(BaseCommand):
+    help = "Delete finished story export archives older than the retention period and release their files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-days', type=int, help="Override STORY_EXPORT_RETENTION['TTL_DAYS']")
+        parser.add_argument('--batch-size', type=int, help="Override STORY_EXPORT_RETENTION['BATCH_SIZE']")
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_exports(ttl_days=options['ttl_days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired exports"))
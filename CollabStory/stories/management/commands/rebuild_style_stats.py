@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from stories.models import Story
+from stories.style import rebuild_story_style
+
+
+class Command(BaseCommand):
+    help = "Recompute the running style statistics for stories from their nodes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('story_ids', nargs='*', type=int, help="Stories to rebuild (default: all)")
+
+    def handle(self, *args, **options):
+        stories = Story.objects.order_by('id')
+        if options['story_ids']:
+            stories = stories.filter(id__in=options['story_ids'])
+        
+        count = 0
+        for story in stories.iterator():
+            rebuild_story_style(story)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt style statistics for {count} stories"))
@@ -0,0 +1,42 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from CollabStory.routers import get_config
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database onto each SQLite read replica, once or every --interval "
+        "seconds, so the replica router can be tried locally with two files"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep copying, waiting this many seconds in between (simulates replication lag)")
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        replicas = [alias for alias in get_config()['ALIASES'] if connections[alias].vendor == 'sqlite']
+        if primary.vendor != 'sqlite' or not replicas:
+            raise CommandError("Needs an SQLite primary and at least one SQLite replica (set DATABASE_REPLICA)")
+
+        while True:
+            started = time.perf_counter()
+            source = sqlite3.connect(primary.settings_dict['NAME'])
+            try:
+                for alias in replicas:
+                    target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                    try:
+                        # The backup API gives a consistent copy while the primary is in use
+                        source.backup(target)
+                    finally:
+                        target.close()
+            finally:
+                source.close()
+            self.stdout.write(f"Synced {', '.join(replicas)} in {(time.perf_counter() - started) * 1000:.0f} ms")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
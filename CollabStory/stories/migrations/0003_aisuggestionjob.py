@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('stories', '0002_story_archive_reason_story_archived_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AISuggestionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prompt_type', models.CharField(choices=[('plot_twist', 'Plot Twist'), ('character', 'Character Development'), ('dialogue', 'Dialogue'), ('setting', 'Setting Description'), ('conflict', 'Conflict Generation'), ('continuation', 'Story Continuation'), ('description', 'Scene Description')], max_length=50)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ai_jobs', to=settings.AUTH_USER_MODEL)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ai_jobs', to='stories.story')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='aiwritingprompt',
+            name='job',
+            field=models.ForeignKey(blank=True, help_text='The background job that generated this prompt', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='prompts', to='stories.aisuggestionjob'),
+        ),
+    ]
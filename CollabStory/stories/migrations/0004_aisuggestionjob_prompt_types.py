@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0003_aisuggestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aisuggestionjob',
+            name='prompt_types',
+            field=models.JSONField(blank=True, default=list, help_text='Prompt types generated together by a batch job'),
+        ),
+        migrations.AlterField(
+            model_name='aisuggestionjob',
+            name='prompt_type',
+            field=models.CharField(choices=[('plot_twist', 'Plot Twist'), ('character', 'Character Development'), ('dialogue', 'Dialogue'), ('setting', 'Setting Description'), ('conflict', 'Conflict Generation'), ('continuation', 'Story Continuation'), ('description', 'Scene Description'), ('batch', 'Batch')], max_length=50),
+        ),
+    ]
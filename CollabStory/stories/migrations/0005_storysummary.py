@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0004_aisuggestionjob_prompt_types'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveSmallIntegerField(default=0, help_text='0 summarizes nodes; higher levels summarize summaries')),
+                ('first_node_id', models.BigIntegerField()),
+                ('last_node_id', models.BigIntegerField()),
+                ('node_count', models.IntegerField()),
+                ('summary', models.TextField()),
+                ('token_count', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='stories.story')),
+            ],
+            options={
+                'ordering': ['first_node_id'],
+                'indexes': [models.Index(fields=['story', 'last_node_id'], name='stories_sto_story_i_12623d_idx')],
+            },
+        ),
+    ]
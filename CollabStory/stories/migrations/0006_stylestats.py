@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('stories', '0005_storysummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StyleStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('node_count', models.IntegerField(default=0)),
+                ('word_count', models.IntegerField(default=0)),
+                ('sentence_count', models.IntegerField(default=0)),
+                ('dialogue_lines', models.IntegerField(default=0)),
+                ('content_lines', models.IntegerField(default=0)),
+                ('vocabulary_sketch', models.BinaryField(default=bytes, help_text='HyperLogLog registers for distinct words')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='style_stats', to='stories.story')),
+                ('user', models.ForeignKey(blank=True, help_text='Empty for the whole-story totals', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='style_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='stylestats',
+            constraint=models.UniqueConstraint(fields=('story', 'user'), name='unique_style_stats_per_author'),
+        ),
+        migrations.AddConstraint(
+            model_name='stylestats',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('story',), name='unique_style_stats_per_story'),
+        ),
+    ]
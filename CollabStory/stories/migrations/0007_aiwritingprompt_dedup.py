@@ -0,0 +1,74 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+import hashlib
+
+
+def move_contexts(apps, schema_editor):
+    """Store each distinct context once and hash existing generated texts"""
+    AIWritingPrompt = apps.get_model('stories', 'AIWritingPrompt')
+    AIPromptContext = apps.get_model('stories', 'AIPromptContext')
+    db = schema_editor.connection.alias
+    
+    context_ids = {}
+    batch = []
+    for prompt in AIWritingPrompt.objects.using(db).only('id', 'context', 'generated_text').iterator(chunk_size=1000):
+        prompt.text_hash = hashlib.sha256(prompt.generated_text.encode('utf-8')).hexdigest()
+        if prompt.context:
+            key = hashlib.sha256(prompt.context.encode('utf-8')).hexdigest()
+            if key not in context_ids:
+                context_ids[key] = AIPromptContext.objects.using(db).create(hash=key, text=prompt.context).id
+            prompt.prompt_context_id = context_ids[key]
+        batch.append(prompt)
+        if len(batch) >= 1000:
+            AIWritingPrompt.objects.using(db).bulk_update(batch, ['text_hash', 'prompt_context'])
+            batch = []
+    if batch:
+        AIWritingPrompt.objects.using(db).bulk_update(batch, ['text_hash', 'prompt_context'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0006_stylestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIPromptContext',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('text', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='aiwritingprompt',
+            name='prompt_context',
+            field=models.ForeignKey(blank=True, help_text='The story context used to generate this prompt', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='prompts', to='stories.aipromptcontext'),
+        ),
+        migrations.AddField(
+            model_name='aiwritingprompt',
+            name='text_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 of generated_text, used to skip duplicates', max_length=64),
+        ),
+        migrations.RunPython(move_contexts, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='aiwritingprompt',
+            name='context',
+        ),
+        migrations.AddIndex(
+            model_name='aiwritingprompt',
+            index=models.Index(fields=['story', 'used', 'created_at'], name='stories_aiw_story_i_3985b7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aiwritingprompt',
+            index=models.Index(fields=['story', 'text_hash'], name='stories_aiw_story_i_a904c2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aiwritingprompt',
+            index=models.Index(fields=['used', 'created_at'], name='stories_aiw_used_fa0f03_idx'),
+        ),
+    ]
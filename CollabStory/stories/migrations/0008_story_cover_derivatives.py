@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0007_aiwritingprompt_dedup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='cover_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Resized WebP/JPEG renditions of the cover (see stories/covers.py)'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0010_storyexport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoryImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=500)),
+                ('header', models.JSONField(help_text="The file's header record, to recognise it on resume")),
+                ('id_offsets', models.JSONField(help_text="Added to the file's story and node ids to get the new ones")),
+                ('lines_done', models.PositiveIntegerField(default=0)),
+                ('nodes_imported', models.PositiveIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
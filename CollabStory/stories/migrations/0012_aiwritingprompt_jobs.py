@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:33
+
+from django.db import migrations, models
+
+
+def copy_job_links(apps, schema_editor):
+    """Each prompt keeps the job it was generated by"""
+    AIWritingPrompt = apps.get_model('stories', 'AIWritingPrompt')
+    links = AIWritingPrompt.jobs.through
+    db = schema_editor.connection.alias
+    prompts = AIWritingPrompt.objects.using(db).filter(job__isnull=False).values_list('id', 'job_id')
+    links.objects.using(db).bulk_create(
+        [links(aiwritingprompt_id=prompt_id, aisuggestionjob_id=job_id) for prompt_id, job_id in prompts.iterator()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0011_storyimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiwritingprompt',
+            name='jobs',
+            field=models.ManyToManyField(blank=True, help_text='The background jobs that generated this prompt; a duplicate suggestion joins the earlier prompt', related_name='+', to='stories.aisuggestionjob'),
+        ),
+        migrations.RunPython(copy_job_links, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='aiwritingprompt',
+            name='job',
+        ),
+        migrations.AlterField(
+            model_name='aiwritingprompt',
+            name='jobs',
+            field=models.ManyToManyField(blank=True, help_text='The background jobs that generated this prompt; a duplicate suggestion joins the earlier prompt', related_name='prompts', to='stories.aisuggestionjob'),
+        ),
+    ]
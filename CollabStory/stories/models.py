@@ -20,6 +20,7 @@ class Story(models.Model):
     genre = models.CharField(max_length=100, choices=GENRE_CHOICES, default='other')
     initial_prompt = models.TextField(help_text="The starting prompt or premise for the story")
     cover_image = models.ImageField(upload_to='story_covers/', null=True, blank=True)
+    cover_derivatives = models.JSONField(default=dict, blank=True, editable=False, help_text="Resized WebP/JPEG renditions of the cover (see stories/covers.py)")
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_stories')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -42,6 +43,12 @@ class Story(models.Model):
     def __str__(self):
         return self.title
     
+    @property
+    def cover_sources(self):
+        """srcset-ready URLs of the cover's derivatives, or None until they are rendered"""
+        from .covers import cover_sources
+        return cover_sources(self)
+    
     def get_contributors(self):
         """Get all users who have contributed to this story"""
         return User.objects.filter(
@@ -55,6 +62,11 @@ class Story(models.Model):
             writing_sessions__is_active=True
         ).distinct()
     
+    def get_ai_context(self):
+        """Build the token-budgeted story context sent to the AI assistant"""
+        from .context import build_story_context
+        return build_story_context(self)
+    
     def can_be_deleted_by(self, user):
         """Check if a user can delete this story"""
         # Only the creator can delete, and only if no other users have contributed
@@ -161,15 +173,113 @@ class AIWritingPrompt(models.Model):
     prompt_type = models.CharField(max_length=50, choices=PROMPT_TYPE_CHOICES)
     generated_text = models.TextField()
     used = models.BooleanField(default=False)
+    text_hash = models.CharField(max_length=64, blank=True, help_text="SHA-256 of generated_text, used to skip duplicates")
     created_at = models.DateTimeField(auto_now_add=True)
     used_at = models.DateTimeField(null=True, blank=True)
-    context = models.TextField(blank=True, help_text="The story context used to generate this prompt")
+    prompt_context = models.ForeignKey('AIPromptContext', on_delete=models.PROTECT, null=True, blank=True, related_name='prompts', help_text="The story context used to generate this prompt")
+    jobs = models.ManyToManyField('AISuggestionJob', blank=True, related_name='prompts', help_text="The background jobs that generated this prompt; a duplicate suggestion joins the earlier prompt")
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['story', 'used', 'created_at']),
+            models.Index(fields=['story', 'text_hash']),
+            models.Index(fields=['used', 'created_at']),
+        ]
     
     def __str__(self):
         return f"{self.story.title} - {self.get_prompt_type_display()}"
+    
+    @property
+    def context(self):
+        """The story context used to generate this prompt"""
+        return self.prompt_context.text if self.prompt_context_id else ''
+
+class AIPromptContext(models.Model):
+    """A story context sent to the AI, stored once and shared by every prompt generated from it"""
+    hash = models.CharField(max_length=64, unique=True)
+    text = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.hash[:12]
+
+class AISuggestionJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    BATCH = 'batch'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='ai_jobs')
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='ai_jobs')
+    prompt_type = models.CharField(max_length=50, choices=AIWritingPrompt.PROMPT_TYPE_CHOICES + [(BATCH, 'Batch')])
+    prompt_types = models.JSONField(default=list, blank=True, help_text="Prompt types generated together by a batch job")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.story.title} - {self.prompt_type} job ({self.status})"
+    
+    @property
+    def is_batch(self):
+        return self.prompt_type == self.BATCH
+    
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_COMPLETED, self.STATUS_FAILED)
+
+class StorySummary(models.Model):
+    """Extractive summary of a run of consecutive story nodes"""
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='summaries')
+    level = models.PositiveSmallIntegerField(default=0, help_text="0 summarizes nodes; higher levels summarize summaries")
+    first_node_id = models.BigIntegerField()
+    last_node_id = models.BigIntegerField()
+    node_count = models.IntegerField()
+    summary = models.TextField()
+    token_count = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['first_node_id']
+        indexes = [models.Index(fields=['story', 'last_node_id'])]
+    
+    def __str__(self):
+        return f"{self.story.title} - summary of {self.node_count} nodes"
+
+class StyleStats(models.Model):
+    """Running writing-style totals for a story, or for one author within it"""
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='style_stats')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='style_stats', help_text="Empty for the whole-story totals")
+    node_count = models.IntegerField(default=0)
+    word_count = models.IntegerField(default=0)
+    sentence_count = models.IntegerField(default=0)
+    dialogue_lines = models.IntegerField(default=0)
+    content_lines = models.IntegerField(default=0)
+    vocabulary_sketch = models.BinaryField(default=bytes, help_text="HyperLogLog registers for distinct words")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['story', 'user'], name='unique_style_stats_per_author'),
+            models.UniqueConstraint(fields=['story'], condition=models.Q(user__isnull=True), name='unique_style_stats_per_story'),
+        ]
+    
+    def __str__(self):
+        who = self.user.username if self.user_id else 'all authors'
+        return f"{self.story.title} style ({who})"
 
 class StoryBranch(models.Model):
     story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='branches')
@@ -196,3 +306,59 @@ class StoryComment(models.Model):
     
     def __str__(self):
         return f"Comment by {self.user.username} on {self.story.title}"
+
+class MediaBlob(models.Model):
+    """A file in the content-addressed media store and how many fields refer to it"""
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.BigIntegerField()
+    reference_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.reference_count} references)"
+
+class StoryExport(models.Model):
+    """A background export of several stories into one zip archive"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = AISuggestionJob.STATUS_CHOICES
+    FORMAT_CHOICES = [
+        ('txt', 'Plain text'),
+        ('md', 'Markdown'),
+        ('epub', 'EPUB'),
+    ]
+    
+    requested_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='story_exports')
+    story_ids = models.JSONField(default=list)
+    export_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    file = models.FileField(upload_to='exports/', blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Export of {len(self.story_ids)} stories as {self.export_format} ({self.status})"
+
+class StoryImport(models.Model):
+    """Progress of an import_stories run, committed with each chunk so a failed run can resume"""
+    source = models.CharField(max_length=500)
+    header = models.JSONField(help_text="The file's header record, to recognise it on resume")
+    id_offsets = models.JSONField(help_text="Added to the file's story and node ids to get the new ones")
+    lines_done = models.PositiveIntegerField(default=0)
+    nodes_imported = models.PositiveIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"Import of {self.source} ({self.lines_done} lines)"
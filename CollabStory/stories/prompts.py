@@ -0,0 +1,116 @@
+"""
+Storage and retention for AI writing prompts.
+
+Contexts are stored once in ``AIPromptContext`` and shared by hash, and a
+suggestion whose text matches an unused prompt of the same type on the same
+story refreshes that prompt instead of adding a row. Unused prompts older
+than ``AI_PROMPT_RETENTION['TTL_DAYS']`` are purged in small batches so each
+DELETE holds its locks only briefly.
+"""
+
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models.deletion import ProtectedError
+from django.utils import timezone
+
+from .models import AIPromptContext, AIWritingPrompt
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def intern_context(text):
+    """Return the shared AIPromptContext row for a context, creating it once"""
+    if not text:
+        return None
+    key = text_hash(text)
+    context = AIPromptContext.objects.filter(hash=key).first()
+    if context is None:
+        # Another writer may insert the same context concurrently
+        AIPromptContext.objects.bulk_create([AIPromptContext(hash=key, text=text)], ignore_conflicts=True)
+        context = AIPromptContext.objects.get(hash=key)
+    return context
+
+
+def record_ai_prompts(story, suggestions, context, job=None):
+    """
+    Save (prompt_type, text) suggestions for a story, skipping duplicates
+
+    An unused prompt with the same type and text is moved to the front and
+    linked to ``job`` as well rather than stored again, so every job that
+    produced it can still read it. Returns the prompts in the order given.
+    """
+    suggestions = [(prompt_type, text, text_hash(text)) for prompt_type, text in suggestions]
+    prompt_context = intern_context(context)
+
+    existing = {
+        (prompt.prompt_type, prompt.text_hash): prompt
+        for prompt in story.ai_prompts.filter(used=False, text_hash__in={key for _, _, key in suggestions})
+    }
+    if existing:
+        now = timezone.now()
+        AIWritingPrompt.objects.filter(id__in=[prompt.id for prompt in existing.values()]).update(created_at=now)
+        for prompt in existing.values():
+            prompt.created_at = now
+
+    new_prompts = {}
+    for prompt_type, text, key in suggestions:
+        if (prompt_type, key) not in existing and (prompt_type, key) not in new_prompts:
+            new_prompts[(prompt_type, key)] = AIWritingPrompt(
+                story=story,
+                prompt_type=prompt_type,
+                generated_text=text,
+                text_hash=key,
+                prompt_context=prompt_context
+            )
+    AIWritingPrompt.objects.bulk_create(new_prompts.values())
+    if job is not None:
+        links = AIWritingPrompt.jobs.through
+        links.objects.bulk_create(
+            [links(aiwritingprompt_id=prompt.id, aisuggestionjob_id=job.id)
+             for prompt in (*existing.values(), *new_prompts.values())],
+            ignore_conflicts=True
+        )
+
+    return [existing.get((prompt_type, key)) or new_prompts[(prompt_type, key)] for prompt_type, _, key in suggestions]
+
+
+def purge_stale_prompts(ttl_days=None, batch_size=None, pause=None):
+    """Delete unused prompts older than the TTL, then contexts nothing refers to"""
+    config = getattr(settings, 'AI_PROMPT_RETENTION', {})
+    ttl_days = config.get('TTL_DAYS', 14) if ttl_days is None else ttl_days
+    batch_size = batch_size or config.get('BATCH_SIZE', 500)
+    pause = config.get('BATCH_PAUSE', 0.05) if pause is None else pause
+    cutoff = timezone.now() - timedelta(days=ttl_days)
+
+    stale_prompts = AIWritingPrompt.objects.filter(used=False, created_at__lt=cutoff)
+    prompts_deleted = delete_in_batches(stale_prompts, batch_size, pause)
+
+    # Contexts younger than the cutoff may be about to gain a prompt
+    orphaned_contexts = AIPromptContext.objects.filter(created_at__lt=cutoff, prompts__isnull=True)
+    contexts_deleted = delete_in_batches(orphaned_contexts, batch_size, pause)
+
+    return prompts_deleted, contexts_deleted
+
+
+def delete_in_batches(queryset, batch_size, pause):
+    """Delete a queryset a primary-key batch at a time; each batch is its own transaction"""
+    deleted = 0
+    skipped = set()
+    while True:
+        ids = list(queryset.exclude(id__in=skipped).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        try:
+            count, _ = queryset.model.objects.filter(id__in=ids).delete()
+            deleted += count
+        except (ProtectedError, IntegrityError):
+            # A context was reused between the SELECT and the DELETE; keep this batch
+            skipped.update(ids)
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,196 @@
+"""
+Pre-rendered pages for completed stories.
+
+A completed story no longer changes, so a public, unarchived one is
+rendered once to ``<DIRECTORY>/<story id>.html``. A gzip copy is written
+next to it, and a brotli copy too when the ``brotli`` package is installed.
+``story_snapshot`` serves these files without touching the database. A
+front-end server can also serve the directory directly.
+
+Saving a story (which adding a node also does) or deleting one of its nodes
+queues ``refresh_story_snapshot`` once the transaction commits. The job
+rewrites the snapshot while the story still qualifies, and removes it once
+the story is reopened, made private, archived or deleted. Changes that skip
+model signals, such as queryset updates, need ``manage.py
+build_snapshots``.
+"""
+
+import gzip
+import os
+import tempfile
+import threading
+import weakref
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+_config = None
+
+# Per thread: story id -> weak reference to its refresh waiting for commit
+_queued = threading.local()
+
+
+def get_config():
+    global _config
+    if _config is None:
+        config = getattr(settings, 'STORY_SNAPSHOTS', {})
+        _config = {
+            'ENABLED': config.get('ENABLED', True),
+            'DIRECTORY': str(config.get('DIRECTORY', settings.BASE_DIR / 'snapshots')),
+            # Seconds browsers may reuse a snapshot; it can change if the story is reopened
+            'MAX_AGE': config.get('MAX_AGE', 300),
+        }
+    return _config
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    global _config
+    if setting == 'STORY_SNAPSHOTS':
+        _config = None
+
+
+def snapshot_path(story_id):
+    return os.path.join(get_config()['DIRECTORY'], f'{int(story_id)}.html')
+
+
+def qualifies(story):
+    return story.is_completed and story.is_public and not story.is_archived
+
+
+def render_snapshot(story):
+    return render_to_string('stories/story_snapshot.html', {
+        'story': story,
+        'nodes': story.nodes.select_related('author').order_by('created_at', 'id'),
+        'contributor_count': story.get_contributors().count(),
+    })
+
+
+def write_file(path, data):
+    """Write ``data`` next to ``path`` and move it into place, so readers never see a partial file"""
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(data)
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def write_snapshot(story):
+    path = snapshot_path(story.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    html = render_snapshot(story).encode('utf-8')
+    # Compressed copies first, so the plain file never appears without them
+    write_file(path + '.gz', gzip.compress(html, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_file(path + '.br', brotli.compress(html, mode=brotli.MODE_TEXT))
+    write_file(path, html)
+
+
+def delete_snapshot(story_id):
+    path = snapshot_path(story_id)
+    # The plain file first: the view looks for it before the compressed ones
+    for name in (path, *(path + suffix for _, suffix in ENCODINGS)):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+
+def refresh_snapshot(story_id):
+    """Write or remove a story's snapshot to match its current state; returns whether one exists"""
+    from .models import Story
+
+    story = Story.objects.select_related('created_by').filter(id=story_id).first()
+    if story is None or not qualifies(story):
+        delete_snapshot(story_id)
+        return False
+    write_snapshot(story)
+    return True
+
+
+def queue_refresh(story_id):
+    """Refresh the snapshot after commit, once per transaction however many rows changed"""
+    from CollabStory.jobs import submit
+    from .tasks import refresh_story_snapshot
+
+    # A cascade delete sends one signal per node; one job is enough. A
+    # transaction that rolls back drops its callbacks, which ends their
+    # weak references here too.
+    queued = _queued.__dict__.setdefault('refreshes', {})
+    reference = queued.get(story_id)
+    if reference is not None and reference() is not None:
+        return
+
+    def refresh():
+        if queued.get(story_id) is reference:
+            del queued[story_id]
+        submit(refresh_story_snapshot, story_id)
+    reference = weakref.ref(refresh)
+    queued[story_id] = reference
+    transaction.on_commit(refresh)
+
+
+@receiver(post_save, sender='stories.Story')
+def _story_saved(sender, instance, raw=False, **kwargs):
+    # Stories that never had a snapshot and do not qualify now need no job
+    if raw or not get_config()['ENABLED']:
+        return
+    if qualifies(instance) or os.path.exists(snapshot_path(instance.id)):
+        queue_refresh(instance.id)
+
+
+@receiver(post_delete, sender='stories.Story')
+def _story_deleted(sender, instance, **kwargs):
+    if get_config()['ENABLED']:
+        # The instance loses its id once the delete finishes
+        story_id = instance.id
+        transaction.on_commit(lambda: delete_snapshot(story_id))
+
+
+@receiver(post_delete, sender='stories.StoryNode')
+def _node_deleted(sender, instance, **kwargs):
+    if get_config()['ENABLED'] and os.path.exists(snapshot_path(instance.story_id)):
+        queue_refresh(instance.story_id)
+
+
+def accepted_encodings(header):
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def snapshot_file(story_id, accept_encoding=''):
+    """The snapshot file to send and its Content-Encoding (or None), or (None, None) if there is none"""
+    path = snapshot_path(story_id)
+    if not os.path.exists(path):
+        return None, None
+    accepted = accepted_encodings(accept_encoding)
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.exists(path + suffix):
+            return path + suffix, encoding
+    return path, None
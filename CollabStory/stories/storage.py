@@ -0,0 +1,102 @@
+"""
+Content-addressed storage for uploaded media.
+
+``ContentAddressedStorage`` ignores the name a file is saved under (apart
+from its extension) and stores it as ``content/ab/cd/<sha256><ext>``. Saving
+content that is already stored writes nothing new and adds a reference to
+the existing file. ``MediaBlob`` keeps each file's reference count, and
+``delete`` removes the file once the last reference is gone. Since a name
+always has the same content, the media view lets clients cache these files
+forever.
+
+The content is hashed while it streams to a temporary file in the storage
+directory, one chunk at a time, and the temporary file is then renamed into
+place. Names outside ``content/`` (files stored before this backend) behave
+as in ``FileSystemStorage``.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+PREFIX = 'content'
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_NAME = re.compile(rf'^{PREFIX}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{64}}(\.[0-9a-z]+)?$')
+
+
+def is_content_name(name):
+    return bool(CONTENT_NAME.match(name.replace('\\', '/')))
+
+
+def content_name(digest, name):
+    extension = os.path.splitext(name)[1].lower()
+    return f'{PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that stores each distinct file once, named by its SHA-256"""
+
+    def get_available_name(self, name, max_length=None):
+        # _save picks the real name; content names never clash
+        return name
+
+    def _save(self, name, content):
+        from .models import MediaBlob
+
+        directory = os.path.join(self.location, PREFIX, 'tmp')
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory)
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(descriptor, 'wb') as temporary:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    temporary.write(chunk)
+
+            stored_name = content_name(digest.hexdigest(), name)
+            path = self.path(stored_name)
+            with transaction.atomic():
+                blob, _ = MediaBlob.objects.select_for_update().get_or_create(
+                    name=stored_name, defaults={'size': size}
+                )
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temporary_path, path)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(path, self.file_permissions_mode)
+                MediaBlob.objects.filter(pk=blob.pk).update(reference_count=F('reference_count') + 1)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        return stored_name
+
+    def delete(self, name):
+        """Drop one reference to ``name``; the file goes with the last one"""
+        if not name or not is_content_name(name):
+            return super().delete(name)
+        from .models import MediaBlob
+
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.reference_count > 1:
+                MediaBlob.objects.filter(pk=name).update(reference_count=F('reference_count') - 1)
+                return
+            if blob is not None:
+                blob.delete()
+            # Only once the row is gone for good, and unless the same content
+            # was saved again in the meantime
+            transaction.on_commit(lambda: self._delete_unreferenced(name))
+
+    def _delete_unreferenced(self, name):
+        from .models import MediaBlob
+
+        if not MediaBlob.objects.filter(name=name).exists():
+            super().delete(name)
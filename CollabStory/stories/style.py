@@ -0,0 +1,62 @@
+"""
+Incrementally maintained writing-style statistics.
+
+Each appended node adds its counts and vocabulary sketch to two
+``StyleStats`` rows, one for the whole story and one for the node's author,
+so story-level ``avg_sentence_length``, ``vocabulary_diversity`` and
+``dialogue_ratio`` can be served without reading any node text. Sentence
+counts are per node, so a sentence split across two nodes counts twice, and
+distinct words are a HyperLogLog estimate.
+"""
+
+from django.db import transaction
+
+from ai_assistant.ai_helpers import collect_style_features, get_style_suggestions
+from ai_assistant.sketch import HyperLogLog
+
+from .models import StyleStats
+
+
+def record_node_style(node):
+    """Add one node's style features to its story and author totals; O(node size)"""
+    word_count, sentence_count, vocabulary, dialogue_lines, content_lines = collect_style_features(node.content)
+    sketch = HyperLogLog()
+    sketch.update(vocabulary)
+    
+    with transaction.atomic():
+        for user in (None, node.author):
+            stats, _ = StyleStats.objects.select_for_update().get_or_create(story_id=node.story_id, user=user)
+            stats.node_count += 1
+            stats.word_count += word_count
+            stats.sentence_count += sentence_count
+            stats.dialogue_lines += dialogue_lines
+            stats.content_lines += content_lines
+            stats.vocabulary_sketch = HyperLogLog.from_bytes(stats.vocabulary_sketch).merge(sketch).to_bytes()
+            stats.save()
+
+
+def rebuild_story_style(story):
+    """Recompute a story's style totals from all of its nodes"""
+    with transaction.atomic():
+        StyleStats.objects.filter(story=story).delete()
+        for node in story.nodes.select_related('author').order_by('id').iterator(chunk_size=500):
+            record_node_style(node)
+
+
+def style_metrics(stats):
+    """The analyze_writing_style metrics for a StyleStats row"""
+    unique_words = HyperLogLog.from_bytes(stats.vocabulary_sketch).count()
+    avg_sentence_length = stats.word_count / stats.sentence_count if stats.sentence_count else 0
+    vocabulary_diversity = min(unique_words / stats.word_count, 1.0) if stats.word_count else 0
+    dialogue_ratio = stats.dialogue_lines / stats.content_lines if stats.content_lines else 0
+    
+    return {
+        "node_count": stats.node_count,
+        "word_count": stats.word_count,
+        "sentence_count": stats.sentence_count,
+        "unique_words": unique_words,
+        "avg_sentence_length": round(avg_sentence_length, 2),
+        "vocabulary_diversity": round(vocabulary_diversity, 3),
+        "dialogue_ratio": round(dialogue_ratio, 3),
+        "suggestions": get_style_suggestions(avg_sentence_length, vocabulary_diversity, dialogue_ratio),
+    }
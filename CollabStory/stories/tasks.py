@@ -0,0 +1,49 @@
+import logging
+
+from celery import shared_task
+
+from .context import summarize_backlog
+from .covers import process_cover
+from .export import purge_expired_exports, run_export
+from .prompts import purge_stale_prompts
+from .snapshots import refresh_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def purge_ai_prompts():
+    """Periodically remove unused AI prompts past their retention period"""
+    prompts_deleted, contexts_deleted = purge_stale_prompts()
+    logger.info("Purged %s stale AI prompts and %s unused contexts", prompts_deleted, contexts_deleted)
+
+
+@shared_task
+def process_cover_image(story_id, name):
+    """Validate an uploaded cover, strip its metadata and render its derivatives"""
+    process_cover(story_id, name)
+
+
+@shared_task
+def export_stories_archive(export_id):
+    """Zip the exports of several stories into a downloadable file"""
+    run_export(export_id)
+
+
+@shared_task
+def purge_story_exports():
+    """Periodically remove export archives past their retention period"""
+    deleted = purge_expired_exports()
+    logger.info("Purged %s expired story exports", deleted)
+
+
+@shared_task
+def refresh_story_snapshot(story_id):
+    """Re-render a completed story's static page, or remove it if the story no longer qualifies"""
+    refresh_snapshot(story_id)
+
+
+@shared_task
+def summarize_story_backlog(story_id):
+    """Write the AI context summaries an append left for later"""
+    summarize_backlog(story_id)
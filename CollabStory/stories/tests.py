@@ -1,8 +1,56 @@
-from django.test import TestCase
-from django.contrib.auth.models import User
+import asyncio
+import io
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection, router, transaction
+from django.db.backends.signals import connection_created
+from django.db.migrations.executor import MigrationExecutor
+from django.contrib.sessions.models import Session
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from .models import Story, StoryNode, Contribution
+from .models import Story, StoryNode, Contribution, AIWritingPrompt, AISuggestionJob, StorySummary, StyleStats, WritingSession, AIPromptContext, MediaBlob, StoryExport, StoryImport, StoryBranch, StoryComment
+from .storage import ContentAddressedStorage, is_content_name
+from .snapshots import snapshot_path
+from .corpus import import_records, read_header, start_import
+from .style import rebuild_story_style
+from .tasks import summarize_story_backlog
+from .prompts import purge_stale_prompts, record_ai_prompts
+from .context import build_story_context, estimate_tokens, update_story_summaries
 from django.utils import timezone
+from ai_assistant.tasks import run_suggestion_job
+from CollabStory.metrics import REGISTRY, Counter, Gauge, collect_all, render
+from CollabStory import db as collab_db
+from CollabStory.perf import install_sql_timer
+from CollabStory.views import media
+from CollabStory.checks import check_static_references
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from CollabStory.routers import ReplicaRoutingMiddleware, use_primary
+from CollabStory.sqlite import apply_profile, database_write_to_async, get_config as sqlite_config
+import json
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from .routing import websocket_urlpatterns
+from . import async_views
+from .covers import render_cover, get_config as cover_config
+from .forms import StoryForm
+from django.core.files.uploadedfile import SimpleUploadedFile
 
 
 class StoryModelTest(TestCase):
@@ -91,4 +139,1237 @@ class StoryViewTest(TestCase):
         """Test that creating a story works when logged in"""
         self.client.login(username='testuser', password='testpass123')
         response = self.client.get(reverse('stories:create_story'))
-        self.assertEqual(response.status_code, 200)
\ No newline at end of file
+        self.assertEqual(response.status_code, 200)
+
+@override_settings(
+    GEMINI_API_KEY='your-gemini-api-key-here',
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class AISuggestionJobTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='writer', password='testpass123')
+        self.story = Story.objects.create(
+            title='Job Story',
+            genre='mystery',
+            initial_prompt='A letter arrives with no stamp.',
+            created_by=self.user
+        )
+        self.client.login(username='writer', password='testpass123')
+        
+    def test_suggestion_endpoint_returns_job_immediately(self):
+        """The endpoint queues a job instead of generating in the request"""
+        with mock.patch('stories.async_views.submit') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get(
+                    reverse('stories:get_ai_suggestion', args=[self.story.id]) + '?type=plot_twist'
+                )
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        job = AISuggestionJob.objects.get(id=data['job_id'])
+        self.assertEqual(job.status, AISuggestionJob.STATUS_PENDING)
+        self.assertEqual(job.prompt_type, 'plot_twist')
+        submit.assert_called_once_with(run_suggestion_job, job.id)
+        self.assertFalse(AIWritingPrompt.objects.exists())
+        
+    def test_job_stores_prompt_and_is_pollable(self):
+        """Running the job saves the prompt and exposes it on the status endpoint"""
+        job = AISuggestionJob.objects.create(story=self.story, requested_by=self.user, prompt_type='setting')
+        run_suggestion_job(job.id)
+        
+        job.refresh_from_db()
+        self.assertEqual(job.status, AISuggestionJob.STATUS_COMPLETED)
+        prompt = job.prompts.get()
+        self.assertEqual(prompt.context, self.story.initial_prompt)
+        
+        data = self.client.get(reverse('stories:ai_suggestion_job', args=[job.id])).json()
+        self.assertEqual(data['status'], 'completed')
+        self.assertEqual(data['suggestion'], prompt.generated_text)
+        self.assertEqual(data['prompt_id'], prompt.id)
+        
+    def test_fallback_suggestions_do_not_repeat_within_a_story(self):
+        """Without a provider each job gets a suggestion the story hasn't had yet"""
+        texts = []
+        for _ in range(5):
+            job = AISuggestionJob.objects.create(story=self.story, requested_by=self.user, prompt_type='dialogue')
+            run_suggestion_job(job.id)
+            texts.append(job.prompts.get().generated_text)
+        self.assertEqual(len(set(texts)), 5)
+        
+    def test_batch_job_creates_one_prompt_per_type_with_one_call(self):
+        """A batch job makes one provider call and bulk-creates every prompt"""
+        with mock.patch('stories.views.submit'):
+            response = self.client.get(
+                reverse('stories:get_ai_suggestions_batch', args=[self.story.id]) + '?types=dialogue,setting,bogus'
+            )
+        self.assertEqual(response.status_code, 202)
+        job = AISuggestionJob.objects.get(id=response.json()['job_id'])
+        self.assertEqual(job.prompt_types, ['dialogue', 'setting'])
+        
+        client = mock.Mock()
+        client.cache_params.return_value = {'provider': 'mock'}
+        client.generate.return_value = '```json\n{"dialogue": "\\"Run,\\" she said.", "setting": "A drowned city."}\n```'
+        with mock.patch('ai_assistant.ai_helpers.get_provider_client', return_value=client):
+            # job, claim, context nodes, shared context (3), duplicate check, insert, job links, save
+            with self.assertNumQueries(10):
+                run_suggestion_job(job.id)
+        client.generate.assert_called_once()
+        
+        data = self.client.get(reverse('stories:ai_suggestion_job', args=[job.id])).json()
+        self.assertEqual(
+            [(item['prompt_type'], item['suggestion']) for item in data['suggestions']],
+            [('dialogue', '"Run," she said.'), ('setting', 'A drowned city.')]
+        )
+        
+    def test_jobs_with_the_same_suggestion_both_report_it(self):
+        """A duplicate suggestion joins the earlier prompt without taking it from the earlier job"""
+        jobs = [
+            AISuggestionJob.objects.create(story=self.story, requested_by=self.user, prompt_type='setting')
+            for _ in range(2)
+        ]
+        with mock.patch('ai_assistant.tasks.generate_ai_suggestion', return_value='A lighthouse.'):
+            for job in jobs:
+                run_suggestion_job(job.id)
+        
+        prompt = AIWritingPrompt.objects.get(story=self.story)
+        for job in jobs:
+            data = self.client.get(reverse('stories:ai_suggestion_job', args=[job.id])).json()
+            self.assertEqual(data['status'], 'completed')
+            self.assertEqual(data['suggestion'], 'A lighthouse.')
+            self.assertEqual(data['prompt_id'], prompt.id)
+        
+    def test_other_users_cannot_poll_a_job(self):
+        """A job's suggestions are only reported to the user who requested it"""
+        job = AISuggestionJob.objects.create(story=self.story, requested_by=self.user, prompt_type='setting')
+        run_suggestion_job(job.id)
+        User.objects.create_user(username='snoop', password='testpass123')
+        self.client.login(username='snoop', password='testpass123')
+        response = self.client.get(reverse('stories:ai_suggestion_job', args=[job.id]))
+        self.assertEqual(response.status_code, 404)
+        
+    def test_job_runs_only_once(self):
+        """A redelivered job does not generate a second prompt"""
+        job = AISuggestionJob.objects.create(story=self.story, prompt_type='character')
+        run_suggestion_job(job.id)
+        run_suggestion_job(job.id)
+        self.assertEqual(AIWritingPrompt.objects.filter(jobs=job).count(), 1)
+
+
+@override_settings(
+    JOB_BACKEND='thread',
+    GEMINI_API_KEY='your-gemini-api-key-here',
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class ThreadJobBackendTest(TransactionTestCase):
+    def test_thread_backend_completes_job(self):
+        """The thread pool backend runs queued jobs outside the request"""
+        user = User.objects.create_user(username='writer', password='testpass123')
+        story = Story.objects.create(title='Threaded', initial_prompt='Rain.', created_by=user)
+        self.client.login(username='writer', password='testpass123')
+        
+        data = self.client.get(reverse('stories:get_ai_suggestion', args=[story.id])).json()
+        status_url = data['status_url']
+        for _ in range(100):
+            data = self.client.get(status_url).json()
+            if data['status'] == 'completed':
+                break
+            time.sleep(0.05)
+        self.assertEqual(data['status'], 'completed')
+        self.assertIn('suggestion', data)
+
+
+def story_socket(story, user):
+    """ASGI communicator connected to a story's WebSocket route"""
+    path = f'/ws/story/{story.id}/'
+    return ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+        'type': 'websocket', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+        'headers': [], 'subprotocols': [], 'user': user,
+    })
+
+
+async def receive_json(communicator, timeout=5):
+    message = await communicator.receive_output(timeout)
+    return json.loads(message['text'])
+
+
+@override_settings(
+    AI_PROVIDER='simulated',
+    AI_SIMULATED_PROVIDER={'WORDS': 40, 'CHUNK_WORDS': 4},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class StreamingSuggestionTest(TransactionTestCase):
+    async def test_suggestion_streams_chunks_then_final_text(self):
+        """Streaming sends partial chunks before the saved final suggestion"""
+        user = await User.objects.acreate(username='streamer')
+        story = await Story.objects.acreate(title='Stream', initial_prompt='Fog rolled in.', created_by=user)
+        
+        communicator = story_socket(story, user)
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output(5))['type'], 'websocket.accept')
+        await receive_json(communicator)  # our own "joined" activity
+        
+        await communicator.send_input({
+            'type': 'websocket.receive',
+            'text': json.dumps({'type': 'ai_suggestion_request', 'prompt_type': 'setting'}),
+        })
+        chunks = []
+        while True:
+            frame = await receive_json(communicator)
+            self.assertEqual(frame['type'], 'ai_suggestion')
+            if frame['done']:
+                break
+            chunks.append(frame['chunk'])
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+        
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(frame['suggestion'], ''.join(chunks).strip())
+        prompt = await AIWritingPrompt.objects.aget(id=frame['prompt_id'])
+        self.assertEqual(prompt.generated_text, frame['suggestion'])
+        self.assertEqual(prompt.prompt_type, 'setting')
+
+
+    async def test_anonymous_request_is_refused(self):
+        """Signed-out readers cannot start a suggestion over the socket"""
+        user = await User.objects.acreate(username='owner')
+        story = await Story.objects.acreate(title='Closed', initial_prompt='Rain.', created_by=user)
+        
+        communicator = story_socket(story, AnonymousUser())
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output(5))['type'], 'websocket.accept')
+        await communicator.send_input({
+            'type': 'websocket.receive',
+            'text': json.dumps({'type': 'ai_suggestion_request', 'prompt_type': 'setting'}),
+        })
+        frame = await receive_json(communicator)
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+        
+        self.assertEqual(frame['type'], 'error')
+        self.assertFalse(await AIWritingPrompt.objects.filter(story=story).aexists())
+        
+    async def test_socket_handles_events_while_streaming(self):
+        """Other socket traffic is delivered while a suggestion streams, and leaving cancels it"""
+        user = await User.objects.acreate(username='streamer')
+        story = await Story.objects.acreate(title='Busy', initial_prompt='Fog rolled in.', created_by=user)
+        started = threading.Event()
+        release = threading.Event()
+        
+        def slow_stream(*args, **kwargs):
+            started.set()
+            release.wait(5)
+            yield 'Too late.'
+        
+        communicator = story_socket(story, user)
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output(5))['type'], 'websocket.accept')
+        await receive_json(communicator)  # our own "joined" activity
+        with mock.patch('stories.consumers.stream_ai_suggestion', slow_stream):
+            await communicator.send_input({
+                'type': 'websocket.receive',
+                'text': json.dumps({'type': 'ai_suggestion_request', 'prompt_type': 'setting'}),
+            })
+            await communicator.send_input({
+                'type': 'websocket.receive',
+                'text': json.dumps({'type': 'user_typing', 'user': 'streamer', 'is_typing': True}),
+            })
+            frame = await receive_json(communicator)
+            self.assertTrue(await asyncio.to_thread(started.wait, 5))
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+            release.set()
+        
+        self.assertEqual(frame['type'], 'typing')
+        self.assertFalse(await AIWritingPrompt.objects.filter(story=story).aexists())
+
+
+@override_settings(AI_CONTEXT={'TOKEN_BUDGET': 300, 'RECENT_WINDOW': 3, 'SEGMENT_SIZE': 4, 'FANOUT': 2, 'SUMMARY_WORDS': 20})
+class StoryContextTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='author')
+        self.story = Story.objects.create(title='Long', initial_prompt='A ship leaves port.', created_by=self.user)
+        
+    def add_nodes(self, count):
+        for i in range(count):
+            StoryNode.objects.create(
+                story=self.story,
+                author=self.user,
+                content=f'Chapter {i} begins here. ' + 'The sea was grey and endless. ' * 10
+            )
+            update_story_summaries(self.story)
+        
+    def test_summaries_are_incremental_and_compacted(self):
+        """Old nodes are summarized in segments and merged up a level"""
+        self.add_nodes(3 + 4 * 5)
+        summaries = list(StorySummary.objects.filter(story=self.story))
+        self.assertEqual(sum(summary.node_count for summary in summaries), 20)
+        self.assertTrue(any(summary.level > 0 for summary in summaries))
+        self.assertLess(len(summaries), 5)
+        
+        # Summaries tile the summarized nodes without overlapping
+        for earlier, later in zip(summaries, summaries[1:]):
+            self.assertLess(earlier.last_node_id, later.first_node_id)
+        
+    def test_context_stays_within_budget_and_is_chronological(self):
+        """Long stories produce a bounded, oldest-first context"""
+        self.add_nodes(30)
+        context = build_story_context(self.story)
+        self.assertLessEqual(estimate_tokens(context), 300 + 20)
+        self.assertTrue(context.startswith('Premise: A ship leaves port.'))
+        self.assertIn('Earlier in the story:', context)
+        self.assertIn('Chapter 0 begins here.', context)
+        self.assertLess(context.index('Chapter 28'), context.index('Chapter 29'))
+        
+    def test_backlog_is_capped_per_append_and_finished_by_job(self):
+        """An append summarizes only a few segments; the job covers the rest"""
+        StoryNode.objects.bulk_create([
+            StoryNode(story=self.story, author=self.user, content=f'Chapter {i} begins here.') for i in range(3 + 4 * 6)
+        ])
+        self.assertTrue(update_story_summaries(self.story))
+        self.assertEqual(StorySummary.objects.filter(story=self.story).aggregate(nodes=Sum('node_count'))['nodes'], 8)
+        
+        summarize_story_backlog(self.story.id)
+        self.assertEqual(StorySummary.objects.filter(story=self.story).aggregate(nodes=Sum('node_count'))['nodes'], 24)
+        self.assertFalse(update_story_summaries(self.story))
+        
+    def test_story_without_nodes_uses_premise(self):
+        """With no nodes the context is just the premise"""
+        self.assertEqual(build_story_context(self.story), 'A ship leaves port.')
+
+
+class StyleStatsTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', password='testpass123')
+        self.story = Story.objects.create(title='Styled', initial_prompt='Begin.', created_by=self.alice)
+        
+    def add_node(self, user, content):
+        WritingSession.objects.get_or_create(story=self.story, user=user)
+        self.client.login(username=user.username, password='testpass123')
+        response = self.client.post(
+            reverse('stories:add_story_node', args=[self.story.id]),
+            data=json.dumps({'content': content}),
+            content_type='application/json'
+        )
+        self.assertTrue(response.json()['success'])
+        
+    def test_stats_update_on_append_and_match_rebuild(self):
+        """Appending nodes keeps story and author totals current"""
+        self.add_node(self.alice, 'The door creaked. Nobody moved.')
+        self.add_node(self.bob, '"Who is there?" asked the guard.\nSilence answered.')
+        
+        data = self.client.get(reverse('stories:story_style_stats', args=[self.story.id])).json()
+        self.assertEqual(data['story']['word_count'], 13)
+        self.assertEqual(data['story']['sentence_count'], 4)
+        self.assertEqual(data['story']['dialogue_ratio'], round(1 / 3, 3))
+        self.assertEqual(data['story']['unique_words'], 12)
+        self.assertEqual(data['authors']['alice']['word_count'], 5)
+        self.assertEqual(data['authors']['bob']['node_count'], 1)
+        
+        before = {(stats.user_id, stats.word_count, bytes(stats.vocabulary_sketch)) for stats in StyleStats.objects.all()}
+        rebuild_story_style(self.story)
+        after = {(stats.user_id, stats.word_count, bytes(stats.vocabulary_sketch)) for stats in StyleStats.objects.all()}
+        self.assertEqual(before, after)
+        
+    def test_stats_are_served_without_reading_nodes(self):
+        """Story-level metrics come from one query on the totals"""
+        self.add_node(self.alice, 'A quiet start.')
+        with self.assertNumQueries(4):  # session, user, story, stats
+            self.client.get(reverse('stories:story_style_stats', args=[self.story.id]))
+
+
+class PromptRetentionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='keeper', password='testpass123')
+        self.story = Story.objects.create(title='Kept', initial_prompt='Once.', created_by=self.user)
+        
+    def test_contexts_are_shared_and_duplicates_refreshed(self):
+        """Identical contexts are stored once and repeated suggestions reuse their row"""
+        first = record_ai_prompts(self.story, [('dialogue', 'Hello.'), ('setting', 'A cave.')], 'Same context')
+        second = record_ai_prompts(self.story, [('dialogue', 'Hello.'), ('setting', 'A ridge.')], 'Same context')
+        
+        self.assertEqual(AIPromptContext.objects.count(), 1)
+        self.assertEqual(AIWritingPrompt.objects.count(), 3)
+        self.assertEqual(second[0].id, first[0].id)
+        self.assertEqual(second[1].context, 'Same context')
+        self.assertGreater(AIWritingPrompt.objects.get(id=first[0].id).created_at, first[1].created_at)
+        
+    def test_purge_removes_only_stale_unused_prompts(self):
+        """Old unused prompts and their orphaned contexts go; used and recent ones stay"""
+        stale, used, old_shared = record_ai_prompts(
+            self.story, [('dialogue', 'Old.'), ('setting', 'Used.'), ('conflict', 'Shared.')], 'Old context'
+        )
+        orphan = record_ai_prompts(self.story, [('character', 'Orphan.')], 'Lonely context')[0]
+        recent = record_ai_prompts(self.story, [('conflict', 'New.')], 'Old context')[0]
+        AIWritingPrompt.objects.filter(id=used.id).update(used=True)
+        long_ago = timezone.now() - timedelta(days=30)
+        AIWritingPrompt.objects.exclude(id=recent.id).update(created_at=long_ago)
+        AIPromptContext.objects.update(created_at=long_ago)
+        
+        self.assertEqual(purge_stale_prompts(ttl_days=14, batch_size=1, pause=0), (3, 1))
+        self.assertEqual(set(AIWritingPrompt.objects.values_list('id', flat=True)), {used.id, recent.id})
+        self.assertEqual(list(AIPromptContext.objects.values_list('text', flat=True)), ['Old context'])
+
+
+class PromptMigrationTest(TransactionTestCase):
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('stories'))
+
+    def test_dedup_migration_moves_existing_contexts(self):
+        """Prompts saved before 0007 keep their context, stored once per distinct text"""
+        executor = MigrationExecutor(connection)
+        executor.migrate([('stories', '0006_stylestats')])
+        old_apps = executor.loader.project_state([('stories', '0006_stylestats')]).apps
+        user = old_apps.get_model('auth', 'User').objects.create(username='archivist')
+        story = old_apps.get_model('stories', 'Story').objects.create(
+            title='Before', initial_prompt='Once.', created_by_id=user.id
+        )
+        OldPrompt = old_apps.get_model('stories', 'AIWritingPrompt')
+        for text, context in [('Hello.', 'Shared'), ('A cave.', 'Shared'), ('Alone.', '')]:
+            OldPrompt.objects.create(story_id=story.id, prompt_type='dialogue', generated_text=text, context=context)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate([('stories', '0007_aiwritingprompt_dedup')])
+        new_apps = executor.loader.project_state([('stories', '0007_aiwritingprompt_dedup')]).apps
+        prompts = new_apps.get_model('stories', 'AIWritingPrompt').objects.select_related('prompt_context')
+        contexts = {
+            prompt.generated_text: prompt.prompt_context.text if prompt.prompt_context else '' for prompt in prompts
+        }
+        self.assertEqual(contexts, {'Hello.': 'Shared', 'A cave.': 'Shared', 'Alone.': ''})
+        self.assertEqual(new_apps.get_model('stories', 'AIPromptContext').objects.count(), 1)
+        self.assertFalse(prompts.filter(text_hash='').exists())
+
+
+class CorpusBenchmarkTest(TestCase):
+    def test_corpus_generation_and_view_benchmark(self):
+        """The generated corpus drives the view benchmark, which fails on more queries"""
+        call_command('generate_corpus', users=6, stories=5, nodes_per_story=8, owner_stories=2,
+                     comments_per_story=2, prompts_per_story=2, batch_size=10, stdout=StringIO())
+        self.assertEqual(Story.objects.count(), 5)
+        self.assertEqual(Story.objects.filter(created_by__username='bench_owner').count(), 2)
+        # Created before the explicit-id writers, so it never needs the lagging sequence
+        owner = User.objects.get(username='bench_owner')
+        self.assertFalse(User.objects.filter(username__startswith='writer', id__lt=owner.id).exists())
+        node = StoryNode.objects.filter(parent_node__isnull=False).first()
+        self.assertEqual(node.parent_node.story_id, node.story_id)
+        self.assertEqual(
+            Contribution.objects.filter(story=node.story).aggregate(total=Sum('words_contributed'))['total'],
+            Story.objects.get(id=node.story_id).word_count
+        )
+        
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, 'views.json')
+            call_command('benchmark_views', baseline=baseline, save=True, repeat=1, stdout=StringIO())
+            nodes = StoryNode.objects.count()
+            call_command('benchmark_views', baseline=baseline, repeat=1, latency_tolerance=100, stdout=StringIO())
+            self.assertEqual(StoryNode.objects.count(), nodes)
+            
+            with open(baseline) as baseline_file:
+                data = json.load(baseline_file)
+            data['views']['profile']['queries'] -= 1
+            with open(baseline, 'w') as baseline_file:
+                json.dump(data, baseline_file)
+            with self.assertRaisesMessage(CommandError, 'profile'):
+                call_command('benchmark_views', baseline=baseline, repeat=1, latency_tolerance=100, stdout=StringIO())
+
+
+PERF_ON = {'ENABLED': True, 'SAMPLE_RATE': 1.0, 'SERVER_TIMING': True}
+
+
+class PerfInstrumentationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='timed', password='testpass123')
+        self.story = Story.objects.create(title='Timed', initial_prompt='Tick.', created_by=self.user)
+        # The test database connection predates the connection_created hook
+        install_sql_timer(connection)
+        
+    def queries_in(self, response):
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        return int(timing['db'].split('desc="')[1].split()[0])
+        
+    @override_settings(PERF_INSTRUMENTATION=PERF_ON)
+    def test_wsgi_request_gets_server_timing_and_log(self):
+        """Sync requests report their SQL in a header and a sampled log line"""
+        self.client.force_login(self.user)
+        with self.assertLogs('CollabStory.perf', 'INFO') as logs:
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(reverse('stories:story_detail', args=[self.story.id]))
+        self.assertEqual(self.queries_in(response), len(captured))
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertIn('kind=http target=stories:story_detail', logs.output[0])
+        
+    @override_settings(PERF_INSTRUMENTATION=PERF_ON)
+    async def test_asgi_request_counts_queries_run_in_threads(self):
+        """Under ASGI the sync view's queries still reach the request's record"""
+        client = AsyncClient()
+        with self.assertLogs('CollabStory.perf', 'INFO'):
+            response = await client.get(reverse('stories:story_list'))
+        self.assertGreater(self.queries_in(response), 0)
+        
+    def test_disabled_instrumentation_adds_nothing(self):
+        """With instrumentation off the middleware is not installed"""
+        response = self.client.get(reverse('stories:story_list'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class MetricsTest(TestCase):
+    def setUp(self):
+        REGISTRY.reset()
+        self.user = User.objects.create_user(username='counted', password='testpass123')
+        self.story = Story.objects.create(title='Counted', initial_prompt='One.', created_by=self.user)
+        
+    def test_counter_sums_per_thread_shards(self):
+        """Increments from many threads all reach the total, including exited threads"""
+        counter = Counter('test_events_total', "Test events", ['kind'])
+        def work():
+            for _ in range(1000):
+                counter.inc('a')
+            counter.inc('b', amount=5)
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc('a')
+        self.assertEqual(counter.samples(), {('a',): 8001, ('b',): 40})
+        self.assertEqual(len(counter._shards), 1)
+        
+    def test_endpoint_requires_staff_or_token(self):
+        """Anonymous scrapes are refused; staff and the bearer token are let in"""
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with override_settings(METRICS={'TOKEN': 'scrape-me'}):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        
+    def test_views_record_latency_and_appends(self):
+        """The detail view is timed and added nodes are counted"""
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.client.get(reverse('stories:story_detail', args=[self.story.id]))
+        self.client.post(
+            reverse('stories:add_story_node', args=[self.story.id]),
+            data=json.dumps({'content': 'Two.'}), content_type='application/json',
+        )
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('collabstory_story_nodes_appended_total 1\n', text)
+        self.assertIn('collabstory_view_duration_seconds_count{view="story_detail"} 1\n', text)
+        self.assertIn('collabstory_view_duration_seconds_bucket{view="story_detail",le="+Inf"} 1\n', text)
+        self.assertIn('collabstory_channel_layer_queue_depth 0\n', text)
+        
+    def test_snapshots_from_other_processes_are_added(self):
+        """Counters include every snapshot; gauges only those of running processes"""
+        exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+        dead_pid = int(exited.stdout)
+        counter = REGISTRY._metrics['collabstory_group_sends_total']
+        gauge = REGISTRY._metrics['collabstory_websocket_connections']
+        counter.inc('story_update')
+        gauge.inc('7')
+        with tempfile.TemporaryDirectory() as directory:
+            for name, pid in (('dead', dead_pid), ('live', os.getppid())):
+                with open(os.path.join(directory, f'{pid}-{name}.json'), 'w') as snapshot:
+                    json.dump({'pid': pid, 'metrics': {
+                        counter.name: {**counter.family(), 'samples': [[['story_update'], 2]]},
+                        gauge.name: {**gauge.family(), 'samples': [[['7'], 3]]},
+                    }}, snapshot)
+            with override_settings(METRICS={'MULTIPROCESS_DIR': directory}):
+                families = collect_all()
+        self.assertEqual(families[counter.name]['samples'], {('story_update',): 5})
+        self.assertEqual(families[gauge.name]['samples'], {('7',): 4})
+        self.assertIn('collabstory_websocket_connections{story="7"} 4', render(families))
+
+
+class SQLiteProfileTest(TransactionTestCase):
+    def test_profile_pragmas_apply(self):
+        """The profile switches a database file to WAL with the configured settings"""
+        with tempfile.TemporaryDirectory() as directory:
+            raw = sqlite3.connect(os.path.join(directory, 'profiled.sqlite3'))
+            apply_profile(raw, {**sqlite_config(), 'BUSY_TIMEOUT': 1234})
+            self.assertEqual(raw.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(raw.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertEqual(raw.execute('PRAGMA busy_timeout').fetchone()[0], 1234)
+            raw.close()
+        
+    @override_settings(SQLITE_PROFILE={'ENABLED': True, 'SERIALIZE_WRITES': True})
+    async def test_consumer_writes_share_one_writer_thread(self):
+        """Concurrent writes from async code all run, in turn, on the writer thread"""
+        user = await User.objects.acreate(username='queued')
+        story = await Story.objects.acreate(title='Queued', initial_prompt='Wait.', created_by=user)
+        
+        @database_write_to_async
+        def write(index):
+            StoryNode.objects.create(story=story, author=user, content=f'Line {index}', order=index)
+            return threading.current_thread().name
+        
+        threads = await asyncio.gather(*(write(index) for index in range(10)))
+        self.assertEqual(len(set(threads)), 1)
+        self.assertTrue(threads[0].startswith('sqlite-writer'))
+        self.assertEqual(await StoryNode.objects.filter(story=story).acount(), 10)
+        
+    def test_benchmark_compares_modes(self):
+        """The benchmark runs every mode against scratch databases"""
+        out = StringIO()
+        call_command('benchmark_sqlite', writers=2, readers=2, duration=0.2, nodes=10, stdout=out)
+        for mode in ('defaults', 'profile', 'profile + writer'):
+            self.assertIn(f'  {mode} ', out.getvalue())
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'STICKY_SECONDS': 10})
+class ReplicaRoutingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader')
+        self.factory = RequestFactory()
+        
+    def route(self, request, action=None):
+        """Where reads go before and after the view runs ``action``"""
+        seen = []
+        def view(request):
+            seen.append(router.db_for_read(Story))
+            if action:
+                action()
+            seen.append(router.db_for_read(Story))
+            return HttpResponse()
+        response = ReplicaRoutingMiddleware(view)(request)
+        return seen, response
+        
+    def test_reads_use_replica_until_the_request_writes(self):
+        """A GET reads from the replica, then from the primary once it has written"""
+        seen, response = self.route(self.factory.get('/'))
+        self.assertEqual(seen, ['replica', 'replica'])
+        self.assertNotIn('db_primary', response.cookies)
+        
+        write = lambda: Story.objects.create(title='New', initial_prompt='Go.', created_by=self.user)
+        seen, response = self.route(self.factory.get('/'), write)
+        self.assertEqual(seen, ['replica', 'default'])
+        self.assertEqual(response.cookies['db_primary']['max-age'], 10)
+        
+    def test_recent_writers_and_unsafe_methods_read_the_primary(self):
+        """The stickiness cookie and POSTs pin every read to the primary"""
+        request = self.factory.get('/')
+        request.COOKIES['db_primary'] = '1'
+        self.assertEqual(self.route(request)[0], ['default', 'default'])
+        self.assertEqual(self.route(self.factory.post('/'))[0], ['default', 'default'])
+        with use_primary():
+            self.assertEqual(router.db_for_read(Story), 'default')
+        
+    def test_admin_sessions_and_background_work_use_the_primary(self):
+        """Admin views, session reads and reads outside requests stay on the primary"""
+        request = self.factory.get('/admin/')
+        request.resolver_match = resolve('/admin/')
+        middleware = ReplicaRoutingMiddleware(lambda request: (
+            middleware.process_view(request, None, (), {}) or HttpResponse(router.db_for_read(Story))
+        ))
+        self.assertEqual(middleware(request).content, b'default')
+        
+        seen = []
+        ReplicaRoutingMiddleware(lambda request: seen.append(router.db_for_read(Session)) or HttpResponse())(
+            self.factory.get('/')
+        )
+        self.assertEqual(seen, ['default'])
+        self.assertEqual(router.db_for_read(Story), 'default')
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ConsumerConnectionTest(TransactionTestCase):
+    async def test_sockets_share_one_connection(self):
+        """Joining and leaving from many sockets neither opens a connection each nor loses updates"""
+        owner = await User.objects.acreate(username='host')
+        story = await Story.objects.acreate(title='Crowded', initial_prompt='Everyone came.', created_by=owner)
+        users = [await User.objects.acreate(username=f'guest{index}') for index in range(5)]
+        
+        opened = []
+        def count(sender, connection, **kwargs):
+            opened.append(connection.alias)
+        connection_created.connect(count)
+        try:
+            sockets = [story_socket(story, user) for user in users]
+            for communicator in sockets:
+                await communicator.send_input({'type': 'websocket.connect'})
+                self.assertEqual((await communicator.receive_output(5))['type'], 'websocket.accept')
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+        finally:
+            connection_created.disconnect(count)
+        
+        self.assertLessEqual(len(opened), 1)
+        sessions = {
+            username: is_active async for username, is_active in
+            WritingSession.objects.filter(story=story).values_list('user__username', 'is_active')
+        }
+        self.assertEqual(sessions, {'guest0': True, 'guest1': True, 'guest2': True, 'guest3': True, 'guest4': False})
+        for communicator in sockets[:-1]:
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+        
+    async def test_recycling_is_throttled(self):
+        """Consumer handlers check the shared connection at most once per interval"""
+        now = [1000.0]
+        with mock.patch.object(collab_db, '_recycled_at', float('-inf')), \
+                mock.patch.object(collab_db, 'close_old_connections') as close_old:
+            await collab_db.recycle_connections(clock=lambda: now[0])
+            now[0] += 1
+            await collab_db.recycle_connections(clock=lambda: now[0])
+            now[0] += collab_db.RECYCLE_INTERVAL
+            await collab_db.recycle_connections(clock=lambda: now[0])
+        self.assertEqual(close_old.call_count, 2)
+
+
+class AsyncStoryViewTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass123')
+        self.story = Story.objects.create(title='Async Story', initial_prompt='Bells rang.', created_by=self.user)
+        StoryNode.objects.create(story=self.story, author=self.user, content='A second bell answered.')
+        
+    def test_story_detail_reads_concurrently(self):
+        """The async story page makes its independent reads on the shared read pool"""
+        url = reverse('stories:story_detail', args=[self.story.id])
+        self.assertIs(resolve(url).func, async_views.story_detail)
+        
+        threads = set()
+        pooled_read = collab_db._pooled_read
+        closed_on = set()
+        close_all = collab_db.connections.close_all
+        
+        def record_thread(read):
+            threads.add(threading.current_thread())
+            return pooled_read(read)
+        
+        def record_close():
+            closed_on.add(threading.current_thread())
+            close_all()
+        
+        self.client.force_login(self.user)
+        with mock.patch.object(collab_db, '_pooled_read', record_thread), \
+                mock.patch.object(collab_db.connections, 'close_all', record_close):
+            response = self.client.get(url)
+            self.client.get(url)
+        self.assertContains(response, 'A second bell answered.')
+        self.assertEqual(response.context['contributor_count'], 1)
+        self.assertTrue(threads)
+        self.assertTrue(all(thread.name.startswith('collabstory-read') for thread in threads))
+        self.assertLessEqual(len(threads), settings.ASYNC_READ_THREADS)
+        # The pool threads outlive the request and keep their connections
+        self.assertFalse(threads & closed_on)
+        self.assertTrue(WritingSession.objects.filter(story=self.story, user=self.user, is_active=True).exists())
+        
+    async def test_async_views_require_login(self):
+        """Anonymous requests are redirected to the login page"""
+        for name in ('story_detail', 'get_ai_suggestion'):
+            response = await self.async_client.get(reverse(f'stories:{name}', args=[self.story.id]))
+            self.assertEqual(response.status_code, 302)
+            self.assertIn('?next=', response.url)
+        
+    def test_sync_story_detail_renders_the_same_page(self):
+        """The sync view, served when ASYNC_VIEWS is off, still renders the page"""
+        from . import views
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.session = {}
+        response = views.story_detail(request, self.story.id)
+        self.assertContains(response, 'A second bell answered.')
+
+
+def cover_bytes(size=(1600, 900), image_format='JPEG', exif=True):
+    """An image with an EXIF artist and orientation tag"""
+    from PIL import Image
+    image = Image.new('RGB', size, (200, 40, 40))
+    output = io.BytesIO()
+    options = {}
+    if exif:
+        tags = Image.Exif()
+        tags[0x013B] = 'Somebody'  # Artist
+        tags[0x0112] = 6  # Orientation: rotate 90 degrees
+        options['exif'] = tags.tobytes()
+    image.save(output, image_format, **options)
+    return output.getvalue()
+
+
+class CoverImageTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username='illustrator', password='testpass123')
+        
+    def test_render_strips_metadata_and_fits_sizes(self):
+        """Derivatives come in every format and fitting size, without EXIF and upright"""
+        from PIL import Image
+        (extension, original), derivatives = render_cover(cover_bytes(size=(900, 1600)), cover_config())
+        self.assertEqual(extension, 'jpg')
+        with Image.open(io.BytesIO(original)) as image:
+            self.assertEqual(image.size, (1600, 900))
+            self.assertFalse(image.getexif())
+        self.assertEqual(
+            sorted((output_format, width, height) for output_format, width, height, _ in derivatives),
+            [('JPEG', 360, 200), ('JPEG', 720, 400), ('JPEG', 1080, 600),
+             ('WEBP', 360, 200), ('WEBP', 720, 400), ('WEBP', 1080, 600)]
+        )
+        for output_format, width, height, data in derivatives:
+            with Image.open(io.BytesIO(data)) as image:
+                self.assertEqual((image.format, image.size), (output_format, (width, height)))
+                self.assertFalse(image.getexif())
+        
+    def test_form_rejects_non_images_and_oversized_uploads(self):
+        """Uploads are checked before they are stored"""
+        data = {'title': 'Covered', 'genre': 'other', 'initial_prompt': 'Dust.', 'max_contributors': 5}
+        fake = SimpleUploadedFile('cover.jpg', b'not an image', content_type='image/jpeg')
+        self.assertIn('cover_image', StoryForm(data, {'cover_image': fake}).errors)
+        with override_settings(COVER_IMAGES={'MAX_UPLOAD_SIZE': 100}):
+            upload = SimpleUploadedFile('cover.jpg', cover_bytes(), content_type='image/jpeg')
+            self.assertIn('cover_image', StoryForm(data, {'cover_image': upload}).errors)
+        upload = SimpleUploadedFile('cover.jpg', cover_bytes(), content_type='image/jpeg')
+        self.assertTrue(StoryForm(data, {'cover_image': upload}).is_valid())
+        
+    def test_upload_is_processed_in_the_background(self):
+        """Creating a story queues the cover job, which replaces the upload and fills srcset"""
+        self.client.force_login(self.user)
+        # Stored sideways with an orientation tag, so upright it is 1600x900
+        upload = SimpleUploadedFile('cover.jpg', cover_bytes(size=(900, 1600)), content_type='image/jpeg')
+        with mock.patch('stories.views.submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('stories:create_story'), {
+                'title': 'Covered', 'genre': 'other', 'initial_prompt': 'Dust.', 'max_contributors': 5,
+                'is_public': True, 'cover_image': upload,
+            })
+        story = Story.objects.get(title='Covered')
+        task, story_id, name = submit.call_args.args
+        self.assertEqual((story_id, name), (story.id, story.cover_image.name))
+        self.assertFalse(story.cover_sources)
+        
+        # Files are released once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            task(story_id, name)
+        story.refresh_from_db()
+        self.assertNotEqual(story.cover_image.name, name)
+        self.assertFalse(os.path.exists(os.path.join(self.media.name, name)))
+        sources = story.cover_sources
+        self.assertEqual(sources['webp'].count('w, '), 2)
+        self.assertTrue(sources['src'].endswith('.jpg'))
+        response = self.client.get(reverse('stories:story_list'))
+        self.assertContains(response, 'type="image/webp"')
+        
+        # A job queued for a cover that has since been replaced does nothing
+        self.assertFalse(task(story_id, name))
+        
+    def test_deleting_a_story_releases_its_cover_files(self):
+        """Files shared with another story stay until neither uses them"""
+        stories = []
+        for index in range(2):
+            story = Story.objects.create(title=f'Twin {index}', initial_prompt='Dust.', created_by=self.user)
+            story.cover_image.save('cover.png', ContentFile(cover_bytes(image_format='PNG', exif=False)))
+            stories.append(story)
+        path = stories[0].cover_image.path
+        self.assertEqual(stories[0].cover_image.name, stories[1].cover_image.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            stories[0].delete()
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            stories[1].delete()
+        self.assertFalse(os.path.exists(path))
+        
+    def test_backfill_processes_existing_covers_in_a_pool(self):
+        """process_covers renders every unprocessed cover"""
+        for index in range(2):
+            story = Story.objects.create(title=f'Old {index}', initial_prompt='Dust.', created_by=self.user)
+            story.cover_image.save(f'old{index}.png', ContentFile(cover_bytes(image_format='PNG', exif=False)))
+        out = StringIO()
+        call_command('process_covers', workers=2, stdout=out)
+        self.assertIn('Processed 2 of 2 covers', out.getvalue())
+        for story in Story.objects.filter(title__startswith='Old'):
+            self.assertTrue(story.cover_image.name.endswith('.png'))
+            self.assertEqual(len(story.cover_derivatives['webp']), 3)
+
+
+class MediaStorageTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.storage = ContentAddressedStorage(location=self.media.name, base_url='/media/')
+
+    def test_identical_content_is_stored_once(self):
+        """Saving the same bytes twice adds a reference to a single file"""
+        first = self.storage.save('a.TXT', ContentFile(b'same bytes'))
+        second = self.storage.save('elsewhere/b.txt', ContentFile(b'same bytes'))
+        self.assertEqual(first, second)
+        self.assertTrue(is_content_name(first))
+        self.assertTrue(first.endswith('.txt'))
+        self.assertEqual(MediaBlob.objects.get(name=first).reference_count, 2)
+        self.assertEqual(os.listdir(os.path.join(self.media.name, 'content', 'tmp')), [])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.storage.delete(first)
+        self.assertTrue(self.storage.exists(first))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.storage.delete(first)
+        self.assertFalse(self.storage.exists(first))
+        self.assertFalse(MediaBlob.objects.filter(name=first).exists())
+        
+    def test_media_view_marks_content_files_immutable(self):
+        """Content-addressed files are served with far-future caching, others are not"""
+        name = self.storage.save('note.txt', ContentFile(b'hello'))
+        with open(os.path.join(self.media.name, 'legacy.txt'), 'w') as file:
+            file.write('old')
+        request = RequestFactory().get('/')
+        with override_settings(MEDIA_ROOT=self.media.name):
+            response = media(request, name)
+            self.assertIn('immutable', response['Cache-Control'])
+            response = media(request, 'legacy.txt')
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header('Cache-Control'))
+
+
+class StaticPipelineTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_collected_assets_are_hashed_compressed_and_immutable(self):
+        """collectstatic writes hashed, gzipped copies that WhiteNoise serves with far-future caching"""
+        from whitenoise.middleware import WhiteNoiseMiddleware
+        manifest = {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'}
+        with override_settings(
+            STATIC_ROOT=self.directory.name, STORAGES={**settings.STORAGES, 'staticfiles': manifest}
+        ):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            url = staticfiles_storage.url('css/style.css')
+            self.assertRegex(url, r'/static/css/style\.[0-9a-f]{12}\.css$')
+            self.assertTrue(os.path.exists(os.path.join(self.directory.name, url[len('/static/'):] + '.gz')))
+            
+            middleware = WhiteNoiseMiddleware(lambda request: HttpResponse(status=404))
+            response = middleware(RequestFactory().get(url, HTTP_ACCEPT_ENCODING='gzip'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertIn('immutable', response['Cache-Control'])
+            
+    def test_check_flags_unhashed_and_unknown_asset_references(self):
+        """Templates may only reach local assets through {% static %} paths that exist"""
+        with open(os.path.join(self.directory.name, 'page.html'), 'w') as file:
+            file.write(
+                "{% load static %}\n"
+                "<link href=\"{% static 'css/style.css' %}\">\n"
+                "<script src=\"/static/js/main.js\"></script>\n"
+                "<img src=\"{% static 'img/missing.png' %}\">\n"
+            )
+        templates = [{**settings.TEMPLATES[0], 'DIRS': [self.directory.name], 'APP_DIRS': False}]
+        with override_settings(TEMPLATES=templates, BASE_DIR=self.directory.name):
+            errors = check_static_references()
+        self.assertEqual(
+            [(error.id, error.msg.split(' ')[0]) for error in errors],
+            [('CollabStory.E001', 'page.html:3'), ('CollabStory.E002', 'page.html:4')]
+        )
+        self.assertEqual(check_static_references(), [])
+
+
+class StoryExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='scribe', password='testpass123')
+        self.other = User.objects.create_user(username='hermit', password='testpass123')
+        self.story = Story.objects.create(title='The Long Road', initial_prompt='A road.', created_by=self.user)
+        self.first = StoryNode.objects.create(story=self.story, content='They set out at dawn.', author=self.user)
+        self.second = StoryNode.objects.create(
+            story=self.story, content='The bridge was gone.', author=self.other, parent_node=self.first
+        )
+        self.aside = StoryNode.objects.create(
+            story=self.story, content='Or they stayed home.', author=self.user, parent_node=self.first
+        )
+        self.client.force_login(self.user)
+
+    def download(self, export_format, **params):
+        response = self.client.get(reverse('stories:export_story', args=[self.story.id, export_format]), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_text_and_markdown_stream_every_node_in_order(self):
+        """Exports contain the prompt and each node with its author, in story order"""
+        text = self.download('txt').decode()
+        self.assertLess(text.index('A road.'), text.index('They set out'))
+        self.assertLess(text.index('The bridge was gone.\n    — hermit'), text.index('Or they stayed home.'))
+        markdown = self.download('md').decode()
+        self.assertTrue(markdown.startswith('# The Long Road'))
+        self.assertIn('*— hermit*', markdown)
+
+    def test_branch_export_follows_the_parent_chain(self):
+        """?node= exports only the path from the first node to that one"""
+        text = self.download('txt', node=self.second.id).decode()
+        self.assertIn('They set out', text)
+        self.assertIn('The bridge was gone.', text)
+        self.assertNotIn('stayed home', text)
+        other_story = Story.objects.create(title='Other', initial_prompt='.', created_by=self.user)
+        foreign = StoryNode.objects.create(story=other_story, content='Elsewhere.', author=self.user)
+        response = self.client.get(
+            reverse('stories:export_story', args=[self.story.id, 'txt']), {'node': foreign.id}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_epub_is_a_valid_package(self):
+        """The EPUB starts with an uncompressed mimetype and holds the story as XHTML"""
+        import zipfile
+        data = self.download('epub')
+        self.assertEqual(data[30:38], b'mimetype')
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(archive.namelist()[0], 'mimetype')
+            self.assertEqual(archive.getinfo('mimetype').compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(archive.read('mimetype'), b'application/epub+zip')
+            chapter = archive.read('OEBPS/story.xhtml').decode()
+        self.assertIn('<p>The bridge was gone.</p>', chapter)
+
+    def test_private_stories_of_others_cannot_be_exported(self):
+        """Only public stories and the user's own can be downloaded"""
+        hidden = Story.objects.create(title='Diary', initial_prompt='.', created_by=self.other, is_public=False)
+        response = self.client.get(reverse('stories:export_story', args=[hidden.id, 'txt']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_multi_story_export_runs_in_the_background(self):
+        """Several stories are zipped into a file by a job, skipping ones the user cannot export"""
+        import zipfile
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        second = Story.objects.create(title='Short Walk', initial_prompt='A walk.', created_by=self.user)
+        hidden = Story.objects.create(title='Diary', initial_prompt='.', created_by=self.other, is_public=False)
+        with override_settings(MEDIA_ROOT=media.name):
+            with mock.patch('stories.views.submit') as submit, self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse('stories:export_stories'),
+                    json.dumps({'story_ids': [self.story.id, second.id, hidden.id], 'format': 'md'}),
+                    content_type='application/json',
+                )
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(sorted(response.json()['story_ids']), sorted([self.story.id, second.id]))
+            task, export_id = submit.call_args.args
+            task(export_id)
+            
+            status = self.client.get(response.json()['status_url']).json()
+            self.assertEqual(status['status'], 'completed')
+            export = StoryExport.objects.get(id=export_id)
+            with export.file.open('rb') as file, zipfile.ZipFile(file) as archive:
+                self.assertEqual(sorted(archive.namelist()), ['short-walk.md', 'the-long-road.md'])
+                self.assertIn(b'The bridge was gone.', archive.read('the-long-road.md'))
+
+    def test_expired_exports_release_their_archives(self):
+        """Purged exports drop their blob reference; the file goes with the last one"""
+        from .export import run_export
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        with override_settings(MEDIA_ROOT=media.name):
+            exports = []
+            for _ in range(2):
+                export = StoryExport.objects.create(requested_by=self.user, story_ids=[self.story.id], export_format='txt')
+                run_export(export.id)
+                export.refresh_from_db()
+                exports.append(export)
+            self.assertEqual(exports[0].file.name, exports[1].file.name)
+            path = exports[0].file.path
+            StoryExport.objects.filter(id=exports[0].id).update(completed_at=timezone.now() - timedelta(days=30))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('purge_story_exports', stdout=StringIO())
+            self.assertEqual(list(StoryExport.objects.values_list('id', flat=True)), [exports[1].id])
+            self.assertEqual(MediaBlob.objects.get(name=exports[1].file.name).reference_count, 1)
+            self.assertTrue(os.path.exists(path))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('purge_story_exports', ttl_days=0, stdout=StringIO())
+            self.assertFalse(StoryExport.objects.exists())
+            self.assertFalse(MediaBlob.objects.exists())
+            self.assertFalse(os.path.exists(path))
+
+    def test_malformed_export_request_is_rejected(self):
+        """Bodies that are not a JSON object get a 400 instead of a server error"""
+        for body in ['{"story_ids": [', '[1, 2]']:
+            response = self.client.post(reverse('stories:export_stories'), body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+        self.assertFalse(StoryExport.objects.exists())
+
+    def test_command_writes_a_story_to_stdout(self):
+        """export_story prints text exports and refuses binary ones without --output"""
+        out = StringIO()
+        call_command('export_story', self.story.id, '--format', 'md', '--chunk-size', '1', stdout=out)
+        self.assertIn('The bridge was gone.', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('export_story', self.story.id, '--format', 'epub', stdout=StringIO())
+
+
+class StoryCorpusTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'corpus.jsonl.gz')
+        self.user = User.objects.create_user(username='archivist', password='testpass123')
+        self.story = Story.objects.create(title='Tree', initial_prompt='Roots.', created_by=self.user)
+        root = StoryNode.objects.create(story=self.story, content='Trunk.', author=self.user)
+        left = StoryNode.objects.create(story=self.story, content='Left.', author=self.user, parent_node=root)
+        StoryNode.objects.create(story=self.story, content='Leaf.', author=self.user, parent_node=left)
+        StoryNode.objects.create(story=self.story, content='Right.', author=self.user, parent_node=root)
+        StoryBranch.objects.create(story=self.story, parent_node=root, branch_name='Fork', created_by=self.user)
+        StoryComment.objects.create(story=self.story, node=left, user=self.user, content='Nice turn.')
+        Contribution.objects.create(story=self.story, user=self.user, nodes_created=4, words_contributed=4)
+
+    def test_round_trip_remaps_ids_and_keeps_the_tree(self):
+        """An imported story gets new ids with its parent links, branches and comments intact"""
+        call_command('export_stories', self.story.id, output=self.path, stdout=StringIO())
+        out = StringIO()
+        call_command('import_stories', self.path, chunk_size=2, batch_size=2, stdout=out)
+        self.assertIn('Imported 4 nodes', out.getvalue())
+        self.assertIn('nodes/s', out.getvalue())
+        
+        copy = Story.objects.exclude(id=self.story.id).get(title='Tree')
+        parents = {node.content: node.parent_node for node in copy.nodes.select_related('parent_node')}
+        self.assertIsNone(parents['Trunk.'])
+        self.assertEqual(parents['Leaf.'].content, 'Left.')
+        self.assertEqual(parents['Leaf.'].story_id, copy.id)
+        self.assertEqual(copy.branches.get().parent_node.content, 'Trunk.')
+        self.assertEqual(copy.comments.get().node.content, 'Left.')
+        self.assertEqual(copy.contributions.get().user, self.user)
+        self.assertEqual(copy.created_at, self.story.created_at)
+        self.assertTrue(StoryImport.objects.get().completed)
+
+    def test_failed_import_resumes_after_the_last_committed_chunk(self):
+        """Chunks before a bad line stay imported and --resume finishes without duplicates"""
+        import gzip
+        call_command('export_stories', output=self.path, stdout=StringIO())
+        with gzip.open(self.path, 'rt') as file:
+            lines = file.readlines()
+        broken = lines[:4] + ['{"type": "mystery"}\n'] + lines[5:]
+        with gzip.open(self.path, 'wt') as file:
+            file.writelines(broken)
+        with self.assertRaisesMessage(CommandError, 'Line 5'):
+            call_command('import_stories', self.path, chunk_size=2, stdout=StringIO())
+        progress = StoryImport.objects.get()
+        self.assertEqual((progress.lines_done, progress.nodes_imported), (3, 1))
+        with self.assertRaisesMessage(CommandError, '--resume'):
+            call_command('import_stories', self.path, chunk_size=2, stdout=StringIO())
+        
+        # The fixed line introduces an author this instance has not seen
+        record = json.loads(lines[4])
+        record['author'] = 'newcomer'
+        with gzip.open(self.path, 'wt') as file:
+            file.writelines(lines[:4] + [json.dumps(record) + '\n'] + lines[5:])
+        call_command('import_stories', self.path, chunk_size=2, resume=True, stdout=StringIO())
+        self.assertEqual(StoryNode.objects.count(), 8)
+        self.assertEqual(Story.objects.filter(title='Tree').count(), 2)
+        self.assertEqual(StoryComment.objects.count(), 2)
+        self.assertFalse(User.objects.get(username='newcomer').has_usable_password())
+
+        
+    def test_rows_created_between_chunks_keep_clear_of_the_import(self):
+        """Stories and nodes the site adds mid-import get ids outside the reserved range"""
+        import gzip
+        call_command('export_stories', self.story.id, output=self.path, stdout=StringIO())
+        with gzip.open(self.path, 'rt') as file:
+            progress = start_import(self.path, read_header(file.readline()))
+            added = []
+            
+            def add_rows(progress, rate):
+                story = Story.objects.create(title='Meanwhile', initial_prompt='Busy.', created_by=self.user)
+                added.append(StoryNode.objects.create(story=story, content='Posted.', author=self.user))
+            
+            import_records(file, progress, chunk_size=2, report=add_rows)
+        
+        self.assertGreater(len(added), 1)
+        copy = Story.objects.exclude(id=self.story.id).get(title='Tree')
+        self.assertEqual(copy.nodes.count(), 4)
+        imported = set(copy.nodes.values_list('id', flat=True))
+        self.assertFalse(imported & {node.id for node in added})
+        self.assertTrue(all(node.story.title == 'Meanwhile' for node in added))
+
+class StorySnapshotTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        override = override_settings(STORY_SNAPSHOTS={'DIRECTORY': self.directory.name})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username='finisher', password='testpass123')
+        self.story = Story.objects.create(title='The End', initial_prompt='Last light.', created_by=self.user)
+        StoryNode.objects.create(story=self.story, content='And so it ended.', author=self.user)
+
+    def save_story(self, **changes):
+        """Save the story and run the snapshot jobs it queues"""
+        for name, value in changes.items():
+            setattr(self.story, name, value)
+        with mock.patch('CollabStory.jobs.submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            self.story.save()
+        for call in submit.call_args_list:
+            task, *args = call.args
+            task(*args)
+        return submit
+
+    def test_completing_a_story_renders_its_snapshot(self):
+        """Only completed public stories get a snapshot, with a gzip copy"""
+        self.assertFalse(self.save_story(title='The End (draft)').called)
+        submit = self.save_story(is_completed=True)
+        self.assertEqual(submit.call_count, 1)
+        path = snapshot_path(self.story.id)
+        with open(path, encoding='utf-8') as file:
+            self.assertIn('And so it ended.', file.read())
+        self.assertTrue(os.path.exists(path + '.gz'))
+
+    def test_snapshot_is_served_without_queries(self):
+        """Readers of a completed story cost no database queries, compressed copies included"""
+        import gzip
+        self.save_story(is_completed=True)
+        url = reverse('stories:story_snapshot', args=[self.story.id])
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'And so it ended.', gzip.decompress(response.content))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['Vary'], 'Accept-Encoding')
+        self.assertEqual(not_modified['Cache-Control'], response['Cache-Control'])
+        
+        # The uncompressed body is a different representation with its own validator
+        plain = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(plain.status_code, 200)
+        self.assertNotEqual(plain['ETag'], response['ETag'])
+        self.assertNotIn('Content-Encoding', plain)
+
+    def test_reopening_or_editing_refreshes_the_snapshot(self):
+        """Edits re-render the snapshot and reopening removes it, sending readers to the live page"""
+        self.save_story(is_completed=True)
+        self.save_story(title='The Real End')
+        with open(snapshot_path(self.story.id), encoding='utf-8') as file:
+            self.assertIn('The Real End', file.read())
+        
+        self.save_story(is_completed=False)
+        self.assertFalse(os.path.exists(snapshot_path(self.story.id)))
+        response = self.client.get(reverse('stories:story_snapshot', args=[self.story.id]))
+        self.assertRedirects(response, reverse('stories:story_detail', args=[self.story.id]), fetch_redirect_response=False)
+
+    def test_snapshot_is_the_same_for_every_reader(self):
+        """The pre-rendered page carries no signed-in user's name or links"""
+        self.save_story(is_completed=True)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('stories:story_snapshot', args=[self.story.id]))
+        self.assertNotContains(response, reverse('users:logout'))
+        self.assertNotContains(response, reverse('users:login'))
+        
+    def test_rolled_back_refresh_does_not_block_the_next(self):
+        """A refresh queued by a transaction that rolled back does not count as pending"""
+        self.story.is_completed = True
+        with mock.patch('CollabStory.jobs.submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.story.save()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            self.story.save()
+        self.assertEqual(submit.call_count, 1)
+        
+    def test_build_command_writes_and_prunes(self):
+        """build_snapshots renders qualifying stories and removes stale files"""
+        Story.objects.filter(id=self.story.id).update(is_completed=True)
+        with open(os.path.join(self.directory.name, '999999.html'), 'w') as file:
+            file.write('stale')
+        out = StringIO()
+        call_command('build_snapshots', stdout=out)
+        self.assertIn('Wrote 1 snapshots and removed 1', out.getvalue())
+        self.assertTrue(os.path.exists(snapshot_path(self.story.id)))
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, '999999.html')))
@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# The hot views run on the event loop under ASGI (see async_views.py)
+hot_views = async_views if settings.ASYNC_VIEWS else views
 
 app_name = 'stories'
 
@@ -7,16 +11,26 @@ urlpatterns = [
     # Story management
     path('', views.story_list, name='story_list'),
     path('create/', views.create_story, name='create_story'),
-    path('<int:story_id>/', views.story_detail, name='story_detail'),
+    path('<int:story_id>/', hot_views.story_detail, name='story_detail'),
     path('<int:story_id>/branches/', views.story_branches, name='story_branches'),
+    path('<int:story_id>/read/', views.story_snapshot, name='story_snapshot'),
     
     # Story nodes
     path('<int:story_id>/add_node/', views.add_story_node, name='add_story_node'),
     
     # AI assistance
-    path('<int:story_id>/ai_suggestion/', views.get_ai_suggestion, name='get_ai_suggestion'),
+    path('<int:story_id>/ai_suggestion/', hot_views.get_ai_suggestion, name='get_ai_suggestion'),
+    path('<int:story_id>/ai_suggestions/', views.get_ai_suggestions_batch, name='get_ai_suggestions_batch'),
     path('ai_suggestion/<int:prompt_id>/use/', views.use_ai_suggestion, name='use_ai_suggestion'),
+    path('ai_job/<int:job_id>/', views.ai_suggestion_job, name='ai_suggestion_job'),
     path('analyze_text/', views.analyze_text, name='analyze_text'),
+    path('<int:story_id>/style/', views.story_style_report, name='story_style_report'),
+    path('<int:story_id>/style/stats/', views.story_style_stats, name='story_style_stats'),
+    
+    # Export
+    path('<int:story_id>/export.<str:export_format>', views.export_story_file, name='export_story'),
+    path('export/', views.export_stories, name='export_stories'),
+    path('export/<int:export_id>/', views.story_export, name='story_export'),
     
     # Writing sessions
     path('<int:story_id>/join/', views.join_writing_session, name='join_writing_session'),
@@ -1,16 +1,31 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
 from django.contrib import messages
 from django.db.models import Count, Q
 from django.core.paginator import Paginator
+from django.db import transaction
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from asgiref.sync import sync_to_async
 import json
-from .models import Story, StoryNode, WritingSession, AIWritingPrompt, Contribution, StoryComment
+import os
+from .models import Story, StoryNode, WritingSession, AIWritingPrompt, AISuggestionJob, Contribution, StoryComment, StyleStats, StoryExport
+from .snapshots import get_config as snapshot_config, snapshot_file
+from .export import FORMATS as EXPORT_FORMATS, branch_path_ids, export_filename, export_story, exportable_stories
 from .forms import StoryForm, StoryNodeForm, StoryCommentForm
-from ai_assistant.ai_helpers import generate_ai_suggestion, analyze_writing_style
+from .context import update_story_summaries
+from .style import record_node_style, style_metrics
+from ai_assistant.ai_helpers import analyze_writing_style, analyze_writing_style_batch
+from ai_assistant.tasks import run_suggestion_job
+from .tasks import export_stories_archive, process_cover_image, summarize_story_backlog
+from CollabStory.jobs import submit
+from CollabStory.metrics import NODES_APPENDED, VIEW_DURATION, timed
 
+@timed(VIEW_DURATION, 'story_list')
 def story_list(request):
     """Display list of public stories"""
     stories = Story.objects.filter(is_public=True, is_archived=False).order_by('-created_at')
@@ -41,10 +56,11 @@ def story_list(request):
     return render(request, 'stories/story_list.html', context)
 
 @login_required
+@timed(VIEW_DURATION, 'story_detail')
 def story_detail(request, story_id):
     """Display story detail and writing interface"""
-    story = get_object_or_404(Story, id=story_id)
-    nodes = story.nodes.all()
+    story = get_object_or_404(Story.objects.select_related('created_by'), id=story_id)
+    nodes = story.nodes.select_related('author')
     
     # Get or create writing session
     writing_session, created = WritingSession.objects.get_or_create(
@@ -60,7 +76,7 @@ def story_detail(request, story_id):
     recent_prompts = story.ai_prompts.filter(used=False)[:5]
     
     # Get story comments
-    comments = story.comments.filter(is_resolved=False)[:10]
+    comments = story.comments.filter(is_resolved=False).select_related('user')[:10]
     
     context = {
         'story': story,
@@ -69,6 +85,7 @@ def story_detail(request, story_id):
         'active_writers': active_writers,
         'recent_prompts': recent_prompts,
         'comments': comments,
+        'contributor_count': story.get_contributors().count(),
         'node_form': StoryNodeForm(),
         'comment_form': StoryCommentForm(),
     }
@@ -83,6 +100,9 @@ def create_story(request):
             story = form.save(commit=False)
             story.created_by = request.user
             story.save()
+            if story.cover_image:
+                # Resizing and metadata stripping happen in the background
+                transaction.on_commit(lambda: submit(process_cover_image, story.id, story.cover_image.name))
             
             # Create initial contribution record
             Contribution.objects.create(
@@ -142,6 +162,14 @@ def add_story_node(request, story_id):
     story.current_state = content
     story.save(update_fields=['current_state'])
     
+    # Roll nodes that left the recent window into the stored AI summaries
+    if update_story_summaries(story):
+        transaction.on_commit(lambda: submit(summarize_story_backlog, story.id))
+    
+    # Keep story and author style totals current without rereading old nodes
+    record_node_style(new_node)
+    NODES_APPENDED.inc()
+    
     return JsonResponse({
         'success': True,
         'node_id': new_node.id,
@@ -153,32 +181,88 @@ def add_story_node(request, story_id):
 
 @login_required
 def get_ai_suggestion(request, story_id):
-    """Get AI writing suggestion"""
+    """Queue an AI writing suggestion and return its job id"""
     story = get_object_or_404(Story, id=story_id)
     prompt_type = request.GET.get('type', 'continuation')
     
-    # Get recent story content for context
-    recent_nodes = story.nodes.order_by('-created_at')[:5]
-    context = "\n".join([node.content for node in recent_nodes])
+    job = AISuggestionJob.objects.create(
+        story=story,
+        requested_by=request.user,
+        prompt_type=prompt_type
+    )
+    
+    # Generation runs in the background; the result is pushed to the story
+    # room over the WebSocket and can also be polled from status_url
+    transaction.on_commit(lambda: submit(run_suggestion_job, job.id))
+    
+    return JsonResponse({
+        'job_id': job.id,
+        'status': job.status,
+        'prompt_type': prompt_type,
+        'status_url': reverse('stories:ai_suggestion_job', args=[job.id])
+    }, status=202)
+
+@login_required
+def get_ai_suggestions_batch(request, story_id):
+    """Queue one AI job that generates several suggestion types together"""
+    story = get_object_or_404(Story, id=story_id)
     
-    if not context:
-        context = story.initial_prompt
+    valid_types = [choice for choice, _ in AIWritingPrompt.PROMPT_TYPE_CHOICES]
+    requested = request.GET.getlist('types') or valid_types
+    # Accept both ?types=a&types=b and ?types=a,b
+    prompt_types = []
+    for value in requested:
+        for prompt_type in value.split(','):
+            if prompt_type in valid_types and prompt_type not in prompt_types:
+                prompt_types.append(prompt_type)
     
-    suggestion = generate_ai_suggestion(context, prompt_type, story.genre)
+    if not prompt_types:
+        return JsonResponse({'error': 'No valid prompt types requested'}, status=400)
     
-    # Save the suggestion
-    ai_prompt = AIWritingPrompt.objects.create(
+    job = AISuggestionJob.objects.create(
         story=story,
-        prompt_type=prompt_type,
-        generated_text=suggestion,
-        context=context
+        requested_by=request.user,
+        prompt_type=AISuggestionJob.BATCH,
+        prompt_types=prompt_types
     )
+    transaction.on_commit(lambda: submit(run_suggestion_job, job.id))
     
     return JsonResponse({
-        'suggestion': suggestion,
-        'prompt_id': ai_prompt.id,
-        'prompt_type': prompt_type
-    })
+        'job_id': job.id,
+        'status': job.status,
+        'prompt_types': prompt_types,
+        'status_url': reverse('stories:ai_suggestion_job', args=[job.id])
+    }, status=202)
+
+@login_required
+def ai_suggestion_job(request, job_id):
+    """Report the status of one of the user's AI suggestion jobs"""
+    job = get_object_or_404(AISuggestionJob, id=job_id, requested_by=request.user)
+    
+    data = {
+        'job_id': job.id,
+        'status': job.status,
+        'prompt_type': job.prompt_type,
+    }
+    if job.status == AISuggestionJob.STATUS_COMPLETED:
+        if job.is_batch:
+            data['suggestions'] = [
+                {
+                    'prompt_type': prompt.prompt_type,
+                    'suggestion': prompt.generated_text,
+                    'prompt_id': prompt.id,
+                }
+                for prompt in job.prompts.order_by('id')
+            ]
+        else:
+            prompt = job.prompts.first()
+            if prompt:
+                data['suggestion'] = prompt.generated_text
+                data['prompt_id'] = prompt.id
+    elif job.status == AISuggestionJob.STATUS_FAILED:
+        data['error'] = job.error or 'AI suggestion failed'
+    
+    return JsonResponse(data)
 
 @login_required
 def use_ai_suggestion(request, prompt_id):
@@ -195,6 +279,12 @@ def analyze_text(request):
     """Analyze writing style of provided text"""
     if request.method == 'POST':
         data = json.loads(request.body)
+        
+        # {"texts": [...]} analyzes a whole batch in one call
+        if isinstance(data.get('texts'), list):
+            texts = [text if isinstance(text, str) else '' for text in data['texts']]
+            return JsonResponse({'results': analyze_writing_style_batch(texts)})
+        
         text = data.get('text', '')
         
         analysis = analyze_writing_style(text)
@@ -202,6 +292,34 @@ def analyze_text(request):
     
     return JsonResponse({'error': 'Invalid request method'})
 
+@login_required
+def story_style_stats(request, story_id):
+    """Serve story-level and per-author style metrics from the running totals"""
+    story = get_object_or_404(Story, id=story_id)
+    
+    data = {'story_id': story.id, 'story': None, 'authors': {}}
+    for stats in StyleStats.objects.filter(story=story).select_related('user'):
+        if stats.user_id is None:
+            data['story'] = style_metrics(stats)
+        else:
+            data['authors'][stats.user.username] = style_metrics(stats)
+    return JsonResponse(data)
+
+@login_required
+def story_style_report(request, story_id):
+    """Analyze the writing style of every node in a story"""
+    story = get_object_or_404(Story, id=story_id)
+    node_ids, contents = [], []
+    for node_id, content in story.nodes.values_list('id', 'content'):
+        node_ids.append(node_id)
+        contents.append(content)
+    
+    results = analyze_writing_style_batch(contents)
+    return JsonResponse({
+        'story_id': story.id,
+        'nodes': [dict(result, node_id=node_id) for node_id, result in zip(node_ids, results)]
+    })
+
 @login_required
 def add_comment(request, story_id):
     """Add a comment to a story"""
@@ -362,3 +480,124 @@ def transfer_ownership(request, story_id):
         return JsonResponse({'success': True, 'message': f'Ownership transferred to {new_owner.username}'})
     except User.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'User not found'})
+
+
+async def _iterate_in_thread(blocks):
+    # Django buffers a sync iterator in full before serving it under ASGI, so
+    # each block is pulled on the request's thread instead
+    blocks = iter(blocks)
+    while (block := await sync_to_async(next)(blocks, None)) is not None:
+        yield block
+
+@login_required
+def export_story_file(request, story_id, export_format):
+    """Stream a story, or with ?node= the branch ending at that node, as txt, md or epub"""
+    if export_format not in EXPORT_FORMATS:
+        raise Http404("Unknown export format.")
+    story = get_object_or_404(
+        exportable_stories(Story.objects.select_related('created_by'), request.user), id=story_id
+    )
+    
+    node_ids = None
+    if request.GET.get('node'):
+        try:
+            node_ids = branch_path_ids(story, int(request.GET['node']))
+        except ValueError:
+            node_ids = []
+        if not node_ids:
+            raise Http404("No such node in this story.")
+    
+    blocks = export_story(story, export_format, node_ids)
+    if hasattr(request, 'scope'):
+        blocks = _iterate_in_thread(blocks)
+    response = StreamingHttpResponse(blocks, content_type=EXPORT_FORMATS[export_format][0])
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(story, export_format)}"'
+    return response
+
+@login_required
+@require_http_methods(["POST"])
+def export_stories(request):
+    """Queue a zip export of several stories and return its job id"""
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Expected a JSON object'}, status=400)
+    export_format = data.get('format', 'txt')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'error': 'Unknown export format'}, status=400)
+    try:
+        requested = [int(story_id) for story_id in data.get('story_ids', [])]
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'story_ids must be a list of ids'}, status=400)
+    story_ids = list(
+        exportable_stories(Story.objects.filter(id__in=requested), request.user).values_list('id', flat=True)
+    )
+    if not story_ids:
+        return JsonResponse({'error': 'No exportable stories requested'}, status=400)
+    
+    export = StoryExport.objects.create(
+        requested_by=request.user,
+        story_ids=story_ids,
+        export_format=export_format
+    )
+    transaction.on_commit(lambda: submit(export_stories_archive, export.id))
+    
+    return JsonResponse({
+        'export_id': export.id,
+        'status': export.status,
+        'story_ids': story_ids,
+        'status_url': reverse('stories:story_export', args=[export.id])
+    }, status=202)
+
+@login_required
+def story_export(request, export_id):
+    """Report the status of a multi-story export, with its download URL once written"""
+    export = get_object_or_404(StoryExport, id=export_id, requested_by=request.user)
+    
+    data = {
+        'export_id': export.id,
+        'status': export.status,
+        'format': export.export_format,
+    }
+    if export.status == StoryExport.STATUS_COMPLETED:
+        data['download_url'] = export.file.url
+    elif export.status == StoryExport.STATUS_FAILED:
+        data['error'] = export.error or 'Export failed'
+    
+    return JsonResponse(data)
+
+
+def story_snapshot(request, story_id):
+    """Serve a completed story's pre-rendered page from disk, without database queries"""
+    path, encoding = snapshot_file(story_id, request.headers.get('Accept-Encoding', ''))
+    try:
+        stat = os.stat(path) if path else None
+    except FileNotFoundError:
+        # Removed since the check above
+        stat = None
+    if stat is None:
+        # Not completed (or not rendered yet): the live page
+        return redirect('stories:story_detail', story_id=story_id)
+    
+    response = HttpResponse(content_type='text/html; charset=utf-8')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = f"public, max-age={snapshot_config()['MAX_AGE']}"
+    # Each encoding is a different body, so each gets its own validator
+    response['ETag'] = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}-{encoding or "identity"}"'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    # A 304 copies Vary and Cache-Control from the response it stands in for
+    conditional = get_conditional_response(
+        request, etag=response['ETag'], last_modified=int(stat.st_mtime), response=response
+    )
+    if conditional is not response:
+        return conditional
+    try:
+        with open(path, 'rb') as file:
+            response.content = file.read()
+    except FileNotFoundError:
+        return redirect('stories:story_detail', story_id=story_id)
+    return response